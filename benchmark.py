@@ -0,0 +1,399 @@
+"""Бенчмарк конвертера фидов Яндекс → Авито
+
+Генерирует синтетический фид Яндекс.Недвижимости нужного размера,
+раздает его локальным HTTP-сервером и прогоняет AutoFeedConverter.convert_feed
+с замерами по стадиям, скоростью и пиковой памятью.
+
+Примеры:
+    python benchmark.py --sizes 1k,10k,100k,1m
+    python benchmark.py --sizes 10k --workers 4 --output bench_results.json
+    python benchmark.py --sizes 10k --compare bench_results.json
+"""
+import argparse
+import functools
+import http.server
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import xml.sax.saxutils
+
+REALTY_NS = 'http://webmaster.yandex.ru/schemas/feed/realty/2010-06'
+CONVERTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'main (3).py')
+
+DISTRICTS = ['Центральный', 'Ленинский', 'Советский', 'Кировский',
+             'Октябрьский', 'Заречный']
+ROOMS = ['studio', '1', '1', '2', '2', '3', '4', '5']
+DESCRIPTION_WORDS = ['светлая', 'просторная', 'квартира', 'с', 'видом', 'на',
+                     'парк', 'рядом', 'школа', 'и', 'детский', 'сад',
+                     'отличная', 'транспортная', 'доступность', 'метро']
+
+
+def parse_size(value):
+    """Разбираем размер вида 1000, 10k или 1m"""
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith('k'):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith('m'):
+        multiplier, value = 1000000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def generate_feed(path, count, jk_count=50, images_per_offer=10,
+                  new_flat_ratio=0.6, no_jk_ratio=0.05, seed=1):
+    """Пишем синтетический фид Яндекс.Недвижимости на count объявлений
+
+    jk_count - число разных ЖК, images_per_offer - среднее число фото,
+    new_flat_ratio - доля новостроек, no_jk_ratio - доля объявлений без
+    building-name.
+    """
+    rnd = random.Random(seed)
+    escape = xml.sax.saxutils.escape
+    with open(path, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<realty-feed xmlns="{REALTY_NS}">\n')
+        f.write('  <generation-date>2024-01-01T00:00:00+03:00'
+                '</generation-date>\n')
+        for i in range(count):
+            jk = rnd.randrange(jk_count)
+            new_flat = rnd.random() < new_flat_ratio
+            floors_total = rnd.randint(5, 30)
+            words = rnd.choices(DESCRIPTION_WORDS, k=rnd.randint(20, 80))
+            description = escape('<p>' + ' '.join(words) + '</p>')
+            parts = [
+                f'  <offer internal-id="{i}">',
+                '<type>продажа</type><property-type>жилая</property-type>'
+                '<category>квартира</category>',
+                '<creation-date>2024-01-01T00:00:00+03:00</creation-date>',
+                '<location><country>Россия</country>'
+                '<locality-name>Город</locality-name>'
+                f'<district>{rnd.choice(DISTRICTS)}</district>'
+                f'<address>улица {rnd.randint(1, 300)}</address></location>',
+                '<sales-agent><name>Отдел продаж</name>'
+                f'<phone>8 (900) {rnd.randint(100, 999)}-'
+                f'{rnd.randint(10, 99)}-{rnd.randint(10, 99)}</phone>'
+                '</sales-agent>',
+                f'<price><value>{rnd.randint(3, 30) * 500000}</value>'
+                '<currency>RUR</currency></price>',
+                f'<area><value>{rnd.randint(20, 150)}</value>'
+                '<unit>кв. м</unit></area>',
+                f'<floor>{rnd.randint(1, floors_total)}</floor>',
+                f'<floors-total>{floors_total}</floors-total>',
+                f'<rooms>{rnd.choice(ROOMS)}</rooms>',
+                f'<new-flat>{"true" if new_flat else "false"}</new-flat>',
+            ]
+            if rnd.random() >= no_jk_ratio:
+                parts.append(f'<building-name>ЖК "Квартал {jk}"'
+                             '</building-name>')
+            parts.append(f'<description>{description}</description>')
+            for k in range(rnd.randint(0, images_per_offer * 2)):
+                parts.append(f'<image>https://img.example.com/{i}/{k}.jpg'
+                             '</image>')
+            parts.append('</offer>\n')
+            f.write(''.join(parts))
+        f.write('</realty-feed>\n')
+
+
+def generate_jk_settings(jk_count, configured_ratio=0.5, seed=1):
+    """Настройки для части ЖК синтетического фида"""
+    rnd = random.Random(seed)
+    settings = {}
+    for jk in range(jk_count):
+        if rnd.random() >= configured_ratio:
+            continue
+        settings[f'ЖК Квартал {jk}'] = {
+            'photos': [f'https://photos.example.com/jk{jk}/{k}.jpg'
+                       for k in range(5)],
+            'description': 'Квартира в ЖК {jk_name}: {rooms} комн., '
+                           '{square} м², этаж {floor}/{floors}.',
+            'price_modifier': rnd.choice(['+3%', '+100000', '']),
+            'development_id': str(100000 + jk),
+            'building_id': str(200000 + jk) if jk % 2 else ''
+        }
+    return settings
+
+
+class StubFeedServer:
+    """Локальный HTTP-сервер, раздающий файлы каталога"""
+
+    def __init__(self, directory):
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    def url(self, name):
+        return f'http://127.0.0.1:{self.server.server_port}/{name}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubImageServer(StubFeedServer):
+    """Локальный HTTP-сервер ссылок на фото для проверки ImageChecker
+
+    Ответ выбирается по имени файла: ok - 200, missing - 404, error - 500,
+    slow - ответ позже delay секунд, nohead - 405 на HEAD и 206 на GET.
+    Запросы копятся в requests как (метод, путь).
+    """
+
+    def __init__(self, delay=2.0):
+        self.requests = []
+        handler = functools.partial(_ImageHandler, self)
+        self.delay = delay
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+
+class _ImageHandler(http.server.BaseHTTPRequestHandler):
+
+    def __init__(self, stub, *args, **kwargs):
+        self.stub = stub
+        super().__init__(*args, **kwargs)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        self.stub.requests.append((self.command, self.path))
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        if name == 'slow':
+            time.sleep(self.stub.delay)
+        status = {
+            'missing': 404,
+            'error': 500,
+            'nohead': 405 if self.command == 'HEAD' else 206
+        }.get(name, 200)
+        body = b'x' if send_body and status < 400 else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_converter_module(workdir):
+    """Импортируем модуль конвертера с рабочим каталогом workdir"""
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location('main', CONVERTER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['main'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure_ad_memory(converter, feed_path, count=2000):
+    """Средний объем памяти на одно сконвертированное объявление
+
+    Держим в памяти результаты convert_offer для первых count объявлений
+    фида и делим прирост памяти на их число.
+    """
+    with open(feed_path, 'rb') as f:
+        fields = [converter.extract_offer_fields(offer)
+                  for offer, _ in zip(converter.iter_offers(f), range(count))]
+    tracemalloc.start()
+    ads = [converter.convert_offer(offer_fields) for offer_fields in fields]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return round(allocated / len(ads)) if ads else 0
+
+
+def run_case(args):
+    """Один замер в отдельном процессе, чтобы пик памяти был честным"""
+    workdir = args.workdir
+    with open(os.path.join(workdir, 'jk_settings.json'), 'w',
+              encoding='utf-8') as f:
+        json.dump(generate_jk_settings(args.jk_count), f, ensure_ascii=False)
+
+    with StubFeedServer(os.path.dirname(args.feed)) as server:
+        with open(os.path.join(workdir, 'feed_config.json'), 'w',
+                  encoding='utf-8') as f:
+            json.dump({
+                'yandex_url': server.url(os.path.basename(args.feed)),
+                'auto_update': False,
+                'update_time': '06:00',
+                'last_update': None,
+                'feed_cache_ttl': 0,
+                'incremental': args.incremental,
+                'workers': args.workers,
+                'log_level': 'info'
+            }, f)
+
+        # Вывод конвертера в консоль не нужен, результат пишем в stdout
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        module = load_converter_module(workdir)
+        converter = module.converter
+
+        runs = []
+        for attempt in range(2 if args.incremental else 1):
+            started = time.perf_counter()
+            stats = converter.convert_feed(manual=True)
+            wall = time.perf_counter() - started
+            if not stats:
+                raise SystemExit('Конвертация завершилась ошибкой')
+            run = converter.run_history.recent(1)[0]
+            runs.append({
+                'kind': 'warm' if attempt else 'cold',
+                'wall': round(wall, 4),
+                'cpu': run['cpu'],
+                'offers_per_sec': round(stats['total'] / wall, 1),
+                'offers': stats['total'],
+                'reused': stats['reused'],
+                'errors': stats['errors'],
+                'output_bytes': os.path.getsize(converter.output_file),
+                'stages': run['stages']
+            })
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    json.dump({
+        'runs': runs,
+        'peak_rss_mb': round(peak_kb / 1024, 1),
+        'ad_bytes': measure_ad_memory(converter, args.feed)
+    }, real_stdout)
+
+
+def run_size(size, args, feeds_dir):
+    feed_path = os.path.join(feeds_dir, f'feed_{size}.xml')
+    started = time.perf_counter()
+    generate_feed(feed_path, size, jk_count=args.jk_count,
+                  images_per_offer=args.images,
+                  new_flat_ratio=args.new_flat_ratio)
+    generation_time = time.perf_counter() - started
+
+    workdir = tempfile.mkdtemp(prefix='bench_run_')
+    try:
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child',
+            '--feed', feed_path, '--workdir', workdir,
+            '--workers', str(args.workers), '--jk-count', str(args.jk_count)
+        ]
+        if args.incremental:
+            command.append('--incremental')
+        output = subprocess.run(command, check=True, capture_output=True,
+                                text=True).stdout
+        result = json.loads(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result.update({
+        'size': size,
+        'feed_bytes': os.path.getsize(feed_path),
+        'generation_time': round(generation_time, 2)
+    })
+    return result
+
+
+def print_result(result, baseline=None):
+    line = f"{result['size']:>8} {result.get('ad_bytes', 0):>10} bytes/ad"
+    if baseline and baseline.get('ad_bytes'):
+        change = result['ad_bytes'] / baseline['ad_bytes'] - 1
+        line += f"  ({change:+.1%} vs baseline)"
+    print(line)
+    for run in result['runs']:
+        line = (f"{result['size']:>8} {run['kind']:<4} "
+                f"{run['offers_per_sec']:>10.0f} offers/s "
+                f"{run['wall']:>8.2f} s  peak {result['peak_rss_mb']:>7.1f} MB")
+        if baseline:
+            old = next((r for r in baseline['runs']
+                        if r['kind'] == run['kind']), None)
+            if old:
+                change = run['offers_per_sec'] / old['offers_per_sec'] - 1
+                line += f"  ({change:+.1%} vs baseline)"
+        print(line)
+        stages = ', '.join(f"{name} {stage['wall']:.2f}s"
+                           for name, stage in run['stages'].items()
+                           if stage['wall'])
+        print(f"{'':>14}{stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1k,10k',
+                        help='размеры фида через запятую (1k,10k,100k,1m)')
+    parser.add_argument('--jk-count', type=int, default=50)
+    parser.add_argument('--images', type=int, default=10,
+                        help='среднее число фото в объявлении')
+    parser.add_argument('--new-flat-ratio', type=float, default=0.6)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--incremental', action='store_true',
+                        help='замерить также повторный запуск с кэшем')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='файл прошлых результатов')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--feed', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_case(args)
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = {r['size']: r for r in json.load(f)['results']}
+
+    feeds_dir = tempfile.mkdtemp(prefix='bench_feeds_')
+    results = []
+    try:
+        for size in [parse_size(s) for s in args.sizes.split(',')]:
+            result = run_size(size, args, feeds_dir)
+            print_result(result, baseline.get(size))
+            results.append(result)
+            # Фид большого размера больше не нужен
+            os.remove(os.path.join(feeds_dir, f'feed_{size}.xml'))
+    finally:
+        shutil.rmtree(feeds_dir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': {
+            'jk_count': args.jk_count,
+            'images': args.images,
+            'new_flat_ratio': args.new_flat_ratio,
+            'workers': args.workers,
+            'incremental': args.incremental
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
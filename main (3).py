@@ -1,612 +1,4004 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response, abort
+from werkzeug.wsgi import wrap_file
 import urllib.request
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 import threading
 import time
-import schedule
 from collections import Counter
 import re
+import hashlib
+import tempfile
+import shutil
+import urllib.error
+import sqlite3
+import multiprocessing
+import atexit
+import functools
+import string
+import random
+import uuid
+import pickle
+import copy
+import urllib.parse
+import http.client
+import base64
+import ssl
+import zlib
+import gzip
+import io
+import mmap
+from contextlib import ExitStack, closing
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 app = Flask(__name__)
 
+# Версия логики конвертации: при изменении кэш объявлений сбрасывается
+CONVERSION_VERSION = 2
 
-class AutoFeedConverter:
+# Уровни логов; debug - подробности по каждому объявлению
+LOG_LEVELS = {'debug': 10, 'info': 20, 'success': 25, 'warning': 30, 'error': 40}
 
-    def __init__(self):
-        self.ns = {
-            'realty': 'http://webmaster.yandex.ru/schemas/feed/realty/2010-06'
-        }
-        self.config_file = 'feed_config.json'
-        self.jk_settings_file = 'jk_settings.json'
-        self.output_file = 'avito_feed.xml'
-        self.log_file = 'conversion_log.json'
+PHONE_JUNK = re.compile(r'[^\d+]')
+HTML_TAG = re.compile(r'<[^>]+>')
+DATE_BEGIN = re.compile(rb'<DateBegin>[^<]*</DateBegin>')
 
-        self.load_config()
-        self.load_jk_settings()
-        self.load_logs()
 
-        # Запускаем планировщик в отдельном потоке
-        self.start_scheduler()
+# Телефоны, описания и наборы фото в фиде сильно повторяются: одно
+# описание и телефон отдела продаж на сотни объявлений, один набор фото
+# на ЖК. Нормализация кэшируется по значению, LRU ограничивает память.
+@functools.lru_cache(maxsize=4096)
+def normalize_phone(phone):
+    """Телефон в формате +7XXXXXXXXXX"""
+    if not phone:
+        return '+79999999999'
 
-    def load_config(self):
-        """Загружаем основную конфигурацию"""
+    clean = PHONE_JUNK.sub('', phone)
+
+    if clean.startswith('8'):
+        return '+7' + clean[1:]
+    elif clean.startswith('7'):
+        return '+' + clean
+    elif clean.startswith('+7'):
+        return clean
+    else:
+        return '+7' + clean
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_description(desc):
+    """Описание без HTML-тегов и лишних пробелов, не длиннее 7500"""
+    if not desc:
+        return 'Продается квартира'
+
+    clean = HTML_TAG.sub('', desc)
+    clean = ' '.join(clean.split())
+    return clean[:7500] if len(clean) > 7500 else clean
+
+
+def xml_escape(text):
+    """Экранируем XML"""
+    if not text:
+        return ''
+    return (str(text).replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&quot;'))
+
+
+@functools.lru_cache(maxsize=4096)
+def render_images(images):
+    """Блок <Images> для набора фото (кортежа URL, не больше 40)"""
+    xml_parts = ['    <Images>']
+    for img_url in images:
+        xml_parts.append(f'      <Image url="{xml_escape(img_url)}"/>')
+    xml_parts.append('    </Images>')
+    return '\n'.join(xml_parts)
+
+
+class ValueInterner:
+    """Общие экземпляры повторяющихся значений полей объявлений
+
+    Одинаковые строки и наборы фото разных объявлений хранятся в одном
+    экземпляре: меньше памяти в буферах пачек, pickle кэша разбора пишет
+    повторы ссылками, а кэши нормализации находят значение без
+    повторного хэширования строки. При переполнении словарь очищается.
+    """
+
+    def __init__(self, limit=100000):
+        self.values = {}
+        self.limit = limit
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        interned = self.values.get(value)
+        if interned is None:
+            if len(self.values) >= self.limit:
+                self.values.clear()
+            self.values[value] = interned = value
+        return interned
+
+    def clear(self):
+        self.values.clear()
+
+
+class OfferFields:
+    """Поля объявления Яндекса, нужные для конвертации"""
+
+    __slots__ = ('offer_id', 'source_id', 'phone', 'description', 'price',
+                 'area', 'floor', 'floors_total', 'rooms', 'new_flat',
+                 'building_name', 'development_name', 'district', 'images')
+
+    def __init__(self, offer_id=None, source_id=None):
+        self.offer_id = offer_id
+        # id объявления в фиде; None, если offer_id придуман конвертером
+        self.source_id = source_id
+        self.phone = None
+        self.description = None
+        self.price = None
+        self.area = None
+        self.floor = None
+        self.floors_total = None
+        self.rooms = None
+        self.new_flat = None
+        self.building_name = None
+        self.development_name = None
+        self.district = None
+        self.images = ()
+
+
+class AvitoAd:
+    """Объявление Авито с фиксированным набором полей
+
+    Вместо словаря на каждое объявление: слоты заметно компактнее.
+    Значения по умолчанию - заглушки обязательных полей Авито; None -
+    поле не выводится.
+    """
+
+    __slots__ = ('id', 'date_begin', 'contact_phone', 'description',
+                 'price', 'property_rights', 'square', 'floor', 'floors',
+                 'rooms', 'market_type', 'house_type', 'status',
+                 'new_development_id', 'finish_type', 'images')
+
+    def __init__(self, ad_id=''):
+        self.id = ad_id
+        self.date_begin = None
+        self.contact_phone = '+79999999999'
+        self.description = 'Продается квартира'
+        self.price = '1000000'
+        self.property_rights = 'Посредник'
+        self.square = None
+        self.floor = None
+        self.floors = None
+        self.rooms = None
+        self.market_type = 'Вторичка'
+        self.house_type = None
+        self.status = 'Квартира'
+        self.new_development_id = None
+        self.finish_type = None
+        self.images = ()
+
+    def text(self, name):
+        """Значение поля для шаблона описания ('' если не задано)"""
+        value = getattr(self, name)
+        return '' if value is None else value
+
+
+class UpstreamResponse:
+    """Ответ upstream с потоковой распаковкой gzip/deflate
+
+    Тело читается кусками и распаковывается по мере чтения, не больше
+    запрошенного размера за раз. bytes_transferred - получено по сети,
+    bytes_decoded - отдано после распаковки.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, response, url, connection=None):
+        self.response = response
+        self.url = url
+        self.connection = connection
+        self.status = getattr(response, 'status', None) or 200
+        self.reason = getattr(response, 'reason', '')
+        self.headers = response.headers
+        self.encoding = (self.headers.get('Content-Encoding') or
+                         'identity').strip().lower()
+        if self.encoding in ('gzip', 'x-gzip'):
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            # zlib-обертка или "сырой" deflate - видно по первым байтам
+            self.decoder = None
+        elif self.encoding == 'identity':
+            self.encoding = None
+        else:
+            raise ValueError(f"неподдерживаемое сжатие ответа: {self.encoding}")
+        self.bytes_transferred = 0
+        self.bytes_decoded = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.CHUNK_SIZE), b''))
+        if size == 0:
+            return b''
+        if self.encoding is None:
+            data = self.response.read(size)
+            self.bytes_transferred += len(data)
+        else:
+            data = b''
+            while not data and not self.eof:
+                data = self._decode(size)
+        self.bytes_decoded += len(data)
+        return data
+
+    def _decode(self, size):
+        if self.decoder is not None and self.decoder.unconsumed_tail:
+            return self.decoder.decompress(self.decoder.unconsumed_tail, size)
+        raw = self.response.read(self.CHUNK_SIZE)
+        if not raw:
+            self.eof = True
+            return self.decoder.flush() if self.decoder is not None else b''
+        self.bytes_transferred += len(raw)
+        if self.decoder is None:
+            zlib_header = (len(raw) >= 2 and raw[0] & 0x0F == 8
+                           and int.from_bytes(raw[:2], 'big') % 31 == 0)
+            self.decoder = zlib.decompressobj(
+                zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+        return self.decoder.decompress(raw, size)
+
+    def close(self):
+        self.response.close()
+        if self.connection is not None:
+            self.connection.close()
+
+
+class UpstreamClient:
+    """Загрузка фидов по HTTP(S) на http.client
+
+    Отдельные таймауты на соединение и на чтение, ограниченные повторы
+    с экспоненциальной задержкой при сетевых ошибках и ответах 429/5xx,
+    редиректы вручную, сжатие gzip/deflate при передаче. Повторяется
+    только установка соединения и получение заголовков: оборванное
+    посреди тела чтение завершается ошибкой; ошибки проверки сертификата
+    не повторяются. Прокси берутся из окружения (HTTP(S)_PROXY,
+    NO_PROXY), как в urllib. Прочие схемы (file://) открываются через
+    urllib.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    MAX_REDIRECTS = 5
+    MAX_DELAY = 30.0
+    USER_AGENT = 'AvitoFeedConverter/1.0'
+
+    def __init__(self,
+                 connect_timeout=10,
+                 read_timeout=60,
+                 retries=3,
+                 backoff=1.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.ssl_context = ssl.create_default_context()
+
+    def open(self, url, headers=None, stats=None):
+        """Открываем url: UpstreamResponse с кодом 2xx или 304
+
+        На остальные коды - urllib.error.HTTPError. В stats считаются
+        повторы (retries) и редиректы (redirects).
+        """
+        headers = dict(headers or {})
+        if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+            return UpstreamResponse(
+                urllib.request.urlopen(urllib.request.Request(url,
+                                                              headers=headers),
+                                       timeout=self.read_timeout), url)
+
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                response = self._follow(url, headers, stats)
+            except ssl.SSLCertVerificationError:
+                # Сертификат не станет верным от повтора
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            else:
+                if response.status < 400:
+                    return response
+                response.close()
+                error = urllib.error.HTTPError(response.url, response.status,
+                                               response.reason,
+                                               response.headers, None)
+                if response.status not in self.RETRY_STATUSES:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+            if attempt == self.retries:
+                raise error
+            if stats is not None:
+                stats['retries'] += 1
+            time.sleep(self.delay(attempt, retry_after))
+
+    def delay(self, attempt, retry_after=None):
+        """Пауза перед повтором: Retry-After или экспонента со случайностью"""
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), self.MAX_DELAY)
+        return min(self.backoff * 2**attempt, self.MAX_DELAY) * random.uniform(
+            0.5, 1.0)
+
+    def _follow(self, url, headers, stats):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = self._request(url, headers)
+            if response.status not in self.REDIRECT_STATUSES:
+                return response
+            location = response.headers.get('Location')
+            response.close()
+            if not location:
+                raise ValueError(f"редирект {response.status} без Location")
+            url = urllib.parse.urljoin(url, location)
+            if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+                raise ValueError(f"недопустимый редирект на {url}")
+            if stats is not None:
+                stats['redirects'] += 1
+        raise ValueError(f"слишком много редиректов, последний на {url}")
+
+    @staticmethod
+    def proxy_for(parts):
+        """Прокси для адреса из окружения, как в urllib, или None"""
+        proxy = urllib.request.getproxies().get(parts.scheme)
+        if not proxy or urllib.request.proxy_bypass(parts.netloc):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return urllib.parse.urlsplit(proxy)
+
+    def _request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        proxy = self.proxy_for(parts)
+        proxy_headers = {}
+        if proxy is not None and proxy.username:
+            credentials = (f'{urllib.parse.unquote(proxy.username)}:'
+                           f'{urllib.parse.unquote(proxy.password or "")}')
+            proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(
+                credentials.encode('utf-8')).decode('ascii')
+
+        host, port = parts.hostname, parts.port
+        if proxy is not None:
+            host, port = proxy.hostname, proxy.port or 80
+        if parts.scheme == 'https':
+            connection = http.client.HTTPSConnection(
+                host, port, timeout=self.connect_timeout,
+                context=self.ssl_context)
+            if proxy is not None:
+                # Через прокси HTTPS идет туннелем CONNECT
+                connection.set_tunnel(parts.hostname, parts.port,
+                                      headers=proxy_headers)
+                proxy_headers = {}
+        else:
+            connection = http.client.HTTPConnection(
+                host, port, timeout=self.connect_timeout)
+        if proxy is not None and parts.scheme == 'http':
+            # HTTP-прокси получает полный адрес в строке запроса
+            path = urllib.parse.urlunsplit(parts._replace(fragment=''))
+        else:
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
         try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
-            print(f"✅ Конфигурация загружена: {self.config}")
-        except Exception as e:
-            print(f"⚠️ Создаем новую конфигурацию: {e}")
-            self.config = {
-                'yandex_url': '',
-                'auto_update': False,
-                'update_time': '06:00',
-                'last_update': None
-            }
+            connection.connect()
+            connection.sock.settimeout(self.read_timeout)
+            connection.request(
+                'GET', path, headers={
+                    'User-Agent': self.USER_AGENT,
+                    'Accept-Encoding': 'gzip, deflate',
+                    **proxy_headers,
+                    **headers
+                })
+            return UpstreamResponse(connection.getresponse(), url, connection)
+        except BaseException:
+            connection.close()
+            raise
+
+
+class FeedStream:
+    """Поток тела фида с попутной записью в кэш и учетом трафика"""
+
+    def __init__(self, source, stats, cache_tmp=None, on_complete=None,
+                 content_hash=None):
+        self.source = source
+        self.stats = stats
+        self.cache_tmp = cache_tmp
+        self.on_complete = on_complete
+        self.complete = False
+        self.metrics = None
+        # Хэш содержимого известен заранее для фида из кэша, иначе
+        # считается по мере чтения и появляется в stats в конце
+        stats['content_hash'] = content_hash
+        self.hasher = hashlib.sha256() if content_hash is None else None
+
+    def read(self, size=-1):
+        if self.metrics is not None:
+            self.metrics.start('fetch')
+        started = time.perf_counter()
+        try:
+            data = self.source.read(size)
+        finally:
+            self.stats['fetch_time'] += time.perf_counter() - started
+            if self.metrics is not None:
+                self.metrics.stop()
+
+        if data:
+            self.stats['bytes_read'] += len(data)
+            if self.hasher is not None:
+                self.hasher.update(data)
+            if self.metrics is not None:
+                self.metrics.add('fetch', bytes=len(data))
+            if self.cache_tmp is not None:
+                self.cache_tmp.write(data)
+                self.stats['bytes_downloaded'] += len(data)
+                self.stats['bytes_transferred'] = (
+                    self.source.bytes_transferred)
+        elif size != 0 and not self.complete:
+            self.complete = True
+            if self.hasher is not None:
+                self.stats['content_hash'] = self.hasher.hexdigest()
+        return data
+
+    def close(self):
+        self.source.close()
+        if self.cache_tmp is not None:
+            self.cache_tmp.close()
+            if self.complete:
+                self.on_complete(self.cache_tmp.name)
+            else:
+                # Тело прочитано не полностью - в кэш его не кладем
+                os.remove(self.cache_tmp.name)
 
-    def save_config(self):
-        """Сохраняем конфигурацию"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FeedFetcher:
+    """Загрузка фида Яндекса с условными запросами и кэшем на диске"""
+
+    def __init__(self, cache_dir='feed_cache'):
+        self.cache_dir = cache_dir
+        self.url_locks = {}
+        self.lock = threading.Lock()
+        self.client = UpstreamClient()
+
+    def _url_lock(self, url):
+        with self.lock:
+            return self.url_locks.setdefault(url, threading.Lock())
+
+    def _cache_paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.xml', base + '.json'
+
+    def _load_meta(self, url):
+        body_path, meta_path = self._cache_paths(url)
+        if not os.path.exists(body_path):
+            return None
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=2)
-            print(f"✅ Конфигурация сохранена")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения конфигурации: {e}")
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def open(self, url, ttl=0, client=None):
+        """Открываем фид: из кэша (TTL или 304) либо загружая заново
+
+        client - UpstreamClient с таймаутами и повторами профиля.
+        Возвращает FeedStream, в stats которого после чтения лежит
+        статистика загрузки и сэкономленный трафик: bytes_transferred
+        получено по сети, bytes_downloaded - после распаковки.
+        """
+        client = client or self.client
+        body_path, meta_path = self._cache_paths(url)
+        meta = self._load_meta(url)
+        stats = {
+            'url': url,
+            'status': 'downloaded',
+            'bytes_downloaded': 0,
+            'bytes_transferred': 0,
+            'content_encoding': None,
+            'retries': 0,
+            'redirects': 0,
+            'bytes_saved': 0,
+            'fetch_time': 0.0,
+            'time_saved': 0.0,
+            'bytes_read': 0,
+            'bytes_total': None
+        }
 
-    def load_jk_settings(self):
-        """Загружаем настройки ЖК"""
+        if meta and ttl and time.time() - meta['fetched_at'] < ttl:
+            return self._open_cached(body_path, meta, stats, 'cached')
+
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        started = time.perf_counter()
+        response = client.open(url, headers, stats)
+        stats['fetch_time'] = time.perf_counter() - started
+        if response.status == 304 and meta:
+            response.close()
+            meta['fetched_at'] = time.time()
+            self._save_meta(meta_path, meta)
+            return self._open_cached(body_path, meta, stats, 'not_modified')
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_tmp = tempfile.NamedTemporaryFile(dir=self.cache_dir,
+                                                suffix='.tmp',
+                                                delete=False)
+        headers = response.headers
+        stats['content_encoding'] = response.encoding
+        # При сжатии Content-Length - размер сжатого тела, а не фида
+        if (response.encoding is None
+                and (headers.get('Content-Length') or '').isdigit()):
+            stats['bytes_total'] = int(headers['Content-Length'])
+
+        def on_complete(tmp_path):
+            os.replace(tmp_path, body_path)
+            self._save_meta(
+                meta_path, {
+                    'url': url,
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified'),
+                    'fetched_at': time.time(),
+                    'size': stats['bytes_downloaded'],
+                    'transferred': stats['bytes_transferred'],
+                    'sha256': stats['content_hash'],
+                    'download_time': stats['fetch_time']
+                })
+
+        return FeedStream(response, stats, cache_tmp, on_complete)
+
+    def fetch(self, url, ttl=0, client=None):
+        """Загружаем фид в кэш целиком и открываем его из кэша
+
+        Нужна для параллельной загрузки нескольких источников: поток
+        загрузки не ждет, пока разбор дойдет до его фида. Одновременные
+        загрузки одного URL (например, из разных профилей) выполняются
+        по очереди, и вторая берет результат первой из кэша.
+        """
+        with self._url_lock(url):
+            with self.open(url, ttl, client) as feed:
+                while feed.read(1024 * 1024):
+                    pass
+            stats = feed.stats
+            body_path = self._cache_paths(url)[0]
+            stats['bytes_read'] = 0
+            stats['bytes_total'] = os.path.getsize(body_path)
+            return FeedStream(open(body_path, 'rb'), stats,
+                              content_hash=stats['content_hash'])
+
+    def _open_cached(self, body_path, meta, stats, status):
+        stats['status'] = status
+        stats['bytes_saved'] = meta.get('transferred', meta.get('size', 0))
+        stats['bytes_total'] = os.path.getsize(body_path)
+        stats['time_saved'] = max(
+            0.0, meta.get('download_time', 0.0) - stats['fetch_time'])
+        return FeedStream(open(body_path, 'rb'),
+                          stats,
+                          content_hash=meta.get('sha256'))
+
+    def _save_meta(self, meta_path, meta):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, meta_path)
+
+
+class ParsedFeedCache:
+    """Общий кэш разобранных фидов
+
+    Поля объявлений разобранного фида сохраняются пачками pickle рядом
+    с кэшем загрузок под хэшем содержимого фида. Профиль, которому
+    нужен тот же фид, читает готовые поля вместо повторного разбора XML.
+    """
+
+    def __init__(self, cache_dir='feed_cache', chunk_size=1000):
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+
+    def _path(self, content_hash):
+        return os.path.join(self.cache_dir,
+                            f'{content_hash}.v{CONVERSION_VERSION}.records')
+
+    def load(self, content_hash):
+        """Поля объявлений фида из кэша или None"""
+        if not content_hash:
+            return None
         try:
-            if os.path.exists(self.jk_settings_file):
-                with open(self.jk_settings_file, 'r', encoding='utf-8') as f:
-                    self.jk_settings = json.load(f)
-                print(
-                    f"✅ Загружены настройки ЖК: {len(self.jk_settings)} элементов"
-                )
-            else:
-                self.jk_settings = {}
-                print("⚠️ Файл настроек ЖК не найден, создаем пустой")
-        except Exception as e:
-            print(f"❌ Ошибка загрузки настроек ЖК: {e}")
-            self.jk_settings = {}
+            f = open(self._path(content_hash), 'rb')
+        except FileNotFoundError:
+            return None
+        return self._iter_records(f)
 
-    def save_jk_settings(self):
-        """Сохраняем настройки ЖК"""
+    def _iter_records(self, f):
+        with f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                yield from chunk
+
+    def record(self, records, stats):
+        """Пропускаем поля объявлений дальше, попутно сохраняя их в кэш
+
+        Записанное сохраняется, только если фид прочитан до конца и
+        известен хэш его содержимого.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(dir=self.cache_dir,
+                                          suffix='.tmp',
+                                          delete=False)
+        saved = False
         try:
-            os.makedirs(os.path.dirname(os.path.abspath(
-                self.jk_settings_file)),
-                        exist_ok=True)
-
-            with open(self.jk_settings_file, 'w', encoding='utf-8') as f:
-                json.dump(self.jk_settings, f, ensure_ascii=False, indent=2)
-            print(
-                f"✅ Настройки ЖК сохранены: {len(self.jk_settings)} элементов")
-
-            if os.path.exists(self.jk_settings_file):
-                size = os.path.getsize(self.jk_settings_file)
-                print(f"✅ Файл создан, размер: {size} байт")
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= self.chunk_size:
+                    pickle.dump(chunk, tmp, pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+                yield record
+            pickle.dump(chunk, tmp, pickle.HIGHEST_PROTOCOL)
+            tmp.close()
+
+            if stats.get('content_hash'):
+                path = self._path(stats['content_hash'])
+                os.replace(tmp.name, path)
+                saved = True
+                self.prune(keep=path)
+        finally:
+            if not saved:
+                tmp.close()
+                os.remove(tmp.name)
+
+    def prune(self, keep=None):
+        """Удаляем разборы фидов, которых больше нет в кэше загрузок"""
+        names = os.listdir(self.cache_dir)
+        keep_names = {os.path.basename(keep)} if keep else set()
+        for name in names:
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.cache_dir, name), 'r',
+                              encoding='utf-8') as f:
+                        content_hash = json.load(f).get('sha256')
+                except Exception:
+                    continue
+                if content_hash:
+                    keep_names.add(os.path.basename(self._path(content_hash)))
+
+        for name in names:
+            if name.endswith('.records') and name not in keep_names:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+
+class OfferCache:
+    """Кэш готовых фрагментов <Ad> для инкрементальной конвертации
+
+    Для каждого объявления хранится хэш исходных полей, версия настроек
+    его ЖК и отрендеренный фрагмент. Работает в рамках одного запуска:
+    записи, не встреченные в фиде, удаляются в finish().
+    """
+
+    def __init__(self, db_file):
+        self.run_id = time.time_ns()
+        self.db = sqlite3.connect(db_file)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS offers (
+                id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                jk_version TEXT NOT NULL,
+                date_begin TEXT NOT NULL,
+                custom INTEGER NOT NULL,
+                fragment TEXT NOT NULL,
+                run_id INTEGER NOT NULL
+            )''')
+
+    def get(self, offer_id, content_hash, jk_version, date_begin):
+        """Возвращаем (фрагмент, с настройками ЖК) или None"""
+        row = self.db.execute(
+            'SELECT content_hash, jk_version, date_begin, custom, fragment '
+            'FROM offers WHERE id = ?', (offer_id, )).fetchone()
+        if not row or row[0] != content_hash or row[1] != jk_version:
+            return None
+
+        self.db.execute('UPDATE offers SET run_id = ? WHERE id = ?',
+                        (self.run_id, offer_id))
+        fragment = row[4]
+        if row[2] != date_begin:
+            # Дата публикации - единственное, что меняется между запусками
+            fragment = fragment.replace(f'<DateBegin>{row[2]}</DateBegin>',
+                                        f'<DateBegin>{date_begin}</DateBegin>',
+                                        1)
+        return fragment, bool(row[3])
+
+    def put(self, offer_id, content_hash, jk_version, date_begin, custom,
+            fragment):
+        self.db.execute(
+            'INSERT OR REPLACE INTO offers VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (offer_id, content_hash, jk_version, date_begin, int(custom),
+             fragment, self.run_id))
+
+    def finish(self):
+        """Удаляем пропавшие из фида объявления и фиксируем изменения"""
+        self.db.execute('DELETE FROM offers WHERE run_id != ?',
+                        (self.run_id, ))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class FeedDelta:
+    """Сравнение объявлений нового фида с последним опубликованным
+
+    Снимок опубликованного фида хранится в SQLite: для каждого
+    объявления хэш фрагмента <Ad> без DateBegin (дата меняется каждый
+    день) и значения полей для отчета; описание и фото - кратко, с
+    хэшем. Объявления сравниваются по Id и хэшу по мере генерации, после
+    публикации снимок обновляется в commit().
+    """
+
+    REPORT_LIMIT = 500
+    FIELD_PATTERN = re.compile(r'^\s*<(\w+)>(.*)</\1>$', re.M)
+    IMAGE_PATTERN = re.compile(r'<Image url="([^"]*)"/>')
+
+    def __init__(self, db_file, date_begin, layout):
+        self.db = sqlite3.connect(db_file)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS ads (
+                id TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                fields TEXT NOT NULL
+            )''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )''')
+        self.previous = dict(self.db.execute('SELECT id, hash FROM ads'))
+        self.previous_meta = dict(
+            self.db.execute('SELECT key, value FROM meta'))
+        self.date_line = f'<DateBegin>{date_begin}</DateBegin>'
+        # Раскладка вывода: при ее смене фид публикуется заново
+        self.layout = json.dumps(layout, sort_keys=True)
+        self.sequence = hashlib.sha256()
+        self.seen = set()
+        self.added = []
+        self.changes = []
+        self.changed_count = 0
+
+    def track(self, converted):
+        """Пропускаем (фрагмент, ЖК) дальше, попутно сравнивая с прошлым"""
+        for fragment, jk_name in converted:
+            self.add(fragment, jk_name)
+            yield fragment, jk_name
+
+    def add(self, fragment, jk_name=None):
+        start = fragment.find('<Id>') + 4
+        ad_id = fragment[start:fragment.find('</Id>', start)]
+        digest = hashlib.sha1(
+            fragment.replace(self.date_line, '', 1).encode('utf-8')).hexdigest()
+        # ЖК определяет шард объявления, поэтому входит в последовательность
+        self.sequence.update(
+            f'{ad_id}\x00{digest}\x00{jk_name or ""}\x00'.encode('utf-8'))
+        self.seen.add(ad_id)
+
+        previous = self.previous.get(ad_id)
+        if previous == digest:
+            return
+        fields = self.parse_fields(fragment)
+        if previous is None:
+            self.added.append(ad_id)
+        else:
+            self.changed_count += 1
+            if len(self.changes) < self.REPORT_LIMIT:
+                row = self.db.execute('SELECT fields FROM ads WHERE id = ?',
+                                      (ad_id, )).fetchone()
+                old_fields = json.loads(row[0]) if row else {}
+                self.changes.append({
+                    'id': ad_id,
+                    'fields': {
+                        name: {
+                            'old': old_fields.get(name),
+                            'new': fields.get(name)
+                        }
+                        for name in sorted(set(old_fields) | set(fields))
+                        if old_fields.get(name) != fields.get(name)
+                    }
+                })
+        # Изменения фиксируются только вместе с публикацией (commit)
+        self.db.execute('INSERT OR REPLACE INTO ads VALUES (?, ?, ?)',
+                        (ad_id, digest, json.dumps(fields,
+                                                   ensure_ascii=False)))
+
+    def parse_fields(self, fragment):
+        """Поля фрагмента <Ad> для отчета (без DateBegin)"""
+        fields = {}
+        for name, value in self.FIELD_PATTERN.findall(fragment):
+            if name == 'DateBegin':
+                continue
+            if name == 'Description':
+                value = (f"{len(value)} симв., "
+                         f"{hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]}")
+            fields[name] = value
+        images = self.IMAGE_PATTERN.findall(fragment)
+        if images:
+            fields['Images'] = (
+                f"{len(images)} фото, "
+                f"{hashlib.sha1(' '.join(images).encode('utf-8')).hexdigest()[:8]}")
+        return fields
+
+    def removed(self):
+        return [ad_id for ad_id in self.previous if ad_id not in self.seen]
+
+    def unchanged(self):
+        """Совпадает ли новый фид с опубликованным (кроме DateBegin)
+
+        Учитывается порядок объявлений, их ЖК (шард) и раскладка вывода.
+        """
+        return (not self.added and not self.changed_count
+                and len(self.seen) == len(self.previous)
+                and self.previous_meta.get('sequence')
+                == self.sequence.hexdigest()
+                and self.previous_meta.get('layout') == self.layout)
+
+    def commit(self):
+        """Новый фид опубликован - он становится снимком для сравнения"""
+        self.db.executemany('DELETE FROM ads WHERE id = ?',
+                            ((ad_id, ) for ad_id in self.removed()))
+        self.db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('sequence', self.sequence.hexdigest()),
+            ('layout', self.layout),
+            ('published_at', datetime.now().isoformat()),
+        ])
+        self.db.commit()
+
+    def report(self, published):
+        """Отчет об изменениях (списки id ограничены REPORT_LIMIT)"""
+        removed = self.removed()
+        limit = self.REPORT_LIMIT
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'previous_published_at': self.previous_meta.get('published_at'),
+            'published': published,
+            'total': len(self.seen),
+            'added': len(self.added),
+            'removed': len(removed),
+            'changed': self.changed_count,
+            'unchanged': len(self.seen) - len(self.added) -
+            self.changed_count,
+            'added_ids': self.added[:limit],
+            'removed_ids': removed[:limit],
+            'changes': self.changes,
+            'truncated': max(len(self.added), len(removed),
+                             self.changed_count) > limit
+        }
+
+    def close(self):
+        self.db.close()
+
+
+class ImageChecker:
+    """Проверка ссылок на фото с кэшем результатов на диске
+
+    Ссылки проверяются HEAD-запросами параллельно в пуле потоков, ответ
+    по каждой хранится в SQLite ttl секунд - ссылка проверяется не чаще
+    раза в сутки. Мертвой считается ссылка с ответом 4xx; таймауты, 5xx
+    и сетевые ошибки не повод выкидывать фото, такие ссылки остаются и
+    проверяются в следующий раз.
+    """
+
+    USER_AGENT = 'AvitoFeedConverter/1.0'
+
+    def __init__(self, db_file, ttl=86400, workers=16, timeout=5.0,
+                 known_limit=50000):
+        self.db = sqlite3.connect(db_file)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                alive INTEGER NOT NULL,
+                checked_at REAL NOT NULL
+            )''')
+        self.ttl = ttl
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        # Недавно проверенные в этом запуске ссылки: url -> жива ли.
+        # LRU ограниченного размера, остальное берется из кэша SQLite
+        self.known = OrderedDict()
+        self.known_limit = known_limit
+        self.stats = {
+            'checked': 0,
+            'cached': 0,
+            'failed': 0,
+            'dead': 0,
+            'dropped': 0
+        }
+
+    def probe(self, url):
+        """True - ссылка жива, False - мертва, None - проверить не удалось"""
+        for method in ('HEAD', 'GET'):
+            headers = {'User-Agent': self.USER_AGENT}
+            if method == 'GET':
+                # Сервер не поддерживает HEAD - просим первый байт
+                headers['Range'] = 'bytes=0-0'
+            try:
+                req = urllib.request.Request(url,
+                                             headers=headers,
+                                             method=method)
+                with urllib.request.urlopen(req, timeout=self.timeout):
+                    return True
+            except urllib.error.HTTPError as e:
+                e.close()
+                if method == 'HEAD' and e.code in (405, 501):
+                    continue
+                if 400 <= e.code < 500 and e.code not in (408, 429):
+                    return False
+                return None
+            except Exception:
+                return None
+
+    def check(self, urls):
+        """Возвращаем множество мертвых ссылок среди urls"""
+        now = time.time()
+        todo = []
+        batch = {}
+        for url in dict.fromkeys(urls):
+            alive = self.known.get(url)
+            if alive is not None:
+                self.known.move_to_end(url)
+                batch[url] = alive
+                continue
+            row = self.db.execute(
+                'SELECT alive, checked_at FROM images WHERE url = ?',
+                (url, )).fetchone()
+            if row and now - row[1] < self.ttl:
+                self.stats['cached'] += 1
+                batch[url] = self.remember(url, bool(row[0]))
             else:
-                print("❌ Файл не создался!")
+                todo.append(url)
+
+        if todo:
+            for url, alive in zip(todo, self.pool.map(self.probe, todo)):
+                self.stats['checked'] += 1
+                if alive is None:
+                    self.stats['failed'] += 1
+                    batch[url] = self.remember(url, True)
+                    continue
+                batch[url] = self.remember(url, alive)
+                self.db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?)',
+                                (url, int(alive), now))
+            self.db.commit()
+        return frozenset(url for url, alive in batch.items() if not alive)
+
+    def remember(self, url, alive):
+        self.known[url] = alive
+        if len(self.known) > self.known_limit:
+            self.known.popitem(last=False)
+        if not alive:
+            self.stats['dead'] += 1
+        return alive
+
+    def filter_offers(self, records, batch_size=200):
+        """Убираем из объявлений мертвые фото, проверяя ссылки пачками
+
+        Поля объявлений могут быть еще не сохранены в кэш разбора, поэтому
+        для объявлений с мертвыми фото отдаются копии полей.
+        """
+        batch = []
+        for fields in records:
+            batch.append(fields)
+            if len(batch) >= batch_size:
+                yield from self.filter_batch(batch)
+                batch = []
+        yield from self.filter_batch(batch)
+
+    def filter_batch(self, batch):
+        dead = self.check([url for fields in batch for url in fields.images])
+        for fields in batch:
+            if dead and not dead.isdisjoint(fields.images):
+                images = tuple(url for url in fields.images
+                               if url not in dead)
+                self.stats['dropped'] += len(fields.images) - len(images)
+                fields = copy.copy(fields)
+                fields.images = images
+            yield fields
+
+    def close(self):
+        self.pool.shutdown()
+        self.db.close()
+
+
+class JkSettingsError(ValueError):
+    """Настройки ЖК не прошли проверку и не сохранены"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = list(errors)
+
+
+class JsonSettingsStore:
+    """Настройки ЖК в одном JSON-файле (прежний формат)
+
+    Любое изменение перезаписывает файл целиком, правки из разных
+    процессов не согласуются. Версия - время изменения файла.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
 
+    def version(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def update(self, jk_name, changes, validate=None):
+        """Дополняем настройки ЖК изменениями и сохраняем
+
+        validate получает итоговые настройки и может отменить сохранение
+        исключением. Возвращает сохраненные настройки.
+        """
+        with self.lock:
+            all_settings = self.load_all()
+            settings = {**all_settings.get(jk_name, {}), **changes}
+            if validate is not None:
+                validate(settings)
+            all_settings[jk_name] = settings
+            self._write(all_settings)
+            return settings
+
+    def import_settings(self, imported, replace=False):
+        with self.lock:
+            all_settings = {} if replace else self.load_all()
+            all_settings.update(imported)
+            self._write(all_settings)
+
+    def _write(self, all_settings):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(all_settings, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class SqliteSettingsStore:
+    """Настройки ЖК в SQLite: по строке на ЖК и общий счетчик версий
+
+    База в режиме WAL: чтение не блокирует запись. Изменение одного ЖК -
+    одна транзакция (чтение, слияние, запись), поэтому правки разных ЖК
+    из разных процессов не затирают друг друга. Счетчик версий растет
+    при каждом изменении и дешево проверяется.
+    """
+
+    def __init__(self, path, import_path=None):
+        self.path = path
+        # Постоянное соединение только для дешевой проверки версии
+        self.version_db = None
+        self.version_lock = threading.Lock()
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS jk_settings (
+                    name TEXT PRIMARY KEY,
+                    settings TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                )''')
+            db.execute('''CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )''')
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)")
+
+        # Первый запуск: переносим настройки из прежнего JSON-файла
+        if (import_path and os.path.exists(import_path)
+                and self.version() == 0):
+            with open(import_path, 'r', encoding='utf-8') as f:
+                self.import_settings(json.load(f))
+            print(f"✅ Настройки ЖК перенесены из {import_path} в {path}")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def load_all(self):
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT name, settings FROM jk_settings')
+            return {name: json.loads(settings) for name, settings in rows}
+
+    def version(self):
+        with self.version_lock:
+            if self.version_db is None:
+                self.version_db = sqlite3.connect(self.path, timeout=10,
+                                                  isolation_level=None,
+                                                  check_same_thread=False)
+            return self.version_db.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def update(self, jk_name, changes, validate=None):
+        """Дополняем настройки ЖК изменениями и сохраняем
+
+        validate получает итоговые настройки и может отменить сохранение
+        исключением. Возвращает сохраненные настройки.
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(
+                    'SELECT settings FROM jk_settings WHERE name = ?',
+                    (jk_name, )).fetchone()
+                settings = {**(json.loads(row[0]) if row else {}), **changes}
+                if validate is not None:
+                    validate(settings)
+                self._upsert(db, jk_name, settings)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return settings
+
+    def import_settings(self, imported, replace=False):
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                if replace:
+                    db.execute('DELETE FROM jk_settings')
+                for jk_name, settings in imported.items():
+                    self._upsert(db, jk_name, settings)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def _upsert(self, db, jk_name, settings):
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        db.execute(
+            'INSERT INTO jk_settings VALUES (?, ?, '
+            "(SELECT value FROM meta WHERE key = 'version'), ?) "
+            'ON CONFLICT(name) DO UPDATE SET settings = excluded.settings, '
+            'version = excluded.version, updated_at = excluded.updated_at',
+            (jk_name, json.dumps(settings, ensure_ascii=False),
+             datetime.now().isoformat()))
+
+
+class LogSink:
+    """Хранилище логов: кольцевой буфер для интерфейса и JSONL на диске
+
+    Записи добавляются в файл пачками фоновым потоком, файл только
+    дописывается и ротируется по размеру. Записи других процессов
+    дочитываются с запомненного смещения.
+    """
+
+    def __init__(self, path, legacy_path=None, capacity=100,
+                 flush_interval=1.0, batch_size=500,
+                 max_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        # Записи, уже лежащие в файле, и еще не дописанные
+        self.recent_entries = deque(maxlen=capacity)
+        self.pending = []
+        # Сколько байт файла уже прочитано и какой это файл (ротация)
+        self.offset = 0
+        self.file_id = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        self._load(legacy_path)
+
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _load(self, legacy_path):
+        """Восстанавливаем последние записи после перезапуска"""
+        try:
+            if os.path.exists(self.path):
+                self.reload()
+            elif legacy_path and os.path.exists(legacy_path):
+                with open(legacy_path, 'r', encoding='utf-8') as f:
+                    self.recent_entries.extend(json.load(f))
         except Exception as e:
-            print(f"❌ Ошибка сохранения настроек ЖК: {e}")
-            import traceback
-            traceback.print_exc()
+            print(f"⚠️ Не удалось загрузить логи: {e}")
 
-    def load_logs(self):
-        """Загружаем логи конвертации"""
-        try:
-            with open(self.log_file, 'r', encoding='utf-8') as f:
-                self.logs = json.load(f)
-        except:
-            self.logs = []
+    def reload(self):
+        """Дочитываем записи, дописанные в файл после прошлого чтения
 
-    def save_logs(self):
-        """Сохраняем логи"""
-        with open(self.log_file, 'w', encoding='utf-8') as f:
-            json.dump(self.logs, f, ensure_ascii=False, indent=2)
+        Читаются только новые строки, в том числе других процессов;
+        после ротации новый файл читается с начала.
+        """
+        with self.flush_lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    file_id = (stat.st_dev, stat.st_ino)
+                    if file_id != self.file_id or stat.st_size < self.offset:
+                        self.file_id, self.offset = file_id, 0
+                    f.seek(self.offset)
+                    data = f.read()
+            except FileNotFoundError:
+                # Файл ротирован и новый еще не создан
+                self.file_id, self.offset = None, 0
+                return
+            except Exception as e:
+                print(f"⚠️ Не удалось перечитать логи: {e}")
+                return
+
+            # Недописанную последнюю строку оставляем до следующего раза
+            data = data[:data.rfind(b'\n') + 1]
+            self.offset += len(data)
+            entries = []
+            for line in deque(data.splitlines(),
+                              maxlen=self.recent_entries.maxlen):
+                try:
+                    entries.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    continue
+            with self.lock:
+                self.recent_entries.extend(entries)
+
+    def add(self, entry):
+        with self.lock:
+            self.pending.append(entry)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+
+    def recent(self, count):
+        """Последние count записей, от старых к новым"""
+        with self.lock:
+            entries = list(self.recent_entries) + self.pending[-count:]
+        return entries[-count:]
+
+    def flush(self):
+        """Дописываем накопленные записи в файл"""
+        with self.flush_lock:
+            with self.lock:
+                batch = list(self.pending)
+            if not batch:
+                return
 
-    def add_log(self, message, level='info'):
-        """Добавляем запись в лог"""
-        log_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'message': message,
-            'level': level
+            try:
+                data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n'
+                               for entry in batch).encode('utf-8')
+                # Одна запись на пачку: дописывания из разных процессов
+                # не перемешиваются
+                with open(self.path, 'ab') as f:
+                    stat = os.fstat(f.fileno())
+                    start = stat.st_size
+                    f.write(data)
+                    f.flush()
+                    end = f.tell()
+                with self.lock:
+                    del self.pending[:len(batch)]
+                    file_id = (stat.st_dev, stat.st_ino)
+                    if self.file_id is None and self.offset == start == 0:
+                        # Файл только что создан этой записью
+                        self.file_id = file_id
+                    if (file_id == self.file_id and start == self.offset
+                            and end == start + len(data)):
+                        # Между чтением и записью никто не дописывал,
+                        # иначе записи подхватит reload()
+                        self.recent_entries.extend(batch)
+                        self.offset = end
+                if end > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                    with self.lock:
+                        self.file_id, self.offset = None, 0
+            except Exception as e:
+                print(f"❌ Ошибка записи логов: {e}")
+                with self.lock:
+                    del self.pending[:len(batch)]
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+
+class RunMetrics:
+    """Замеры стадий одного запуска конвертации
+
+    Стадии вложены друг в друга (запись тянет конвертацию, та - разбор,
+    разбор - загрузку), поэтому каждой стадии засчитывается только ее
+    собственное время, без времени вложенных стадий.
+    """
+
+    STAGES = ('fetch', 'parse', 'extract', 'images', 'convert', 'write',
+              'cache')
+
+    def __init__(self):
+        self.stages = {
+            name: {'wall': 0.0, 'cpu': 0.0, 'bytes': 0, 'items': 0}
+            for name in self.STAGES
+        }
+        self.stack = []
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    def _charge(self, frame, now_wall, now_cpu):
+        stage = self.stages[frame[0]]
+        stage['wall'] += now_wall - frame[1]
+        stage['cpu'] += now_cpu - frame[2]
+        frame[1] = now_wall
+        frame[2] = now_cpu
+
+    def start(self, name):
+        now_wall, now_cpu = time.perf_counter(), time.thread_time()
+        if self.stack:
+            self._charge(self.stack[-1], now_wall, now_cpu)
+        self.stack.append([name, now_wall, now_cpu])
+
+    def stop(self):
+        now_wall, now_cpu = time.perf_counter(), time.thread_time()
+        self._charge(self.stack.pop(), now_wall, now_cpu)
+        if self.stack:
+            self.stack[-1][1] = now_wall
+            self.stack[-1][2] = now_cpu
+
+    def timed(self, iterable, name):
+        """Засчитываем стадии name время получения каждого элемента"""
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            self.stages[name]['items'] += 1
+            yield item
+
+    def add(self, name, cpu=0.0, bytes=0, items=0):
+        stage = self.stages[name]
+        stage['cpu'] += cpu
+        stage['bytes'] += bytes
+        stage['items'] += items
+
+    def report(self):
+        """Итоговые замеры: время, CPU, байты, элементы и скорость"""
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage)
+            stages[name]['wall'] = round(stage['wall'], 4)
+            stages[name]['cpu'] = round(stage['cpu'], 4)
+            stages[name]['items_per_sec'] = (round(
+                stage['items'] / stage['wall'], 1)
+                                             if stage['items'] and stage['wall']
+                                             else None)
+        return {
+            'wall': round(time.perf_counter() - self.started_wall, 4),
+            'cpu': round(time.process_time() - self.started_cpu, 4),
+            'stages': stages
         }
-        self.logs.append(log_entry)
 
-        # Храним только последние 100 записей
-        if len(self.logs) > 100:
-            self.logs = self.logs[-100:]
 
-        self.save_logs()
-        print(f"[{level.upper()}] {message}")
+class RunHistory:
+    """Ограниченная история запусков конвертации в JSON-файле"""
 
-    def get_jk_list(self):
-        """Получаем список ЖК из текущего фида"""
-        if not self.config['yandex_url']:
-            return {}
+    def __init__(self, path, limit=200):
+        self.path = path
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.load()
 
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                runs = deque(json.load(f), maxlen=self.limit)
+        except Exception:
+            runs = deque(maxlen=self.limit)
+        with self.lock:
+            self.runs = runs
+
+    def add(self, run):
+        with self.lock:
+            self.runs.append(run)
+            runs = list(self.runs)
         try:
-            with urllib.request.urlopen(self.config['yandex_url']) as response:
-                xml_content = response.read()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(runs, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения истории запусков: {e}")
+
+    def recent(self, count):
+        """Последние count запусков, от новых к старым"""
+        with self.lock:
+            runs = list(self.runs)
+        return runs[::-1][:count]
+
+
+class ConversionJob:
+    """Фоновый запуск конвертации и его прогресс"""
+
+    def __init__(self, manual, job_id=None, state='running'):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.manual = manual
+        self.state = state
+        # Запросы других процессов, присоединенные к этому запуску
+        self.request_ids = []
+        self.started_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.started = time.perf_counter()
+        self.triggers = 1
+        # Живые данные запуска, их заполняет _convert_feed
+        self.stats = None
+        self.metrics = None
+        self.fetch_stats = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, result):
+        self.state = 'done' if result else 'failed'
+        self.result = result or None
+        if not result:
+            self.error = 'Ошибка конвертации, подробности в логах'
+        self.finished_at = datetime.now().isoformat()
+        self.done.set()
+
+    def progress(self):
+        """Обработано объявлений, текущая стадия и оценка оставшегося времени
+
+        Оценка строится по доле прочитанных байт фида.
+        """
+        elapsed = time.perf_counter() - self.started
+        stage = self.state if self.state != 'running' else 'start'
+        if self.state == 'running' and self.metrics is not None:
+            stack = list(self.metrics.stack)
+            if stack:
+                stage = stack[-1][0]
+
+        offers = 0
+        if self.stats is not None:
+            offers = (self.stats['reused'] + self.stats['reconverted'] +
+                      self.stats['errors'])
+
+        bytes_read = bytes_total = percent = eta = None
+        if self.fetch_stats is not None:
+            bytes_read = sum(stats['bytes_read']
+                             for stats in self.fetch_stats)
+            if all(stats['bytes_total'] is not None
+                   for stats in self.fetch_stats):
+                bytes_total = sum(stats['bytes_total']
+                                  for stats in self.fetch_stats)
+        if self.state in ('done', 'failed'):
+            percent, eta = 100.0, 0.0
+        elif bytes_read and bytes_total:
+            fraction = min(bytes_read / bytes_total, 1.0)
+            percent = round(fraction * 100, 1)
+            eta = round(elapsed * (1 - fraction) / fraction, 1)
+
+        return {
+            'stage': stage,
+            'offers': offers,
+            'bytes_read': bytes_read,
+            'bytes_total': bytes_total,
+            'percent': percent,
+            'elapsed': round(elapsed, 1),
+            'eta': eta
+        }
 
-            root = ET.fromstring(xml_content)
-            offers = root.findall('.//realty:offer', self.ns)
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'manual': self.manual,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'triggers': self.triggers,
+            'progress': self.progress(),
+            'stats': self.result,
+            'error': self.error
+        }
 
-            jk_names = []
-            for offer in offers:
-                building_name = offer.find('.//realty:building-name', self.ns)
-                if building_name is not None and building_name.text:
-                    # Очищаем название от кавычек для упрощения
-                    jk_name = building_name.text.strip().replace('"',
-                                                                 '').replace(
-                                                                     "'", "")
-                    jk_names.append(jk_name)
+    def status(self):
+        """Состояние для других процессов: со всеми присоединенными id"""
+        return dict(self.to_dict(), ids=[self.id] + self.request_ids)
+
+
+class Scheduler:
+    """Планировщик автоматических обновлений
+
+    Следующий запуск вычисляется из текущей конфигурации: несколько
+    времен в сутки (update_times) либо интервал в минутах
+    (update_interval), плюс случайная задержка до update_jitter секунд.
+    Выбранный запуск хранится до выполнения и пересчитывается только
+    после него или по reschedule(). Запуски выполняются по очереди в
+    одном потоке и не накладываются; reschedule() будит поток сразу
+    после изменения настроек.
+    """
+
+    def __init__(self, get_config, job, clock=datetime.now):
+        self.get_config = get_config
+        self.job = job
+        self.clock = clock
+        self.wake = threading.Event()
+        self.changed = True
+        self.next_slot = None
+        self.next_run = None
+        self.last_run = None
+
+    def start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def reschedule(self):
+        """Пересчитываем следующий запуск по новой конфигурации"""
+        self.changed = True
+        self.wake.set()
+
+    @staticmethod
+    def parse_times(config):
+        """Времена ежедневного обновления в виде (час, минута)"""
+        times = config.get('update_times') or [config.get('update_time')
+                                               or '06:00']
+        parsed = set()
+        for value in times:
+            parsed.add(
+                datetime.strptime(str(value).strip(), '%H:%M').time())
+        return sorted(parsed)
+
+    def compute_next(self, config, now):
+        """Ближайшее время запуска без случайной задержки или None"""
+        if not config.get('auto_update'):
+            return None
+
+        interval = config.get('update_interval') or 0
+        if interval > 0:
+            # Отсчитываем от последнего обновления, в том числе ручного
+            last = self.last_run
+            try:
+                last_update = datetime.fromisoformat(config['last_update'])
+                last = max(last, last_update) if last else last_update
+            except (KeyError, TypeError, ValueError):
+                pass
+            if last is None:
+                return now
+            return max(last + timedelta(minutes=interval), now)
+
+        slots = [
+            datetime.combine(now.date() + timedelta(days=day), update_time)
+            for day in (0, 1) for update_time in self.parse_times(config)
+        ]
+        return min(slot for slot in slots if slot > now)
+
+    def plan(self, config, now):
+        """Выбираем следующий запуск и случайную задержку к нему
+
+        Если срок ожидающего запуска уже наступил и новая конфигурация
+        его не отменяет, он сохраняется вместе со своей задержкой.
+        """
+        slot = self.compute_next(config, now)
+        pending = self.next_slot
+        if slot is not None and pending is not None and pending <= now:
+            if (config.get('update_interval') or 0) > 0:
+                due = slot <= now
+            else:
+                due = pending.time() in self.parse_times(config)
+            if due:
+                return
+
+        # Задержку выбираем один раз на каждый запуск
+        self.next_slot = slot
+        jitter = random.uniform(0, config.get('update_jitter') or 0)
+        self.next_run = slot + timedelta(seconds=jitter) if slot else None
+
+    def step(self):
+        """Выполняем запуск, если пора; иначе возвращаем, сколько ждать"""
+        if self.changed:
+            self.changed = False
+            self.plan(self.get_config(), self.clock())
+
+        now = self.clock()
+        if self.next_run is None or self.next_run > now:
+            # Перепроверяем хотя бы раз в 5 минут на случай
+            # перевода системных часов
+            timeout = 300
+            if self.next_run is not None:
+                timeout = min((self.next_run - now).total_seconds(), timeout)
+            return timeout
+
+        self.last_run = now
+        self.next_slot = self.next_run = None
+        try:
+            self.job()
+        finally:
+            self.plan(self.get_config(), self.clock())
+        return 0
 
-            jk_counter = Counter(jk_names)
-            return dict(jk_counter.most_common())
+    def _run(self):
+        while True:
+            try:
+                self.wake.clear()
+                timeout = self.step()
+                if timeout:
+                    self.wake.wait(timeout)
+            except Exception as e:
+                print(f"Ошибка планировщика: {e}")
+                self.changed = True
+                self.wake.wait(300)
+
+
+class PublishedFeed:
+    """Опубликованная версия фида, отображенная в память
+
+    Файлы каждой версии (XML и сжатые варианты) отображаются через mmap
+    до подмены на место, поэтому обработчики запросов отдают данные без
+    stat/open и никогда не видят частично записанный фид. После
+    os.replace отображение продолжает ссылаться на свою версию, пока на
+    нее есть ссылки.
+    """
+
+    def __init__(self, meta, files):
+        self.meta = meta
+        self.bodies = {}
+        for encoding, path in files.items():
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self.bodies[encoding] = memoryview(
+                    mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                    if size else b'')
+        self.modified = datetime.fromisoformat(meta['generated_at'])
+
+    def etag(self, encoding=None):
+        if encoding:
+            return f"{self.meta['etag']}-{encoding}"
+        return self.meta['etag']
+
+
+class FeedReader(io.RawIOBase):
+    """Независимый поток чтения по телу фида для одного запроса"""
+
+    def __init__(self, body):
+        self.body = body
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.body[self.position:self.position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.body)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def fsync_directory(path):
+    """Фиксируем на диске переименования внутри каталога"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
-        except Exception as e:
-            self.add_log(f"Ошибка загрузки фида: {e}", 'error')
-            return {}
 
-    def convert_feed(self, manual=False):
-        """Основная функция конвертации"""
-        if not self.config['yandex_url']:
-            self.add_log("Не указана ссылка на фид Яндекса", 'error')
-            return False
+def write_json_atomic(path, data, **dump_args):
+    """Пишем JSON через временный файл и подменяем на месте
 
-        source = "Ручная" if manual else "Автоматическая"
-        self.add_log(f"{source} конвертация начата", 'info')
+    Временный файл свой у каждого процесса, поэтому одновременные
+    записи из нескольких воркеров не перемешиваются.
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **dump_args)
+    os.replace(tmp_path, path)
 
-        try:
-            # Загружаем фид
-            with urllib.request.urlopen(self.config['yandex_url']) as response:
-                xml_content = response.read()
 
-            root = ET.fromstring(xml_content)
-            offers = root.findall('.//realty:offer', self.ns)
+def file_version(path):
+    """Дешевая версия файла: время изменения и размер (None - нет файла)"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
-            self.add_log(f"Найдено объявлений: {len(offers)}", 'info')
 
-            # Статистика
-            stats = {
-                'total': len(offers),
-                'with_custom': 0,
-                'errors': 0,
-                'jk_configured': len(self.jk_settings)
+def take_request(path):
+    """Забираем запрос, оставленный другим процессом, или None"""
+    taken_path = f'{path}.{os.getpid()}.taken'
+    try:
+        os.rename(path, taken_path)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(taken_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(taken_path)
+
+
+class JkIndexBuilder:
+    """Накопление сводки по ЖК за один проход по фиду"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, jk_name, fields):
+        entry = self.entries.get(jk_name)
+        if entry is None:
+            entry = self.entries[jk_name] = {
+                'count': 0,
+                'rooms': Counter(),
+                'price_min': None,
+                'price_max': None
             }
+        entry['count'] += 1
 
-            avito_ads = []
+        rooms = (fields.rooms or '').strip().lower() or '?'
+        if rooms in ('studio', 'студия', '0'):
+            rooms = 'studio'
+        entry['rooms'][rooms] += 1
 
-            for offer in offers:
-                try:
-                    ad_data = self.convert_offer(offer)
-                    if ad_data:
-                        # Применяем настройки ЖК
-                        jk_name = self.get_jk_name(offer)
-
-                        if jk_name:
-                            self.add_log(
-                                f"Обрабатываем объявление из ЖК: '{jk_name}'",
-                                'info')
-
-                            if jk_name in self.jk_settings:
-                                self.add_log(
-                                    f"✅ Найдены настройки для ЖК: '{jk_name}'",
-                                    'info')
-                                ad_data = self.apply_jk_settings(
-                                    ad_data, jk_name)
-                                stats['with_custom'] += 1
-                            else:
-                                self.add_log(
-                                    f"❌ Настройки для ЖК '{jk_name}' не найдены",
-                                    'warning')
-                        else:
-                            self.add_log("ЖК не определен для объявления",
-                                         'warning')
-
-                        avito_ads.append(ad_data)
+        try:
+            price = float(fields.price)
+        except (TypeError, ValueError):
+            return
+        if entry['price_min'] is None or price < entry['price_min']:
+            entry['price_min'] = price
+        if entry['price_max'] is None or price > entry['price_max']:
+            entry['price_max'] = price
 
-                except Exception as e:
-                    stats['errors'] += 1
-                    self.add_log(f"Ошибка обработки объявления: {e}", 'error')
 
-            # Генерируем XML
-            xml_result = self.generate_avito_xml(avito_ads)
+class JkIndex:
+    """Индекс ЖК фида в JSON-файле
 
-            # Сохраняем
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                f.write(xml_result)
+    Для каждого ЖК хранятся число объявлений, разбивка по комнатам,
+    диапазон цен и время последнего появления в фиде. Индекс строится
+    попутно с конвертацией (или отдельным обновлением), поэтому список
+    ЖК отдается без загрузки фида. ЖК, пропавшие из фида, остаются в
+    индексе с in_feed=False.
+    """
 
-            # Обновляем конфигурацию
-            self.config['last_update'] = datetime.now().isoformat()
-            self.save_config()
+    SORT_FIELDS = ('name', 'count', 'price_min', 'price_max', 'last_seen')
 
-            # Логируем результат
-            message = f"Конвертация завершена: {stats['total']} объявлений, {stats['with_custom']} с настройками, {stats['errors']} ошибок"
-            self.add_log(message, 'success')
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.load()
 
-            return stats
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries, updated_at = data['entries'], data['updated_at']
+        except Exception:
+            entries, updated_at = {}, None
+        with self.lock:
+            self.entries = entries
+            self.updated_at = updated_at
+
+    def replace(self, builder):
+        """Заменяем сводку результатами нового прохода по фиду"""
+        with self.lock:
+            seen_at = datetime.now().isoformat()
+            entries = {
+                name: dict(entry, in_feed=False)
+                for name, entry in self.entries.items()
+            }
+            for name, entry in builder.entries.items():
+                entries[name] = {
+                    'name': name,
+                    'count': entry['count'],
+                    'rooms': dict(entry['rooms'].most_common()),
+                    'price_min': entry['price_min'],
+                    'price_max': entry['price_max'],
+                    'last_seen': seen_at,
+                    'in_feed': True
+                }
 
-        except Exception as e:
-            self.add_log(f"Критическая ошибка конвертации: {e}", 'error')
-            return False
+            try:
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({
+                        'updated_at': seen_at,
+                        'entries': entries
+                    },
+                              f,
+                              ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"❌ Ошибка сохранения индекса ЖК: {e}")
+            self.entries = entries
+            self.updated_at = seen_at
+
+    def search(self, query='', sort='-count'):
+        """ЖК, в названии которых есть query, в порядке sort
+
+        sort - поле из SORT_FIELDS, с префиксом '-' по убыванию. ЖК без
+        значения поля всегда идут в конце.
+        """
+        descending = sort.startswith('-')
+        field = sort.lstrip('-')
+        if field not in self.SORT_FIELDS:
+            raise ValueError(f"Неизвестная сортировка: {sort}")
+
+        query = query.strip().lower()
+        entries = [
+            entry for entry in self.entries.values()
+            if query in entry['name'].lower()
+        ]
+        entries.sort(key=lambda entry: entry['name'].lower())
+        if field == 'name':
+            if descending:
+                entries.reverse()
+            return entries
+
+        present = [entry for entry in entries if entry[field] is not None]
+        missing = [entry for entry in entries if entry[field] is None]
+        present.sort(key=lambda entry: entry[field], reverse=descending)
+        return present + missing
+
+
+class CompiledJkSettings(
+        namedtuple('CompiledJkSettings', [
+            'jk_name', 'version', 'photos', 'photo_count',
+            'description_parts', 'description_template', 'price_rule',
+            'new_development_id', 'id_source', 'errors', 'warnings'
+        ])):
+    """Настройки ЖК, разобранные один раз при загрузке или сохранении
+
+    Фото уже отфильтрованы, наценка разобрана в (вид, величина, исходная
+    строка), NewDevelopmentId выбран, шаблон описания разбит на части.
+    Ошибки и предупреждения собираются в errors/warnings.
+    """
+
+    __slots__ = ()
+
+    # Переменные шаблона описания -> поля объявления
+    DESCRIPTION_FIELDS = {
+        'rooms': 'rooms',
+        'square': 'square',
+        'floor': 'floor',
+        'floors': 'floors',
+        'price': 'price'
+    }
+
+    @classmethod
+    def compile(cls, jk_name, settings):
+        """Разбираем настройки ЖК из JSON"""
+        errors = []
+        warnings = []
 
-    def get_jk_name(self, offer):
+        # Фотографии (максимум 40 по документации Авито)
+        valid_photos = []
+        photos = settings.get('photos') or []
+        if not isinstance(photos, list):
+            errors.append("Фото должны быть списком ссылок")
+            photos = []
+        for url in photos:
+            if isinstance(url, str) and url.strip().startswith(
+                    ('http://', 'https://')):
+                valid_photos.append(url.strip())
+            else:
+                warnings.append(f"Пропущена некорректная ссылка на фото: {url}")
+        if len(valid_photos) > 40:
+            warnings.append(
+                f"Фото больше 40, будут использованы первые 40 из {len(valid_photos)}"
+            )
+
+        # Шаблон описания
+        description_parts = None
+        description_template = None
+        template = str(settings.get('description') or '')
+        if template.strip():
+            description_parts, error = cls._compile_description(
+                jk_name, template)
+            if error:
+                errors.append(f"Ошибка в шаблоне описания: {error}")
+            elif description_parts is None:
+                description_template = template
+
+        # Изменение цены
+        price_rule = None
+        modifier = str(settings.get('price_modifier') or '').strip()
+        try:
+            if modifier.endswith('%'):
+                price_rule = ('percent', float(modifier[:-1]), modifier)
+            elif modifier and modifier != '0':
+                price_rule = ('absolute', float(modifier.replace('+', '')),
+                              modifier)
+        except ValueError:
+            errors.append(f"Некорректное изменение цены: '{modifier}'")
+
+        # Логика выбора ID: корпус (приоритет) -> ЖК -> вторичка
+        building_id = str(settings.get('building_id') or '').strip()
+        development_id = str(settings.get('development_id') or '').strip()
+        if building_id and not building_id.isdigit():
+            errors.append(f"ID корпуса должен состоять из цифр: '{building_id}'")
+        if development_id and not development_id.isdigit():
+            errors.append(f"ID ЖК должен состоять из цифр: '{development_id}'")
+
+        if building_id.isdigit():
+            new_development_id, id_source = building_id, 'building'
+        elif development_id.isdigit():
+            new_development_id, id_source = development_id, 'development'
+        else:
+            new_development_id = id_source = None
+            warnings.append(
+                "Нет ID ЖК или корпуса: новостройки будут переведены во вторичку")
+
+        version = hashlib.sha1(
+            json.dumps(settings, ensure_ascii=False,
+                       sort_keys=True).encode('utf-8')).hexdigest()
+
+        return cls(jk_name, version, tuple(valid_photos[:40]),
+                   len(valid_photos), description_parts, description_template,
+                   price_rule, new_development_id, id_source, tuple(errors),
+                   tuple(warnings))
+
+    @classmethod
+    def _compile_description(cls, jk_name, template):
+        """Разбиваем шаблон на (текст, поле объявления или None)
+
+        Возвращает (части, ошибка). Для шаблонов с форматированием
+        ({price:>10} и т.п.) частей нет - они форматируются через str.format.
+        """
+        values = dict.fromkeys(cls.DESCRIPTION_FIELDS, '')
+        try:
+            parsed = list(string.Formatter().parse(template))
+            for _, field_name, _, _ in parsed:
+                if field_name is None:
+                    continue
+                if not field_name:
+                    return None, "переменные без имени {} не поддерживаются"
+                if '.' in field_name or '[' in field_name:
+                    return None, (f"индексы и атрибуты в переменной "
+                                  f"{{{field_name}}} не поддерживаются")
+            # Проверяем шаблон так же, как он будет применяться
+            template.format(jk_name=jk_name, **values)
+        except KeyError as e:
+            return None, f"неизвестная переменная {{{e.args[0]}}}"
+        except IndexError:
+            return None, "переменные без имени {} не поддерживаются"
+        except (ValueError, AttributeError, TypeError) as e:
+            return None, str(e)
+
+        parts = []
+        for literal, field_name, format_spec, conversion in parsed:
+            if literal:
+                parts.append((literal, None))
+            if field_name is None:
+                continue
+            if format_spec or conversion:
+                return None, None
+            if field_name == 'jk_name':
+                parts.append((jk_name, None))
+            else:
+                parts.append(('', cls.DESCRIPTION_FIELDS[field_name]))
+        return tuple(parts), None
+
+    def has_description(self):
+        return (self.description_parts is not None
+                or self.description_template is not None)
+
+    def render_description(self, ad):
+        """Подставляем поля объявления (AvitoAd) в шаблон описания"""
+        if self.description_parts is None:
+            return self.description_template.format(
+                jk_name=self.jk_name,
+                **{
+                    name: ad.text(field)
+                    for name, field in self.DESCRIPTION_FIELDS.items()
+                })
+        return ''.join(literal if field is None else str(ad.text(field))
+                       for literal, field in self.description_parts)
+
+
+class OfferConverter:
+    """Конвертация отдельных объявлений Яндекса в формат Авито
+
+    Не зависит от файлов и планировщика, поэтому используется и в
+    процессах-воркерах параллельной конвертации.
+    """
+
+    def __init__(self, compiled_jk_settings=None, log_level='info'):
+        self.ns = {
+            'realty': 'http://webmaster.yandex.ru/schemas/feed/realty/2010-06'
+        }
+        self.compiled_jk_settings = (compiled_jk_settings
+                                     if compiled_jk_settings is not None else
+                                     {})
+        self.log_level = log_level
+        self.log_buffer = []
+        # Короткие значения (телефон, ЖК, этажи) и длинные (описания,
+        # наборы фото): уникальных длинных в фиде много, их держим меньше
+        self.intern = ValueInterner()
+        self.intern_large = ValueInterner(limit=2048)
+        # Мертвые ссылки на фото текущего запуска (проверка фото)
+        self.dead_images = frozenset()
+
+    def log_enabled(self, level):
+        """Проверяем, проходит ли запись текущий уровень логирования"""
+        return LOG_LEVELS.get(level, 20) >= LOG_LEVELS.get(self.log_level, 20)
+
+    def add_log(self, message, level='info'):
+        """Копим записи лога, чтобы передать их в основной процесс"""
+        if self.log_enabled(level):
+            self.log_buffer.append((message, level))
+
+    def take_logs(self):
+        """Забираем накопленные записи лога"""
+        logs, self.log_buffer = self.log_buffer, []
+        return logs
+
+    def iter_offers(self, stream):
+        """Потоково перебираем объявления фида без построения всего дерева
+
+        Каждое объявление отдается сразу после закрывающего тега и
+        отцепляется от родителя после обработки, поэтому расход памяти
+        не зависит от размера фида.
+        """
+        offer_tag = '{%s}offer' % self.ns['realty']
+        path = []
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem)
+                continue
+
+            path.pop()
+            if elem.tag == offer_tag:
+                yield elem
+                elem.clear()
+                if path:
+                    path[-1].remove(elem)
+
+    # Простые поля: тег Яндекса -> атрибут OfferFields
+    OFFER_TEXT_FIELDS = {
+        'phone': 'phone',
+        'description': 'description',
+        'floor': 'floor',
+        'floors-total': 'floors_total',
+        'rooms': 'rooms',
+        'new-flat': 'new_flat',
+        'building-name': 'building_name',
+        'new-development-name': 'development_name'
+    }
+
+    def extract_offer_fields(self, offer):
+        """Извлекаем все нужные поля объявления за один обход поддерева
+
+        Как и у find('.//...'), для каждого поля берется первый по порядку
+        документа элемент, даже если он пустой.
+        """
+        prefix = '{%s}' % self.ns['realty']
+        prefix_len = len(prefix)
+        text_fields = self.OFFER_TEXT_FIELDS
+        intern = self.intern
+        intern_large = self.intern_large
+
+        source_id = offer.get('internal-id') or offer.get('id') or None
+        fields = OfferFields(
+            source_id or f"apt_{offer.get('internal-id', 'unknown')}",
+            source_id)
+        seen = set()
+        image_count = 0
+        images = []
+
+        # Обход в порядке документа: (элемент, имя родителя, внутри location)
+        stack = [(child, None, False) for child in reversed(offer)]
+        while stack:
+            elem, parent, in_location = stack.pop()
+            tag = elem.tag
+            name = tag[prefix_len:] if tag.startswith(prefix) else None
+
+            if name in text_fields:
+                if name not in seen:
+                    seen.add(name)
+                    value = (intern_large(elem.text) if name == 'description'
+                             else intern(elem.text))
+                    setattr(fields, text_fields[name], value)
+            elif name == 'image':
+                # Лимит Авито считается по элементам, как раньше
+                if image_count < 40:
+                    image_count += 1
+                    if elem.text and elem.text.strip():
+                        img_url = elem.text.strip()
+                        if img_url.startswith(('http://', 'https://')):
+                            images.append(img_url)
+            elif name == 'value' and parent in ('price', 'area'):
+                if parent not in seen:
+                    seen.add(parent)
+                    setattr(fields, parent, intern(elem.text))
+            elif name == 'district' and in_location:
+                if name not in seen:
+                    seen.add(name)
+                    fields.district = intern(elem.text)
+
+            if len(elem):
+                # Район ищем только внутри первого location
+                if name == 'location' and name not in seen:
+                    seen.add(name)
+                    child_in_location = True
+                else:
+                    child_in_location = in_location
+                stack.extend((child, name, child_in_location)
+                             for child in reversed(elem))
+            elif name == 'location':
+                seen.add(name)
+
+        if images:
+            fields.images = intern_large(tuple(images))
+        return fields
+
+    def get_jk_name(self, fields):
         """Получаем название ЖК"""
         # Пробуем разные варианты поиска названия ЖК
-        building_name = offer.find('.//realty:building-name', self.ns)
-        if building_name is not None and building_name.text:
+        if fields.building_name:
             # Очищаем от кавычек для упрощения
-            return building_name.text.strip().replace('"', '').replace("'", "")
+            return fields.building_name.strip().replace('"', '').replace(
+                "'", "")
 
         # Если нет building-name, пробуем другие поля
-        development = offer.find('.//realty:new-development-name', self.ns)
-        if development is not None and development.text:
-            return development.text.strip().replace('"', '').replace("'", "")
+        if fields.development_name:
+            return fields.development_name.strip().replace('"', '').replace(
+                "'", "")
 
-        location = offer.find('.//realty:location', self.ns)
-        if location is not None:
-            district = location.find('.//realty:district', self.ns)
-            if district is not None and district.text:
-                return f"Район {district.text.strip()}"
+        if fields.district:
+            return f"Район {fields.district.strip()}"
 
         return None
 
-    def apply_jk_settings(self, ad_data, jk_name):
+    def convert_fields(self, fields, jk_name):
+        """Конвертируем объявление и применяем настройки ЖК
+
+        Возвращает фрагмент <Ad> и признак применения настроек ЖК.
+        """
+        ad = self.convert_offer(fields)
+        custom = False
+
+        if jk_name:
+            self.add_log(f"Обрабатываем объявление из ЖК: '{jk_name}'",
+                         'debug')
+
+            if jk_name in self.compiled_jk_settings:
+                self.add_log(f"✅ Найдены настройки для ЖК: '{jk_name}'",
+                             'debug')
+                ad = self.apply_jk_settings(ad, jk_name)
+                custom = True
+            else:
+                self.add_log(f"❌ Настройки для ЖК '{jk_name}' не найдены",
+                             'warning')
+        else:
+            self.add_log("ЖК не определен для объявления", 'warning')
+
+        return self.render_ad(ad), custom
+
+    def convert_safely(self, fields, jk_name):
+        """Конвертируем объявление, возвращая ошибку вместо исключения
+
+        Возвращает (фрагмент, с настройками ЖК, ошибка, записи лога).
+        """
+        try:
+            fragment, custom = self.convert_fields(fields, jk_name)
+            return fragment, custom, None, self.take_logs()
+        except Exception as e:
+            return None, False, str(e), self.take_logs()
+
+    def offer_content_hash(self, fields):
+        """Хэш исходных полей объявления для инкрементальной конвертации"""
+        values = [str(CONVERSION_VERSION)]
+        for name in OfferFields.__slots__:
+            value = getattr(fields, name)
+            if name == 'images':
+                value = '\x1e'.join(value)
+            values.append('\x00' if value is None else value)
+        return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+    def apply_jk_settings(self, ad, jk_name):
         """Применяем настройки ЖК с правильной обработкой ID корпусов"""
-        if jk_name not in self.jk_settings:
-            return ad_data
+        settings = self.compiled_jk_settings.get(jk_name)
+        if settings is None:
+            return ad
 
-        settings = self.jk_settings[jk_name]
-        self.add_log(f"Применяем настройки для ЖК: {jk_name}", 'info')
+        self.add_log(f"Применяем настройки для ЖК: {jk_name}", 'debug')
 
         # Фотографии (максимум 40 по документации Авито)
-        if settings.get('photos') and len(settings['photos']) > 0:
-            valid_photos = [
-                url.strip() for url in settings['photos']
-                if url.strip().startswith(('http://', 'https://'))
-            ]
-            if valid_photos:
-                ad_data['Images'] = valid_photos[:40]  # Лимит Авито
-                self.add_log(
-                    f"Добавлено {len(valid_photos)} фото для {jk_name}",
-                    'info')
+        photos = settings.photos
+        if photos and self.dead_images:
+            photos = tuple(url for url in photos
+                           if url not in self.dead_images)
+        if photos:
+            ad.images = photos
+            self.add_log(
+                f"Добавлено {settings.photo_count} фото для {jk_name}",
+                'debug')
 
         # Описание (максимум 7500 символов по документации)
-        if settings.get('description') and settings['description'].strip():
+        if settings.has_description():
             try:
-                description = settings['description'].format(
-                    jk_name=jk_name,
-                    rooms=ad_data.get('Rooms', ''),
-                    square=ad_data.get('Square', ''),
-                    floor=ad_data.get('Floor', ''),
-                    floors=ad_data.get('Floors', ''),
-                    price=ad_data.get('Price', ''))
+                description = settings.render_description(ad)
                 # Обрезаем до лимита Авито
                 if len(description) > 7500:
                     description = description[:7497] + "..."
-                ad_data['Description'] = description
-                self.add_log(f"Обновлено описание для {jk_name}", 'info')
+                ad.description = description
+                self.add_log(f"Обновлено описание для {jk_name}", 'debug')
             except Exception as e:
                 self.add_log(
                     f"Ошибка форматирования описания для {jk_name}: {e}",
                     'warning')
 
         # Изменение цены
-        if settings.get('price_modifier') and 'Price' in ad_data:
+        if settings.price_rule and ad.price is not None:
+            kind, value, modifier = settings.price_rule
             try:
-                price = float(ad_data['Price'])
-                modifier = settings['price_modifier'].strip()
+                price = float(ad.price)
 
-                if modifier.endswith('%'):
-                    percent = float(modifier[:-1])
-                    new_price = price * (1 + percent / 100)
-                    ad_data['Price'] = str(int(new_price))
+                if kind == 'percent':
+                    new_price = price * (1 + value / 100)
+                    ad.price = str(int(new_price))
                     self.add_log(
                         f"Изменена цена для {jk_name}: {price} -> {int(new_price)} ({modifier})",
-                        'info')
-                elif modifier and modifier != '0':
-                    additional = float(modifier.replace('+', ''))
-                    new_price = price + additional
-                    ad_data['Price'] = str(int(new_price))
+                        'debug')
+                else:
+                    new_price = price + value
+                    ad.price = str(int(new_price))
                     self.add_log(
-                        f"Изменена цена для {jk_name}: {price} -> {int(new_price)} (+{additional}р)",
-                        'info')
+                        f"Изменена цена для {jk_name}: {price} -> {int(new_price)} (+{value}р)",
+                        'debug')
             except Exception as e:
                 self.add_log(f"Ошибка изменения цены для {jk_name}: {e}",
                              'warning')
 
         # КРИТИЧЕСКИ ВАЖНО: Правильная обработка ID для новостроек
-        if ad_data.get('MarketType') == 'Новостройка':
-
-            # Логика выбора правильного ID:
-            # 1. Если есть building_id (ID корпуса) - используем его в NewDevelopmentId
-            # 2. Если building_id нет, но есть development_id (ID ЖК) - используем его
-
-            building_id = settings.get('building_id', '').strip()
-            development_id = settings.get('development_id', '').strip()
-
-            if building_id and building_id.isdigit():
-                # Приоритет у ID корпуса
-                ad_data['NewDevelopmentId'] = building_id
-                ad_data['PropertyRights'] = 'Застройщик'
-                self.add_log(
-                    f"✅ Использован ID корпуса как NewDevelopmentId для {jk_name}: {building_id}",
-                    'info')
-
-            elif development_id and development_id.isdigit():
-                # Если нет ID корпуса, используем ID ЖК
-                ad_data['NewDevelopmentId'] = development_id
-                ad_data['PropertyRights'] = 'Застройщик'
+        if ad.market_type == 'Новостройка':
+
+            # ID выбран при разборе настроек: корпус, затем ЖК
+            if settings.new_development_id:
+                ad.new_development_id = settings.new_development_id
+                ad.property_rights = 'Застройщик'
+                id_kind = ('ID корпуса' if settings.id_source == 'building'
+                           else 'ID ЖК')
                 self.add_log(
-                    f"✅ Использован ID ЖК как NewDevelopmentId для {jk_name}: {development_id}",
-                    'info')
+                    f"✅ Использован {id_kind} как NewDevelopmentId для {jk_name}: {settings.new_development_id}",
+                    'debug')
 
             else:
-                # Если нет ни того, ни другого - убираем новостройку
+                # Если нет ни того, ни другого - убираем новостройку.
+                # Об отсутствии ID предупреждаем при сохранении настроек
                 self.add_log(
                     f"❌ Нет валидных ID для новостройки {jk_name}, переводим во вторичку",
-                    'warning')
-                ad_data['MarketType'] = 'Вторичка'
-                ad_data.pop('NewDevelopmentId', None)
+                    'debug')
+                ad.market_type = 'Вторичка'
+                ad.new_development_id = None
 
             # Обязательные поля для новостроек
-            if 'NewDevelopmentId' in ad_data:
+            if ad.new_development_id is not None:
                 # Тип отделки
-                if not ad_data.get('FinishType'):
-                    ad_data['FinishType'] = 'Без отделки'
+                if not ad.finish_type:
+                    ad.finish_type = 'Без отделки'
 
                 # Статус объекта
-                if not ad_data.get('Status'):
-                    ad_data['Status'] = 'Квартира'
+                if not ad.status:
+                    ad.status = 'Квартира'
 
-        return ad_data
+        return ad
 
-    def convert_offer(self, offer):
+    def convert_offer(self, fields):
         """Конвертируем одно объявление с правильной обработкой комнат"""
-        offer_id = (offer.get('internal-id') or 
-                   offer.get('id') or 
-                   f"apt_{offer.get('internal-id', 'unknown')}")
+        # Обязательные поля без значения в фиде остаются заглушками AvitoAd
+        ad = AvitoAd(fields.offer_id)
+        ad.date_begin = self.intern(datetime.now().strftime('%Y-%m-%d'))
+
+        # Основные поля
+        field_mapping = (
+            ('contact_phone', fields.phone, self.format_phone),
+            ('description', fields.description, self.clean_description),
+            ('price', fields.price, str),
+            ('square', fields.area, str),
+            ('floor', fields.floor, str),
+            ('floors', fields.floors_total, str)
+        )
+
+        for field, text, processor in field_mapping:
+            if text:
+                try:
+                    setattr(ad, field, processor(text))
+                except:
+                    pass
+
+        # Определяем тип рынка
+        if fields.new_flat == 'true':
+            ad.market_type = 'Новостройка'
+            ad.property_rights = 'Застройщик'
+        else:
+            ad.market_type = 'Вторичка'
+            ad.property_rights = 'Посредник'
+
+        ad.status = 'Квартира'
+        ad.house_type = 'Монолитный'
+
+        # ПРАВИЛЬНАЯ обработка комнат согласно Яндекс и Авито
+        if fields.rooms:
+            rooms_value = fields.rooms.strip().lower()
+
+            # Яндекс использует "studio" для студий
+            if rooms_value in ['studio', 'студия', '0']:
+                ad.rooms = 'Студия'  # Авито требует "Студия"
+            elif rooms_value == '1':
+                ad.rooms = '1'
+            elif rooms_value == '2':
+                ad.rooms = '2'
+            elif rooms_value == '3':
+                ad.rooms = '3'
+            elif rooms_value == '4':
+                ad.rooms = '4'
+            elif rooms_value == '5':
+                ad.rooms = '5'
+            elif rooms_value in ['6', '7', '8', '9']:
+                ad.rooms = rooms_value
+            elif rooms_value.isdigit() and int(rooms_value) >= 10:
+                ad.rooms = '10 и более'
+            else:
+                # Пытаемся извлечь число
+                try:
+                    rooms_int = int(rooms_value)
+                    if rooms_int == 0:
+                        ad.rooms = 'Студия'
+                    elif 1 <= rooms_int <= 9:
+                        ad.rooms = str(rooms_int)
+                    elif rooms_int >= 10:
+                        ad.rooms = '10 и более'
+                    else:
+                        ad.rooms = '1'  # Значение по умолчанию
+                except ValueError:
+                    # Если не удалось распарсить - ставим по умолчанию
+                    ad.rooms = '1'
+
+            self.add_log(f"Обработка комнат: '{fields.rooms}' -> '{ad.rooms}'", 'debug')
+        else:
+            # Если поле rooms отсутствует
+            ad.rooms = '1'
+            self.add_log("Поле rooms отсутствует, установлено значение '1'", 'warning')
+
+        # Изображения (уже отфильтрованы и ограничены лимитом Авито);
+        # кортеж общий у объявлений с одинаковым набором фото
+        if fields.images:
+            ad.images = fields.images
+
+        return ad
+
+    def format_phone(self, phone):
+        """Форматируем телефон"""
+        return normalize_phone(phone)
+
+    def clean_description(self, desc):
+        """Очищаем описание"""
+        return normalize_description(desc)
+
+    def render_ad(self, ad):
+        """Генерируем фрагмент <Ad> для одного объявления (AvitoAd)"""
+        xml_parts = ['  <Ad>']
+
+        # Обязательные поля по документации
+        mandatory_fields = (
+            ('Id', ad.id),
+            ('Category', 'Квартиры'),  # Всегда "Квартиры" для квартир
+            ('OperationType', 'Продам'),  # Всегда "Продам"
+            ('ContactPhone', ad.contact_phone),
+            ('Description', ad.description),
+            ('Price', ad.price),
+            ('PropertyRights', ad.property_rights)
+        )
+
+        # Добавляем обязательные поля
+        for field, value in mandatory_fields:
+            escaped_value = self.xml_escape(str(value))
+            xml_parts.append(f'    <{field}>{escaped_value}</{field}>')
+
+        # Дополнительные поля
+        optional_fields = (
+            ('DateBegin', ad.date_begin),
+            ('Square', ad.square),
+            ('Floor', ad.floor),
+            ('Floors', ad.floors),
+            ('Rooms', ad.rooms),
+            ('MarketType', ad.market_type),
+            ('HouseType', ad.house_type),
+            ('Status', ad.status)
+        )
+
+        for field, value in optional_fields:
+            if value:
+                escaped_value = self.xml_escape(str(value))
+                xml_parts.append(f'    <{field}>{escaped_value}</{field}>')
+
+        # КРИТИЧЕСКИ ВАЖНО: NewDevelopmentId только для новостроек
+        if ad.market_type == 'Новостройка' and ad.new_development_id:
+
+            dev_id = self.xml_escape(ad.new_development_id)
+            xml_parts.append(
+                f'    <NewDevelopmentId>{dev_id}</NewDevelopmentId>')
+
+            # Добавляем тип отделки для новостроек
+            if ad.finish_type:
+                finish_type = self.xml_escape(ad.finish_type)
+                xml_parts.append(
+                    f'    <FinishType>{finish_type}</FinishType>')
+            else:
+                xml_parts.append(
+                    '    <FinishType>Без отделки</FinishType>')
+
+        # Изображения (максимум 40 по документации)
+        if ad.images:
+            # Лимит Авито = 40 фото
+            xml_parts.append(render_images(tuple(ad.images[:40])))
+
+        xml_parts.append('  </Ad>')
+        return '\n'.join(xml_parts)
+
+    def xml_escape(self, text):
+        """Экранируем XML"""
+        return xml_escape(text)
+
+
+class AutoFeedConverter(OfferConverter):
+
+    def __init__(self, profile='default', base_dir='.', registry=None):
+        super().__init__()
+        self.profile = profile
+        self.registry = registry
+        self.config_file = os.path.join(base_dir, 'feed_config.json')
+        self.jk_settings_file = os.path.join(base_dir, 'jk_settings.json')
+        self.jk_settings_db = os.path.join(base_dir, 'jk_settings.db')
+        self.output_file = os.path.join(base_dir, 'avito_feed.xml')
+        self.feed_meta_file = os.path.join(base_dir, 'avito_feed.json')
+        self.shards_dir = os.path.join(base_dir, 'shards')
+        self.shard_index_file = os.path.join(self.shards_dir, 'index.json')
+        self.log_file = os.path.join(base_dir, 'conversion_log.jsonl')
+        self.legacy_log_file = os.path.join(base_dir, 'conversion_log.json')
+        self.offer_cache_file = os.path.join(base_dir, 'offer_cache.db')
+        self.image_cache_file = os.path.join(base_dir, 'image_cache.db')
+        self.feed_snapshot_file = os.path.join(base_dir, 'feed_snapshot.db')
+        self.feed_delta_file = os.path.join(base_dir, 'feed_delta.json')
+        # Обмен с ведущим процессом (см. LeaderLock)
+        self.conversion_request_file = os.path.join(
+            base_dir, 'conversion_request.json')
+        self.jk_index_request_file = os.path.join(base_dir,
+                                                  'jk_index_request.json')
+        self.leader_status_file = os.path.join(base_dir, 'leader_status.json')
+        self.leader_status = {}
+        self.published_status_key = None
+        self.config_lock = threading.Lock()
+        self.settings_store = None
+        self.jk_index = JkIndex(os.path.join(base_dir, 'jk_index.json'))
+        self.jk_index_refreshing = False
+        self.run_history = RunHistory(
+            os.path.join(base_dir, 'run_history.json'))
+        self.jobs = {}
+        self.current_job = None
+        self.jobs_lock = threading.Lock()
+        # Уровень логов запуска виден только потоку конвертации
+        self.run_local = threading.local()
+        # Загрузки и разбор фидов общие для всех профилей
+        if registry is not None:
+            self.fetcher = registry.fetcher
+            self.parsed_cache = registry.parsed_cache
+        else:
+            self.fetcher = FeedFetcher()
+            self.parsed_cache = ParsedFeedCache()
+
+        self.load_config()
+        self.load_logs()
+        self.load_jk_settings()
+        self.load_published_feed()
+        self.load_published_shards()
+        self.load_feed_delta()
+        self.synced_versions = self.state_versions()
+
+        # Запускаем планировщик в отдельном потоке
+        self.start_scheduler()
+
+    def load_config(self):
+        """Загружаем основную конфигурацию"""
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                self.config = json.load(f)
+            print(f"✅ Конфигурация загружена: {self.config}")
+        except Exception as e:
+            print(f"⚠️ Создаем новую конфигурацию: {e}")
+            self.config = {
+                'yandex_url': '',
+                'yandex_urls': [],
+                'auto_update': False,
+                'update_time': '06:00',
+                'last_update': None,
+                'feed_cache_ttl': 0,
+                'incremental': True,
+                'workers': 1,
+                'chunk_size': 200,
+                'log_level': 'info',
+                'feed_brotli': True,
+                'update_times': [],
+                'update_interval': 0,
+                'update_jitter': 0,
+                'settings_backend': 'sqlite',
+                'shard_by': '',
+                'shard_size': 5000,
+                'check_images': False,
+                'image_check_ttl': 86400,
+                'image_check_workers': 16,
+                'image_check_timeout': 5,
+                'fetch_connect_timeout': 10,
+                'fetch_read_timeout': 60,
+                'fetch_retries': 3,
+                'fetch_backoff': 1.0
+            }
+
+    def save_config(self):
+        """Сохраняем конфигурацию"""
+        try:
+            write_json_atomic(self.config_file, self.config, indent=2)
+            print(f"✅ Конфигурация сохранена")
+        except Exception as e:
+            print(f"❌ Ошибка сохранения конфигурации: {e}")
+
+    def update_config(self, changes):
+        """Применяем изменения к свежей конфигурации и сохраняем
+
+        Конфигурацию могут менять другие процессы, поэтому перед записью
+        файл перечитывается, а не перезаписывается своей копией.
+        """
+        with self.config_lock:
+            if os.path.exists(self.config_file):
+                self.load_config()
+            self.config.update(changes)
+            self.save_config()
+
+    def open_settings_store(self):
+        """Хранилище настроек ЖК: SQLite или прежний JSON-файл"""
+        if self.config.get('settings_backend', 'sqlite') == 'json':
+            return JsonSettingsStore(self.jk_settings_file)
+        return SqliteSettingsStore(self.jk_settings_db,
+                                   import_path=self.jk_settings_file)
+
+    def load_jk_settings(self, report=True):
+        """Загружаем настройки ЖК
+
+        report=False - тихая перезагрузка после изменений в другом процессе,
+        проблемы настроек уже записаны в лог при сохранении.
+        """
+        self.jk_settings_version = 0
+        try:
+            if self.settings_store is None:
+                self.settings_store = self.open_settings_store()
+            self.jk_settings_version = self.settings_store.version()
+            jk_settings = self.settings_store.load_all()
+            if report:
+                print(f"✅ Загружены настройки ЖК: {len(jk_settings)} "
+                      f"элементов")
+        except Exception as e:
+            print(f"❌ Ошибка загрузки настроек ЖК: {e}")
+            jk_settings = {}
+
+        compiled_jk_settings = {}
+        for jk_name, settings in jk_settings.items():
+            try:
+                compiled = CompiledJkSettings.compile(jk_name, settings)
+            except Exception as e:
+                # Одна испорченная запись не должна мешать запуску
+                self.add_log(f"Настройки ЖК '{jk_name}' пропущены: {e}",
+                             'error')
+                continue
+            compiled_jk_settings[jk_name] = compiled
+            if report:
+                for problem in compiled.errors + compiled.warnings:
+                    self.add_log(f"Настройки ЖК '{jk_name}': {problem}",
+                                 'warning')
+        # Подменяем словари целиком, а не правим на месте
+        self.jk_settings = jk_settings
+        self.compiled_jk_settings = compiled_jk_settings
+
+    def load_published_feed(self):
+        """Отображаем в память опубликованный фид и его сведения (ETag)"""
+        if not os.path.exists(self.output_file):
+            self.published_feed = None
+            return
+
+        files = {'identity': self.output_file}
+        try:
+            with open(self.feed_meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            for encoding in meta['encodings']:
+                files[encoding] = self.encoded_path(self.output_file,
+                                                    encoding)
+        except Exception:
+            # Фид опубликован старой версией - ETag считаем по файлу
+            meta = {
+                'etag': '',
+                'size': os.path.getsize(self.output_file),
+                'encodings': {},
+                'generated_at': datetime.fromtimestamp(
+                    os.path.getmtime(self.output_file)).isoformat()
+            }
+
+        try:
+            feed = PublishedFeed(meta, files)
+        except Exception as e:
+            print(f"❌ Ошибка загрузки опубликованного фида: {e}")
+            self.published_feed = None
+            return
+        if not meta['etag']:
+            meta['etag'] = hashlib.sha256(
+                feed.bodies['identity']).hexdigest()[:32]
+        self.published_feed = feed
+
+    def shard_files(self, name, encodings=()):
+        """Файлы шарда по кодировкам"""
+        path = os.path.join(self.shards_dir, f'{name}.xml')
+        files = {'identity': path}
+        for encoding in encodings:
+            files[encoding] = self.encoded_path(path, encoding)
+        return files
+
+    def load_published_shards(self):
+        """Отображаем в память шарды из индекса (режим shard_by)"""
+        try:
+            with open(self.shard_index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            self.shard_index, self.published_shards = None, {}
+            return
+        except Exception as e:
+            print(f"❌ Ошибка загрузки индекса шардов: {e}")
+            self.shard_index, self.published_shards = None, {}
+            return
+
+        shards = {}
+        for entry in index['shards']:
+            try:
+                shards[entry['name']] = PublishedFeed(
+                    entry, self.shard_files(entry['name'],
+                                            entry['encodings']))
+            except Exception as e:
+                print(f"❌ Ошибка загрузки шарда {entry['name']}: {e}")
+        self.shard_index, self.published_shards = index, shards
+
+    def update_jk_settings(self, jk_name, changes):
+        """Сохраняем изменения настроек одного ЖК
+
+        Настройки проверяются внутри транзакции хранилища: некорректные
+        не сохраняются (JkSettingsError). Возвращает скомпилированные.
+        """
+        result = {}
+
+        def validate(settings):
+            compiled = CompiledJkSettings.compile(jk_name, settings)
+            if compiled.errors:
+                raise JkSettingsError(compiled.errors)
+            result['compiled'] = compiled
+
+        settings = self.settings_store.update(jk_name, changes, validate)
+        # Подменяем словари целиком: конвертация в другом потоке читает их
+        self.jk_settings, self.compiled_jk_settings = (
+            {**self.jk_settings, jk_name: settings},
+            {**self.compiled_jk_settings, jk_name: result['compiled']})
+        self.jk_settings_version = self.settings_store.version()
+        print(f"✅ Настройки ЖК '{jk_name}' сохранены "
+              f"(версия {self.jk_settings_version})")
+        return result['compiled']
+
+    def import_jk_settings(self, imported, replace=False):
+        """Загружаем настройки ЖК из JSON (формат jk_settings.json)
+
+        Возвращает ошибки по ЖК; при ошибках ничего не сохраняется.
+        """
+        errors = {}
+        for jk_name, settings in imported.items():
+            if not isinstance(settings, dict):
+                errors[jk_name] = ['Настройки должны быть объектом']
+                continue
+            compiled = CompiledJkSettings.compile(jk_name, settings)
+            if compiled.errors:
+                errors[jk_name] = list(compiled.errors)
+        if errors:
+            return errors
+
+        self.settings_store.import_settings(imported, replace=replace)
+        self.load_jk_settings()
+        return {}
+
+    def load_feed_delta(self):
+        """Последний отчет об изменениях фида"""
+        try:
+            with open(self.feed_delta_file, 'r', encoding='utf-8') as f:
+                self.feed_delta = json.load(f)
+        except Exception:
+            self.feed_delta = None
+
+    def load_logs(self):
+        """Загружаем логи конвертации"""
+        self.log_sink = LogSink(self.log_file,
+                                legacy_path=self.legacy_log_file)
+
+    def save_logs(self):
+        """Сохраняем логи"""
+        self.log_sink.flush()
+
+    def run_log_level(self):
+        """Уровень логов: запуска в его потоке, иначе config['log_level']"""
+        return (getattr(self.run_local, 'log_level', None)
+                or self.config.get('log_level', 'info'))
+
+    def log_enabled(self, level):
+        """Проверяем запись по уровню логов текущего потока"""
+        return (LOG_LEVELS.get(level, 20) >=
+                LOG_LEVELS.get(self.run_log_level(), 20))
+
+    def add_log(self, message, level='info'):
+        """Добавляем запись в лог"""
+        if not self.log_enabled(level):
+            return
+
+        log_entry = {
+            'timestamp': datetime.now().isoformat(),
+            'message': message,
+            'level': level
+        }
+        self.log_sink.add(log_entry)
+        print(f"[{level.upper()}] {message}")
+
+    def feed_sources(self):
+        """Ссылки на фиды-источники в порядке приоритета
+
+        Основной фид - yandex_url, дополнительные - список yandex_urls.
+        Если объявление с одним id есть в нескольких фидах, берется из
+        источника, указанного раньше.
+        """
+        urls = [self.config.get('yandex_url')]
+        urls += self.config.get('yandex_urls') or []
+        return list(
+            dict.fromkeys(url.strip() for url in urls
+                          if url and url.strip()))
+
+    def upstream_client(self):
+        """HTTP-клиент загрузки фидов с таймаутами и повторами профиля"""
+        return UpstreamClient(
+            connect_timeout=self.config.get('fetch_connect_timeout', 10),
+            read_timeout=self.config.get('fetch_read_timeout', 60),
+            retries=self.config.get('fetch_retries', 3),
+            backoff=self.config.get('fetch_backoff', 1.0))
+
+    def open_feeds(self, metrics=None, revalidate=False):
+        """Открываем фиды-источники через кэш загрузок
+
+        Кэш без запроса к источнику используется feed_cache_ttl секунд
+        (по умолчанию 0 - проверяем всегда); revalidate=True (ручной
+        запуск) проверяет источник независимо от ttl. Единственный фид,
+        которого нет у других профилей, читается потоково по мере
+        загрузки. Остальные сначала загружаются в кэш
+        параллельно, поэтому загрузка занимает время самого медленного из
+        них, и затем читаются из кэша по очереди.
+        """
+        urls = self.feed_sources()
+        ttl = 0 if revalidate else self.config.get('feed_cache_ttl', 0)
+        client = self.upstream_client()
+        if len(urls) == 1 and not (self.registry and
+                                   self.registry.is_shared(urls[0], self)):
+            return [self.fetcher.open(urls[0], ttl=ttl, client=client)]
+
+        if metrics is not None:
+            metrics.start('fetch')
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(urls), 8)) as pool:
+                futures = [
+                    pool.submit(self.fetcher.fetch, url, ttl, client)
+                    for url in urls
+                ]
+            feeds, errors = [], []
+            for url, future in zip(urls, futures):
+                try:
+                    feeds.append(future.result())
+                except Exception as e:
+                    errors.append(f"{url}: {e}")
+        finally:
+            if metrics is not None:
+                metrics.stop()
+
+        # Без одного из фидов его объявления пропали бы с Авито
+        if errors:
+            for feed in feeds:
+                feed.close()
+            raise RuntimeError("не удалось загрузить " + '; '.join(errors))
+        return feeds
+
+    def iter_source_fields(self, feeds, stats=None, metrics=None):
+        """Поля объявлений всех фидов по очереди без повторов id
+
+        Для нескольких фидов побеждает первое встреченное объявление, то
+        есть фид раньше в списке; объявления без id не сравниваются. Фиды, уже разобранные этим или другим
+        профилем, берутся из общего кэша разбора. Ошибки извлечения полей
+        учитываются и логируются, только если передан stats.
+        """
+        seen_ids = set() if len(feeds) > 1 else None
+        for feed in feeds:
+            records = self.parsed_cache.load(feed.stats['content_hash'])
+            if records is not None:
+                feed.stats['parsed_from_cache'] = True
+                feed.stats['bytes_read'] = feed.stats['bytes_total']
+            else:
+                records = self.parsed_cache.record(
+                    self.iter_feed_fields(feed, metrics), feed.stats)
+
+            for record in records:
+                if isinstance(record, str):
+                    if stats is not None:
+                        stats['total'] += 1
+                        stats['errors'] += 1
+                        self.add_log(f"Ошибка обработки объявления: {record}",
+                                     'error')
+                    continue
+                if seen_ids is not None and record.source_id:
+                    if record.source_id in seen_ids:
+                        if stats is not None:
+                            stats['duplicates'] += 1
+                        continue
+                    seen_ids.add(record.source_id)
+                yield record
+
+    def iter_feed_fields(self, feed, metrics=None):
+        """Разбираем фид и извлекаем поля объявлений
+
+        Вместо объявления, поля которого извлечь не удалось, отдается
+        текст ошибки.
+        """
+        for offer in self.iter_offers(feed):
+            if metrics is not None:
+                metrics.start('extract')
+            try:
+                record = self.extract_offer_fields(offer)
+            except Exception as e:
+                record = str(e)
+            finally:
+                if metrics is not None:
+                    metrics.stop()
+            yield record
+
+    def log_fetch_stats(self, fetch_stats, with_url=False):
+        """Логируем статистику загрузки фида"""
+        name = f"Фид {fetch_stats['url']}" if with_url else "Фид"
+        if fetch_stats['status'] == 'downloaded':
+            transfer = ''
+            if fetch_stats.get('content_encoding'):
+                transfer = (f" (передано {fetch_stats['bytes_transferred']} "
+                            f"байт, {fetch_stats['content_encoding']})")
+            self.add_log(
+                f"{name} загружен: {fetch_stats['bytes_downloaded']} байт"
+                f"{transfer} за {fetch_stats['fetch_time']:.2f} с", 'info')
+        else:
+            reason = ('не изменился (304)'
+                      if fetch_stats['status'] == 'not_modified' else
+                      'взят из кэша')
+            self.add_log(
+                f"{name} {reason}: сэкономлено {fetch_stats['bytes_saved']} "
+                f"байт и {fetch_stats['time_saved']:.2f} с", 'info')
+        if fetch_stats.get('retries') or fetch_stats.get('redirects'):
+            self.add_log(
+                f"{name}: повторов запроса {fetch_stats['retries']}, "
+                f"редиректов {fetch_stats['redirects']}", 'warning')
+
+    def refresh_jk_index(self):
+        """Перестраиваем индекс ЖК по текущему фиду без конвертации"""
+        try:
+            builder = JkIndexBuilder()
+            with ExitStack() as stack:
+                feeds = [
+                    stack.enter_context(feed) for feed in self.open_feeds()
+                ]
+                for fields in self.iter_source_fields(feeds):
+                    jk_name = self.get_jk_name(fields)
+                    if jk_name:
+                        builder.add(jk_name, fields)
+            self.jk_index.replace(builder)
+        except Exception as e:
+            self.add_log(f"Ошибка загрузки фида: {e}", 'error')
+        finally:
+            self.jk_index_refreshing = False
+
+    def start_jk_index_refresh(self):
+        """Обновляем индекс ЖК в фоне
+
+        Если идет конвертация, индекс обновит она. Возвращает True, если
+        обновление запущено или уже идет.
+        """
+        if not self.is_leader():
+            if not self.feed_sources():
+                return False
+            write_json_atomic(self.jk_index_request_file,
+                              {'requested_at': datetime.now().isoformat()})
+            self.jk_index_refreshing = True
+            return True
+
+        with self.jobs_lock:
+            if self.jk_index_refreshing:
+                return True
+            job = self.current_job
+            if not self.feed_sources() or (job is not None
+                                           and job.state == 'running'):
+                return False
+            self.jk_index_refreshing = True
+        threading.Thread(target=self.refresh_jk_index, daemon=True).start()
+        return True
+
+    def start_conversion(self, manual=False, job_id=None):
+        """Запускаем конвертацию в фоне или присоединяемся к идущей
+
+        Возвращает задачу и признак того, что она уже выполнялась. Не в
+        ведущем процессе запуск передается ведущему; job_id - id такого
+        переданного запроса.
+        """
+        if not self.is_leader():
+            return self.request_conversion()
+
+        with self.jobs_lock:
+            job = self.current_job
+            if job is not None and job.state == 'running':
+                job.triggers += 1
+                if job_id:
+                    job.request_ids.append(job_id)
+                return job, True
+
+            job = ConversionJob(manual, job_id)
+            self.current_job = job
+            self.jobs[job.id] = job
+            # Храним только последние задачи
+            while len(self.jobs) > 20:
+                del self.jobs[next(iter(self.jobs))]
+
+        threading.Thread(target=self._run_job, args=(job, ),
+                         daemon=True).start()
+        return job, False
+
+    def _run_job(self, job):
+        result = False
+        try:
+            result = self.convert_feed(manual=job.manual, job=job)
+        finally:
+            job.finish(result)
+
+    def convert_feed(self, manual=False, log_level=None, job=None):
+        """Основная функция конвертации
+
+        log_level задает подробность логов на время запуска; по умолчанию
+        берется config['log_level']. В job публикуется прогресс запуска.
+        """
+        self.run_local.log_level = log_level
+        try:
+            return self._convert_feed(manual, job)
+        finally:
+            self.run_local.log_level = None
+            self.save_logs()
+            # Значения фида не держим в памяти до следующего запуска
+            self.intern.clear()
+            self.intern_large.clear()
+
+    def _convert_feed(self, manual, job=None):
+        """Конвертация фида с текущим уровнем логирования"""
+        if not self.feed_sources():
+            self.add_log("Не указана ссылка на фид Яндекса", 'error')
+            return False
+
+        source = "Ручная" if manual else "Автоматическая"
+        self.add_log(f"{source} конвертация начата", 'info')
+
+        metrics = RunMetrics()
+        run = {
+            'started_at': datetime.now().isoformat(),
+            'manual': manual,
+            'success': False
+        }
+        offer_cache = None
+        delta = None
+        image_checker = None
+        try:
+            # Статистика
+            stats = {
+                'total': 0,
+                'with_custom': 0,
+                'errors': 0,
+                'jk_configured': len(self.jk_settings),
+                'reused': 0,
+                'reconverted': 0,
+                'duplicates': 0
+            }
+            jk_index_builder = JkIndexBuilder()
+
+            if job is not None:
+                job.stats = stats
+                job.metrics = metrics
+
+            if self.config.get('incremental', True):
+                offer_cache = OfferCache(self.offer_cache_file)
+            jk_versions = {
+                jk_name: compiled.version
+                for jk_name, compiled in self.compiled_jk_settings.items()
+            }
+            if self.config.get('check_images'):
+                image_checker = ImageChecker(
+                    self.image_cache_file,
+                    ttl=self.config.get('image_check_ttl', 86400),
+                    workers=self.config.get('image_check_workers', 16),
+                    timeout=self.config.get('image_check_timeout', 5))
+                metrics.start('images')
+                self.dead_images = image_checker.check([
+                    url for compiled in self.compiled_jk_settings.values()
+                    for url in compiled.photos
+                ])
+                metrics.stop()
+                # Фото ЖК пропали - готовые объявления ЖК в кэше устарели
+                for jk_name, compiled in self.compiled_jk_settings.items():
+                    dead = [
+                        url for url in compiled.photos
+                        if url in self.dead_images
+                    ]
+                    if dead:
+                        jk_versions[jk_name] += ':' + hashlib.sha1(
+                            '\x1e'.join(dead).encode('utf-8')).hexdigest()
+            date_begin = datetime.now().strftime('%Y-%m-%d')
+            shard_by = self.config.get('shard_by')
+            delta = FeedDelta(
+                self.feed_snapshot_file, date_begin, {
+                    'shard_by': shard_by,
+                    'shard_size': (self.config.get('shard_size')
+                                   if shard_by == 'size' else None),
+                    'brotli': brotli is not None
+                    and self.config.get('feed_brotli', True)
+                })
+
+            def unchanged():
+                # Пропускаем публикацию, только если прошлый вывод на месте
+                published_output = (self.shard_index if shard_by else
+                                    self.published_feed)
+                return published_output is not None and delta.unchanged()
+
+            # Читаем фид потоково и сразу пишем готовые <Ad> в файл
+            with ExitStack() as stack:
+                feeds = [
+                    stack.enter_context(feed)
+                    for feed in self.open_feeds(metrics, revalidate=manual)
+                ]
+                for feed in feeds:
+                    feed.metrics = metrics
+                if job is not None:
+                    job.fetch_stats = [feed.stats for feed in feeds]
+                records = metrics.timed(
+                    self.iter_source_fields(feeds, stats, metrics), 'parse')
+                if image_checker is not None:
+                    records = metrics.timed(
+                        image_checker.filter_offers(records), 'images')
+                converted = delta.track(
+                    metrics.timed(
+                        self.iter_converted_offers(records, stats,
+                                                   offer_cache, jk_versions,
+                                                   date_begin, metrics,
+                                                   jk_index_builder),
+                        'convert'))
+                if shard_by:
+                    published = self.write_shards(converted, metrics,
+                                                  skip_if=unchanged)
+                else:
+                    published = self.write_avito_xml(
+                        (fragment for fragment, _ in converted),
+                        self.output_file, metrics, skip_if=unchanged)
 
-        ad_data = {
-            'Id': offer_id,
-            'Category': 'Квартиры',
-            'OperationType': 'Продам',
-            'DateBegin': datetime.now().strftime('%Y-%m-%d'),
-            'PropertyRights': 'Посредник'
-        }
+            if published is None:
+                self.add_log(
+                    "Фид не изменился, публикация пропущена", 'info')
+            elif shard_by:
+                index, written = published
+                self.publish_shards(index, written)
+                stats['shards'] = {
+                    'total': len(index['shards']),
+                    'written': len(written)
+                }
+            else:
+                self.publish_feed(published)
+            if published is not None:
+                delta.commit()
+            self.save_feed_delta(delta.report(published is not None))
+            stats['delta'] = {
+                name: self.feed_delta[name]
+                for name in ('published', 'added', 'removed', 'changed')
+            }
+            self.jk_index.replace(jk_index_builder)
 
-        # Основные поля
-        field_mapping = {
-            'ContactPhone': ('.//realty:phone', self.format_phone),
-            'Description': ('.//realty:description', self.clean_description),
-            'Price': ('.//realty:price/realty:value', str),
-            'Square': ('.//realty:area/realty:value', str),
-            'Floor': ('.//realty:floor', str),
-            'Floors': ('.//realty:floors-total', str)
-        }
-
-        for field, (xpath, processor) in field_mapping.items():
-            elem = offer.find(xpath, self.ns)
-            if elem is not None and elem.text:
-                try:
-                    ad_data[field] = processor(elem.text)
-                except:
-                    pass
+            stats['fetch'] = [feed.stats for feed in feeds]
+            for fetch_stats in stats['fetch']:
+                self.log_fetch_stats(fetch_stats, with_url=len(feeds) > 1)
+            self.add_log(f"Найдено объявлений: {stats['total']}", 'info')
+            if 'shards' in stats:
+                self.add_log(
+                    f"Шарды фида: {stats['shards']['total']}, перезаписано "
+                    f"{stats['shards']['written']}", 'info')
+            if stats['delta']['published']:
+                self.add_log(
+                    f"Изменения фида: добавлено {stats['delta']['added']}, "
+                    f"удалено {stats['delta']['removed']}, изменено "
+                    f"{stats['delta']['changed']}", 'info')
+            if image_checker is not None:
+                stats['images'] = image_checker.stats
+                self.add_log(
+                    f"Проверка фото: проверено {stats['images']['checked']}, "
+                    f"из кэша {stats['images']['cached']}, мертвых "
+                    f"{stats['images']['dead']}, убрано из объявлений "
+                    f"{stats['images']['dropped']}",
+                    'warning' if stats['images']['dead'] else 'info')
+            if stats['duplicates']:
+                self.add_log(
+                    f"Пропущено повторов из других фидов: "
+                    f"{stats['duplicates']}", 'warning')
 
-        # Заглушки для обязательных полей
-        if 'ContactPhone' not in ad_data:
-            ad_data['ContactPhone'] = '+79999999999'
-        if 'Description' not in ad_data:
-            ad_data['Description'] = 'Продается квартира'
-        if 'Price' not in ad_data:
-            ad_data['Price'] = '1000000'
+            if offer_cache is not None:
+                metrics.start('cache')
+                offer_cache.finish()
+                metrics.stop()
 
-        # Определяем тип рынка
-        new_flat_elem = offer.find('.//realty:new-flat', self.ns)
-        if new_flat_elem is not None and new_flat_elem.text == 'true':
-            ad_data['MarketType'] = 'Новостройка'
-            ad_data['PropertyRights'] = 'Застройщик'
-        else:
-            ad_data['MarketType'] = 'Вторичка'
-            ad_data['PropertyRights'] = 'Посредник'
+            # Обновляем конфигурацию
+            self.update_config({'last_update': datetime.now().isoformat()})
 
-        ad_data['Status'] = 'Квартира'
-        ad_data['HouseType'] = 'Монолитный'
+            # Логируем результат
+            message = f"Конвертация завершена: {stats['total']} объявлений, {stats['with_custom']} с настройками, {stats['errors']} ошибок, {stats['reused']} из кэша, {stats['reconverted']} сконвертировано"
+            self.add_log(message, 'success')
 
-        # ПРАВИЛЬНАЯ обработка комнат согласно Яндекс и Авито
-        rooms_elem = offer.find('.//realty:rooms', self.ns)
-        if rooms_elem is not None and rooms_elem.text:
-            rooms_value = rooms_elem.text.strip().lower()
+            run['success'] = True
+            run['stats'] = stats
+            return stats
 
-            # Яндекс использует "studio" для студий
-            if rooms_value in ['studio', 'студия', '0']:
-                ad_data['Rooms'] = 'Студия'  # Авито требует "Студия"
-            elif rooms_value == '1':
-                ad_data['Rooms'] = '1'
-            elif rooms_value == '2':
-                ad_data['Rooms'] = '2'
-            elif rooms_value == '3':
-                ad_data['Rooms'] = '3'
-            elif rooms_value == '4':
-                ad_data['Rooms'] = '4'
-            elif rooms_value == '5':
-                ad_data['Rooms'] = '5'
-            elif rooms_value in ['6', '7', '8', '9']:
-                ad_data['Rooms'] = rooms_value
-            elif rooms_value.isdigit() and int(rooms_value) >= 10:
-                ad_data['Rooms'] = '10 и более'
-            else:
-                # Пытаемся извлечь число
-                try:
-                    rooms_int = int(rooms_value)
-                    if rooms_int == 0:
-                        ad_data['Rooms'] = 'Студия'
-                    elif 1 <= rooms_int <= 9:
-                        ad_data['Rooms'] = str(rooms_int)
-                    elif rooms_int >= 10:
-                        ad_data['Rooms'] = '10 и более'
-                    else:
-                        ad_data['Rooms'] = '1'  # Значение по умолчанию
-                except ValueError:
-                    # Если не удалось распарсить - ставим по умолчанию
-                    ad_data['Rooms'] = '1'
+        except Exception as e:
+            self.add_log(f"Критическая ошибка конвертации: {e}", 'error')
+            run['error'] = str(e)
+            return False
 
-            self.add_log(f"Обработка комнат: '{rooms_elem.text}' -> '{ad_data['Rooms']}'", 'info')
+        finally:
+            if offer_cache is not None:
+                offer_cache.close()
+            if delta is not None:
+                delta.close()
+            if image_checker is not None:
+                image_checker.close()
+                self.dead_images = frozenset()
+            run['finished_at'] = datetime.now().isoformat()
+            run.update(metrics.report())
+            self.run_history.add(run)
+
+    def iter_converted_offers(self, records, stats, offer_cache, jk_versions,
+                              date_begin, metrics, jk_index_builder=None):
+        """Потоково конвертируем объявления фида во фрагменты <Ad>
+
+        Отдает (фрагмент, ЖК).
+        """
+        entries = metrics.timed(
+            self.iter_offer_entries(records, stats, offer_cache, jk_versions,
+                                    date_begin, jk_index_builder), 'extract')
+        workers = self.config.get('workers', 1)
+        if workers > 1:
+            results = self.iter_parallel_results(entries, workers, metrics)
         else:
-            # Если поле rooms отсутствует
-            ad_data['Rooms'] = '1'
-            self.add_log("Поле rooms отсутствует, установлено значение '1'", 'warning')
+            results = self.iter_serial_results(entries)
+
+        for entry, (fragment, custom, error, logs) in results:
+            for message, level in logs:
+                self.add_log(message, level)
+            if error is not None:
+                stats['errors'] += 1
+                self.add_log(f"Ошибка обработки объявления: {error}", 'error')
+                continue
+
+            fields, jk_name, content_hash, jk_version, cached = entry
+            if cached:
+                stats['reused'] += 1
+            else:
+                stats['reconverted'] += 1
+                if offer_cache is not None:
+                    offer_cache.put(fields.offer_id, content_hash, jk_version,
+                                    date_begin, custom, fragment)
 
-        # Изображения
-        images = []
-        for image in offer.findall('.//realty:image', self.ns)[:40]:  # Лимит Авито
-            if image.text and image.text.strip():
-                img_url = image.text.strip()
-                if img_url.startswith(('http://', 'https://')):
-                    images.append(img_url)
+            if custom:
+                stats['with_custom'] += 1
 
-        if images:
-            ad_data['Images'] = images
+            yield fragment, jk_name
 
-        return ad_data
+    def iter_offer_entries(self, records, stats, offer_cache, jk_versions,
+                           date_begin, jk_index_builder=None):
+        """Определяем ЖК объявлений и ищем их в кэше
 
-    def format_phone(self, phone):
-        """Форматируем телефон"""
-        if not phone:
-            return '+79999999999'
+        Отдает (поля, ЖК, хэш, версия настроек ЖК, результат из кэша).
+        Попутно пополняет сводку для индекса ЖК.
+        """
+        for fields in records:
+            stats['total'] += 1
+            try:
+                jk_name = self.get_jk_name(fields)
+                if jk_name and jk_index_builder is not None:
+                    jk_index_builder.add(jk_name, fields)
 
-        clean = re.sub(r'[^\d+]', '', phone)
+                content_hash = jk_version = cached = None
+                if offer_cache is not None:
+                    content_hash = self.offer_content_hash(fields)
+                    jk_version = jk_versions.get(jk_name, '')
+                    cached = offer_cache.get(fields.offer_id, content_hash,
+                                             jk_version, date_begin)
 
-        if clean.startswith('8'):
-            return '+7' + clean[1:]
-        elif clean.startswith('7'):
-            return '+' + clean
-        elif clean.startswith('+7'):
-            return clean
+            except Exception as e:
+                stats['errors'] += 1
+                self.add_log(f"Ошибка обработки объявления: {e}", 'error')
+                continue
+
+            yield fields, jk_name, content_hash, jk_version, cached
+
+    def iter_serial_results(self, entries):
+        """Конвертируем объявления в текущем процессе"""
+        for entry in entries:
+            fields, jk_name, content_hash, jk_version, cached = entry
+            if cached:
+                yield entry, (cached[0], cached[1], None, [])
+            else:
+                yield entry, self.convert_safely(fields, jk_name)
+
+    def iter_parallel_results(self, entries, workers, metrics):
+        """Конвертируем объявления пулом процессов, сохраняя их порядок
+
+        Объявления отправляются в пул пачками по chunk_size; в работе
+        держится не больше двух пачек на процесс, чтобы память не росла.
+        """
+        chunk_size = self.config.get('chunk_size', 200)
+        max_pending = workers * 2
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # Без fork (spawn/forkserver) воркеры заново импортировали бы
+            # модуль: Flask, профили, планировщик и выборы ведущего.
+            # Форк многопоточного процесса безопасен, пока дочерний
+            # процесс не берет блокировки, которые в момент fork мог
+            # держать другой поток: воркер выполняет только
+            # OfferConverter - чистый Python без print, файлов, SQLite и
+            # блокировок приложения (логи копятся в буфере и уходят
+            # родителю). Унаследованный flock ведущего воркер закрывает
+            # при старте (_init_conversion_worker).
+            mp_context = multiprocessing.get_context('fork')
         else:
-            return '+7' + clean
-
-    def clean_description(self, desc):
-        """Очищаем описание"""
-        if not desc:
-            return 'Продается квартира'
-
-        clean = re.sub(r'<[^>]+>', '', desc)
-        clean = ' '.join(clean.split())
-        return clean[:7500] if len(clean) > 7500 else clean
-
-    def generate_avito_xml(self, ads_data):
-        """Генерируем XML для Авито согласно официальной документации"""
-        xml_parts = [
-            '<?xml version="1.0" encoding="UTF-8"?>\n<Ads formatVersion="3" target="Avito.ru">'
-        ]
+            mp_context = None
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=mp_context,
+                                 initializer=_init_conversion_worker,
+                                 initargs=(self.compiled_jk_settings,
+                                           self.run_log_level(),
+                                           self.dead_images)) as pool:
+            pending = deque()
+
+            def submit(chunk):
+                todo = [(entry[0], entry[1]) for entry in chunk
+                        if not entry[4]]
+                pending.append((chunk, pool.submit(_convert_chunk, todo)))
+
+            def drain():
+                chunk, future = pending.popleft()
+                results, cpu = future.result()
+                # CPU воркеров засчитываем стадии конвертации
+                metrics.add('convert', cpu=cpu)
+                converted = iter(results)
+                for entry in chunk:
+                    cached = entry[4]
+                    if cached:
+                        yield entry, (cached[0], cached[1], None, [])
+                    else:
+                        yield entry, next(converted)
+
+            chunk = []
+            for entry in entries:
+                chunk.append(entry)
+                if len(chunk) >= chunk_size:
+                    submit(chunk)
+                    chunk = []
+                    if len(pending) > max_pending:
+                        yield from drain()
+            if chunk:
+                submit(chunk)
+            while pending:
+                yield from drain()
+
+    AVITO_XML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<Ads formatVersion="3" target="Avito.ru">')
+    AVITO_XML_FOOTER = '\n</Ads>'
+
+    def iter_avito_xml(self, fragments):
+        """Отдаем XML для Авито по частям по мере готовности фрагментов <Ad>"""
+        yield self.AVITO_XML_HEADER
+        for fragment in fragments:
+            yield '\n'
+            yield fragment
+        yield self.AVITO_XML_FOOTER
+
+    @staticmethod
+    def encoded_path(path, encoding):
+        """Путь к сжатой версии фида"""
+        return path + ('.br' if encoding == 'br' else '.gz')
+
+    def write_encoded_files(self, chunks, path, version, skip_if=None):
+        """Пишем XML (поток bytes) и его сжатые версии во временные файлы
+
+        Рядом с path пишутся path.gz и, если установлен brotli, path.br;
+        файлы сбрасываются на диск (fsync). Возвращает сведения о версии
+        (ETag, размеры), целевые и временные файлы по кодировкам; подмену
+        на место делает replace_encoded_files. При ошибке временные файлы
+        удаляются.
+
+        Сжатые версии пишутся вторым проходом по готовому XML: если после
+        первого прохода skip_if() истинно, файлы удаляются без сжатия и
+        возвращается None.
+        """
+        use_brotli = brotli is not None and self.config.get(
+            'feed_brotli', True)
+        targets = {'identity': path, 'gzip': self.encoded_path(path, 'gzip')}
+        if use_brotli:
+            targets['br'] = self.encoded_path(path, 'br')
+        tmp_files = {
+            encoding: f'{target}.{version}.tmp'
+            for encoding, target in targets.items()
+        }
 
-        for ad_data in ads_data:
-            xml_parts.append('  <Ad>')
-
-            # Обязательные поля по документации
-            mandatory_fields = {
-                'Id': ad_data.get('Id', ''),
-                'Category': 'Квартиры',  # Всегда "Квартиры" для квартир
-                'OperationType': 'Продам',  # Всегда "Продам" 
-                'ContactPhone': ad_data.get('ContactPhone', '+79999999999'),
-                'Description': ad_data.get('Description',
-                                           'Продается квартира'),
-                'Price': ad_data.get('Price', '1000000'),
-                'PropertyRights': ad_data.get('PropertyRights', 'Посредник')
+        try:
+            hasher = hashlib.sha256()
+            size = 0
+            with open(tmp_files['identity'], 'wb',
+                      buffering=1024 * 1024) as f:
+                for data in chunks:
+                    f.write(data)
+                    hasher.update(data)
+                    size += len(data)
+                if skip_if is not None and skip_if():
+                    f.close()
+                    self.remove_files(tmp_files.values())
+                    return None
+                f.flush()
+                os.fsync(f.fileno())
+
+            with ExitStack() as stack:
+                source = stack.enter_context(open(tmp_files['identity'],
+                                                  'rb'))
+                gz_file = stack.enter_context(open(tmp_files['gzip'], 'wb'))
+                gz = stack.enter_context(
+                    gzip.GzipFile(fileobj=gz_file,
+                                  mode='wb',
+                                  compresslevel=6,
+                                  mtime=0))
+                if use_brotli:
+                    br_file = stack.enter_context(
+                        open(tmp_files['br'], 'wb'))
+                    compressor = brotli.Compressor(quality=5)
+
+                for data in iter(lambda: source.read(1024 * 1024), b''):
+                    gz.write(data)
+                    if use_brotli:
+                        br_file.write(compressor.process(data))
+
+                gz.close()
+                if use_brotli:
+                    br_file.write(compressor.finish())
+                for out in (gz_file, ) + ((br_file, ) if use_brotli else ()):
+                    out.flush()
+                    os.fsync(out.fileno())
+
+            meta = {
+                'etag': hasher.hexdigest()[:32],
+                'sha256': hasher.hexdigest(),
+                'version': version,
+                'size': size,
+                'encodings': {
+                    encoding: os.path.getsize(tmp_path)
+                    for encoding, tmp_path in tmp_files.items()
+                    if encoding != 'identity'
+                },
+                'generated_at': datetime.now().isoformat()
+            }
+            return meta, targets, tmp_files
+        except BaseException:
+            self.remove_files(tmp_files.values())
+            raise
+
+    @staticmethod
+    def remove_files(paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def replace_encoded_files(self, path, targets, tmp_files):
+        """Подменяем файлы версии на месте; XML - последним"""
+        # По XML определяется наличие фида
+        for encoding in sorted(targets, key=lambda e: e == 'identity'):
+            os.replace(tmp_files[encoding], targets[encoding])
+        if 'br' not in targets and os.path.exists(path + '.br'):
+            # Устаревшая br-версия не должна отдаваться с новым ETag
+            os.remove(path + '.br')
+        fsync_directory(path)
+
+    def write_avito_xml(self, fragments, path, metrics=None, skip_if=None):
+        """Пишем новую версию XML для Авито по мере генерации
+
+        Вместе со сжатыми версиями и ETag (write_encoded_files). Каждая
+        версия пишется в свои временные файлы, отображается в память и
+        только потом атомарно подменяет предыдущую. При ошибке прежний фид
+        сохраняется. Возвращает PublishedFeed новой версии или None, если
+        skip_if() после генерации истинно (фид не изменился).
+        """
+        if metrics is not None:
+            metrics.start('write')
+        try:
+            chunks = (chunk.encode('utf-8')
+                      for chunk in self.iter_avito_xml(fragments))
+            written = self.write_encoded_files(chunks, path, time.time_ns(),
+                                               skip_if)
+            if written is None:
+                return None
+            meta, targets, tmp_files = written
+            try:
+                feed = PublishedFeed(meta, tmp_files)
+                self.replace_encoded_files(path, targets, tmp_files)
+            except BaseException:
+                self.remove_files(tmp_files.values())
+                raise
+
+            if metrics is not None:
+                metrics.add('write', bytes=meta['size'])
+            return feed
+        finally:
+            if metrics is not None:
+                metrics.stop()
+
+    def shard_name(self, position, jk_name):
+        """Стабильное имя шарда для объявления (используется в URL)"""
+        if self.config.get('shard_by') == 'jk':
+            if not jk_name:
+                return 'other'
+            return 'jk-' + hashlib.sha1(
+                jk_name.encode('utf-8')).hexdigest()[:12]
+        shard_size = max(1, int(self.config.get('shard_size') or 5000))
+        return f'part-{position // shard_size + 1:04d}'
+
+    def write_shards(self, converted, metrics=None, skip_if=None):
+        """Раскладываем объявления по шардам и пишем изменившиеся
+
+        shard_by=jk - шард на ЖК, shard_by=size - по shard_size объявлений
+        подряд. Фрагменты пишутся во временный файл, для каждого шарда
+        запоминаются их смещения; затем шарды собираются параллельно в
+        потоках (сжатие и запись отпускают GIL). Шард с прежним хэшем
+        содержимого (без DateBegin) не перезаписывается. Возвращает новый индекс и
+        PublishedFeed перезаписанных шардов; None, если skip_if() после
+        раскладки истинно (фид не изменился).
+        """
+        if metrics is not None:
+            metrics.start('write')
+        os.makedirs(self.shards_dir, exist_ok=True)
+        try:
+            shards = {}
+            with tempfile.TemporaryFile(dir=self.shards_dir) as spool:
+                offset = 0
+                for position, (fragment, jk_name) in enumerate(converted):
+                    data = fragment.encode('utf-8')
+                    spool.write(data)
+                    shard = shards.setdefault(
+                        self.shard_name(position, jk_name), {
+                            'jk': jk_name,
+                            'spans': []
+                        })
+                    shard['spans'].append((offset, len(data)))
+                    offset += len(data)
+                spool.flush()
+                if skip_if is not None and skip_if():
+                    return None
+
+                body = (memoryview(
+                    mmap.mmap(spool.fileno(), offset,
+                              access=mmap.ACCESS_READ))
+                        if offset else memoryview(b''))
+                previous = {
+                    entry['name']: entry
+                    for entry in (self.shard_index or {}).get('shards', [])
+                }
+                version = time.time_ns()
+                names = sorted(shards)
+                with ThreadPoolExecutor(
+                        max_workers=max(1, min(len(names),
+                                               os.cpu_count() or 1))) as pool:
+                    results = list(
+                        pool.map(
+                            lambda name: self.write_shard(
+                                name, shards[name], body,
+                                previous.get(name), version), names))
+                body.release()
+
+            written = {}
+            entries = []
+            for entry, feed in results:
+                entries.append(entry)
+                if feed is not None:
+                    written[entry['name']] = feed
+            index = {
+                'shard_by': self.config.get('shard_by'),
+                'generated_at': datetime.now().isoformat(),
+                'total': sum(entry['ads'] for entry in entries),
+                'shards': entries
             }
+            if metrics is not None:
+                metrics.add('write', bytes=offset)
+            return index, written
+        finally:
+            if metrics is not None:
+                metrics.stop()
+
+    def write_shard(self, name, shard, body, previous, version):
+        """Собираем один шард; без изменений - оставляем прежние файлы
+
+        Возвращает запись индекса и PublishedFeed (None, если шард не
+        перезаписывался).
+        """
+        def chunks():
+            yield self.AVITO_XML_HEADER.encode('utf-8')
+            for offset, length in shard['spans']:
+                yield b'\n'
+                yield body[offset:offset + length].tobytes()
+            yield self.AVITO_XML_FOOTER.encode('utf-8')
+
+        # DateBegin меняется каждый день и изменением шарда не считается
+        hasher = hashlib.sha256()
+        for data in chunks():
+            hasher.update(DATE_BEGIN.sub(b'', data))
+        content_hash = hasher.hexdigest()
+        files = self.shard_files(name, (previous or {}).get('encodings', ()))
+        if (previous is not None
+                and previous.get('content_hash') == content_hash
+                and all(os.path.exists(path) for path in files.values())):
+            return dict(previous, jk=shard['jk']), None
+
+        path = self.shard_files(name)['identity']
+        meta, targets, tmp_files = self.write_encoded_files(
+            chunks(), path, version)
+        try:
+            feed = PublishedFeed(meta, tmp_files)
+            self.replace_encoded_files(path, targets, tmp_files)
+        except BaseException:
+            self.remove_files(tmp_files.values())
+            raise
+        meta.update(name=name, jk=shard['jk'], ads=len(shard['spans']),
+                    content_hash=content_hash)
+        return meta, feed
+
+    def publish_shards(self, index, written):
+        """Публикуем индекс шардов и убираем то, что больше не отдается
+
+        Удаляются шарды, пропавшие из индекса, и единый фид прежнего
+        режима, чтобы по старым ссылкам не отдавались устаревшие
+        объявления.
+        """
+        shards = {
+            name: written.get(name) or self.published_shards.get(name)
+            for name in (entry['name'] for entry in index['shards'])
+        }
+        for entry in index['shards']:
+            if shards[entry['name']] is None:
+                # Шард не менялся, но в этом процессе еще не загружен
+                shards[entry['name']] = PublishedFeed(
+                    entry, self.shard_files(entry['name'],
+                                            entry['encodings']))
+
+        write_json_atomic(self.shard_index_file, index, indent=2)
+        fsync_directory(self.shard_index_file)
+        self.shard_index, self.published_shards = index, shards
+
+        keep = {os.path.basename(self.shard_index_file)}
+        for entry in index['shards']:
+            keep.update(
+                os.path.basename(path)
+                for path in self.shard_files(entry['name'],
+                                             ('gzip', 'br')).values())
+        for name in os.listdir(self.shards_dir):
+            if name not in keep and not name.endswith('.tmp'):
+                os.remove(os.path.join(self.shards_dir, name))
+
+        self.remove_files([self.feed_meta_file, self.output_file] + [
+            self.encoded_path(self.output_file, encoding)
+            for encoding in ('gzip', 'br')
+        ])
+        self.published_feed = None
+
+    def save_feed_delta(self, report):
+        """Сохраняем отчет об изменениях фида для API"""
+        try:
+            write_json_atomic(self.feed_delta_file, report)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения отчета об изменениях: {e}")
+        self.feed_delta = report
+
+    def remove_shards(self):
+        """Убираем шарды после возврата к единому фиду"""
+        if os.path.isdir(self.shards_dir):
+            shutil.rmtree(self.shards_dir, ignore_errors=True)
+        self.shard_index, self.published_shards = None, {}
+
+    def publish_feed(self, feed):
+        """Сохраняем сведения о новой версии и переключаем отдачу на нее"""
+        tmp_path = f"{self.feed_meta_file}.{feed.meta['version']}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(feed.meta, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.feed_meta_file)
+        fsync_directory(self.feed_meta_file)
+        # Присваивание атомарно: запросы видят либо старую, либо новую версию
+        self.published_feed = feed
+        if self.shard_index is not None:
+            self.remove_shards()
+
+    def is_leader(self):
+        """Выполняет ли этот процесс конвертации и расписание"""
+        return self.registry is None or self.registry.leader.is_leader
+
+    def state_versions(self):
+        """Версии общего с другими процессами состояния"""
+        return {
+            'config': file_version(self.config_file),
+            'settings': self.settings_store.version(),
+            'feed': file_version(self.feed_meta_file),
+            'shards': file_version(self.shard_index_file),
+            'delta': file_version(self.feed_delta_file),
+            'jk_index': file_version(self.jk_index.path),
+            'history': file_version(self.run_history.path),
+            'logs': file_version(self.log_file),
+            'status': file_version(self.leader_status_file)
+        }
 
-            # Добавляем обязательные поля
-            for field, value in mandatory_fields.items():
-                escaped_value = self.xml_escape(str(value))
-                xml_parts.append(f'    <{field}>{escaped_value}</{field}>')
+    def sync(self):
+        """Подхватываем изменения, сделанные другими процессами
+
+        Сравниваются только версии (stat файлов и счетчик версий
+        настроек ЖК), перечитывается лишь изменившееся.
+        """
+        versions = self.state_versions()
+        changed = {
+            name
+            for name, version in versions.items()
+            if version != self.synced_versions.get(name)
+        }
+        self.synced_versions = versions
+        if not changed:
+            return
+
+        if 'config' in changed and versions['config'] is not None:
+            with self.config_lock:
+                self.load_config()
+            self.scheduler.reschedule()
+        if 'settings' in changed:
+            self.load_jk_settings(report=False)
+        if 'feed' in changed:
+            self.load_published_feed()
+        if 'shards' in changed:
+            self.load_published_shards()
+        if 'delta' in changed:
+            self.load_feed_delta()
+        if 'jk_index' in changed:
+            self.jk_index.load()
+        if 'history' in changed:
+            self.run_history.load()
+        if 'logs' in changed:
+            self.log_sink.reload()
+        if 'status' in changed and not self.is_leader():
+            try:
+                with open(self.leader_status_file, 'r',
+                          encoding='utf-8') as f:
+                    self.leader_status = json.load(f)
+            except Exception:
+                self.leader_status = {}
+        if not self.is_leader():
+            self.jk_index_refreshing = bool(
+                self.leader_status.get('jk_index_refreshing')
+                or os.path.exists(self.jk_index_request_file))
+
+    def request_conversion(self):
+        """Передаем ручной запуск ведущему процессу
+
+        Если ведущий уже конвертирует, присоединяемся к его запуску.
+        Возвращает задачу-заглушку и признак присоединения.
+        """
+        status = self.leader_status.get('job')
+        if status and status['state'] == 'running':
+            return ConversionJob(True, status['id'], state='queued'), True
+
+        job = ConversionJob(True, state='queued')
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > 20:
+                del self.jobs[next(iter(self.jobs))]
+        write_json_atomic(self.conversion_request_file, {
+            'id': job.id,
+            'requested_at': job.started_at
+        })
+        return job, False
+
+    def get_job(self, job_id):
+        """Состояние задачи этого процесса или ведущего"""
+        job = self.jobs.get(job_id)
+        if job is not None and job.state != 'queued':
+            return job.to_dict()
+        status = self.leader_status.get('job')
+        if status and job_id in status['ids']:
+            return status
+        return job.to_dict() if job is not None else None
+
+    def serve_requests(self):
+        """Выполняем запросы других процессов и публикуем свое состояние
+
+        Вызывается только в ведущем процессе.
+        """
+        request = take_request(self.conversion_request_file)
+        if request is not None:
+            self.start_conversion(manual=True, job_id=request.get('id'))
+        if take_request(self.jk_index_request_file) is not None:
+            self.start_jk_index_refresh()
+
+        job = self.current_job
+        key = (job and (job.id, job.state, len(job.request_ids)),
+               self.jk_index_refreshing)
+        # Пока идет конвертация, обновляем и прогресс
+        if key != self.published_status_key or (job is not None
+                                                and job.state == 'running'):
+            write_json_atomic(self.leader_status_file, {
+                'job': job.status() if job is not None else None,
+                'jk_index_refreshing': self.jk_index_refreshing
+            })
+            self.published_status_key = key
 
-            # Дополнительные поля
-            optional_fields = {
-                'DateBegin': ad_data.get('DateBegin'),
-                'Square': ad_data.get('Square'),
-                'Floor': ad_data.get('Floor'),
-                'Floors': ad_data.get('Floors'),
-                'Rooms': ad_data.get('Rooms'),
-                'MarketType': ad_data.get('MarketType', 'Вторичка'),
-                'HouseType': ad_data.get('HouseType'),
-                'Status': ad_data.get('Status', 'Квартира')
-            }
+    def scheduled_update(self):
+        """Запланированное обновление"""
+        if not self.is_leader():
+            # Расписание выполняет ведущий процесс
+            return
+        job, attached = self.start_conversion(manual=False)
+        if attached:
+            self.add_log("Конвертация уже идет, автоматическое обновление "
+                         "присоединено к ней", 'info')
+        else:
+            self.add_log("Запуск автоматического обновления", 'info')
+        job.done.wait()
 
-            for field, value in optional_fields.items():
-                if value:
-                    escaped_value = self.xml_escape(str(value))
-                    xml_parts.append(f'    <{field}>{escaped_value}</{field}>')
+    def start_scheduler(self):
+        """Запускаем планировщик"""
+        self.scheduler = Scheduler(lambda: self.config, self.scheduled_update)
+        self.scheduler.start()
 
-            # КРИТИЧЕСКИ ВАЖНО: NewDevelopmentId только для новостроек
-            if (ad_data.get('MarketType') == 'Новостройка'
-                    and ad_data.get('NewDevelopmentId')):
 
-                dev_id = self.xml_escape(ad_data['NewDevelopmentId'])
-                xml_parts.append(
-                    f'    <NewDevelopmentId>{dev_id}</NewDevelopmentId>')
+# Конвертер процесса-воркера параллельной конвертации
+_worker_converter = None
 
-                # Добавляем тип отделки для новостроек
-                if ad_data.get('FinishType'):
-                    finish_type = self.xml_escape(ad_data['FinishType'])
-                    xml_parts.append(
-                        f'    <FinishType>{finish_type}</FinishType>')
-                else:
-                    xml_parts.append(
-                        '    <FinishType>Без отделки</FinishType>')
 
-            # Изображения (максимум 40 по документации)
-            if 'Images' in ad_data and ad_data['Images']:
-                images = ad_data['Images'][:40]  # Лимит Авито = 40 фото
-                xml_parts.append('    <Images>')
-                for img_url in images:
-                    escaped_url = self.xml_escape(img_url)
-                    xml_parts.append(f'      <Image url="{escaped_url}"/>')
-                xml_parts.append('    </Images>')
+def _init_conversion_worker(compiled_jk_settings, log_level, dead_images):
+    """Инициализируем процесс-воркер пула конвертации
 
-            xml_parts.append('  </Ad>')
+    Воркер - форк процесса приложения (см. iter_parallel_results).
+    Унаследованную копию дескриптора блокировки ведущего закрываем,
+    чтобы блокировка не пережила ведущий процесс в его воркерах.
+    """
+    global _worker_converter
+    profiles.leader.close_inherited()
+    _worker_converter = OfferConverter(compiled_jk_settings, log_level)
+    _worker_converter.dead_images = dead_images
 
-        xml_parts.append('</Ads>')
-        return '\n'.join(xml_parts)
 
-    def xml_escape(self, text):
-        """Экранируем XML"""
-        if not text:
-            return ''
-        return (str(text).replace('&', '&amp;').replace('<', '&lt;').replace(
-            '>', '&gt;').replace('"', '&quot;'))
+def _convert_chunk(items):
+    """Конвертируем пачку объявлений (поля, ЖК) в процессе-воркере
 
-    def scheduled_update(self):
-        """Запланированное обновление"""
-        self.add_log("Запуск автоматического обновления", 'info')
-        self.convert_feed(manual=False)
+    Возвращает результаты и затраченное процессом время CPU.
+    """
+    started = time.process_time()
+    results = [
+        _worker_converter.convert_safely(fields, jk_name)
+        for fields, jk_name in items
+    ]
+    return results, time.process_time() - started
 
-    def start_scheduler(self):
-        """Запускаем планировщик"""
 
-        def run_scheduler():
-            while True:
-                try:
-                    if self.config['auto_update']:
-                        schedule.every().day.at(self.config['update_time']).do(
-                            self.scheduled_update)
-                    schedule.run_pending()
-                    time.sleep(60)  # Проверяем каждую минуту
-                except Exception as e:
-                    print(f"Ошибка планировщика: {e}")
-                    time.sleep(300)  # При ошибке ждем 5 минут
+class LeaderLock:
+    """Выбор ведущего процесса по advisory-блокировке файла
 
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        scheduler_thread.start()
+    gunicorn с несколькими воркерами импортирует модуль в каждом
+    процессе. Расписание, конвертации и обновление индекса ЖК выполняет
+    только процесс, удерживающий flock; остальные передают ему запросы
+    через файлы. Когда ведущий завершается, блокировку снимает ОС, и ее
+    забирает следующий. Без fcntl (Windows) процесс всегда ведущий.
+    """
 
+    def __init__(self, path):
+        self.path = path
+        self.file = None
 
-# Создаем глобальный экземпляр конвертера
-converter = AutoFeedConverter()
+    @property
+    def is_leader(self):
+        return fcntl is None or self.file is not None
+
+    def try_acquire(self):
+        if self.is_leader:
+            return True
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+        self.file = f
+        return True
+
+    def close_inherited(self):
+        """Закрываем копию дескриптора, унаследованную при fork
+
+        flock принадлежит открытому файлу, а не процессу: закрытие копии
+        в дочернем процессе блокировку у родителя не снимает.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ProfileRegistry:
+    """Профили сервиса: у каждого свои настройки, ЖК, расписание и фид
+
+    Профиль default хранит файлы в корне, как раньше, остальные - в
+    profiles/<имя>/. Загрузки и разбор фидов общие для всех профилей.
+    """
+
+    NAME_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,39}$')
+
+    def __init__(self, root='profiles', leader_lock='leader.lock'):
+        self.root = root
+        self.fetcher = FeedFetcher()
+        self.parsed_cache = ParsedFeedCache()
+        self.leader = LeaderLock(leader_lock)
+        self.converters = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Поднимаем конвертеры профилей с диска, которых еще нет"""
+        self.leader.try_acquire()
+        with self.lock:
+            if 'default' not in self.converters:
+                self._add('default', '.')
+            if os.path.isdir(self.root):
+                for name in sorted(os.listdir(self.root)):
+                    path = os.path.join(self.root, name)
+                    if (name not in self.converters
+                            and self.NAME_PATTERN.match(name)
+                            and os.path.isdir(path)):
+                        self._add(name, path)
+
+    def start(self):
+        """Запускаем согласование с другими процессами"""
+        threading.Thread(target=self._coordinate, daemon=True).start()
+
+    def _coordinate(self, interval=1.0):
+        """Раз в interval секунд: выборы ведущего, новые профили, версии
+
+        Ведущий также забирает запросы других процессов.
+        """
+        while True:
+            try:
+                if not self.leader.is_leader and self.leader.try_acquire():
+                    print(f"✅ Процесс {os.getpid()} стал ведущим")
+                    for converter in list(self.converters.values()):
+                        converter.scheduler.reschedule()
+                self.load()
+                for converter in list(self.converters.values()):
+                    converter.sync()
+                    if self.leader.is_leader:
+                        converter.serve_requests()
+            except Exception as e:
+                print(f"❌ Ошибка согласования процессов: {e}")
+            time.sleep(interval)
+
+    def _add(self, name, base_dir):
+        converter = AutoFeedConverter(name, base_dir, registry=self)
+        self.converters[name] = converter
+        return converter
+
+    def create(self, name):
+        """Создаем новый профиль с пустыми настройками"""
+        if not self.NAME_PATTERN.match(name or ''):
+            raise ValueError("Имя профиля: латинские буквы в нижнем "
+                             "регистре, цифры, - и _ (до 40 символов)")
+        with self.lock:
+            if name in self.converters:
+                raise ValueError(f"Профиль {name} уже существует")
+            path = os.path.join(self.root, name)
+            os.makedirs(path, exist_ok=True)
+            return self._add(name, path)
+
+    def get(self, name):
+        return self.converters.get(name)
+
+    def names(self):
+        return list(self.converters)
+
+    def is_shared(self, url, converter):
+        """Используют ли фид по url другие профили"""
+        return any(url in other.feed_sources()
+                   for other in list(self.converters.values())
+                   if other is not converter)
+
+
+# Поднимаем профили; default - прежний единственный конвертер
+profiles = ProfileRegistry()
+profiles.load()
+profiles.start()
+converter = profiles.get('default')
+
+
+def get_converter():
+    """Конвертер профиля из параметра ?profile= (по умолчанию default)
+
+    Перед ответом API подхватываем изменения других воркеров.
+    """
+    name = request.args.get('profile', 'default')
+    profile_converter = profiles.get(name)
+    if profile_converter is None:
+        # Профиль мог создать другой воркер
+        profiles.load()
+        profile_converter = profiles.get(name)
+    if profile_converter is not None:
+        profile_converter.sync()
+    if profile_converter is None:
+        response = jsonify({'error': 'Профиль не найден'})
+        response.status_code = 404
+        abort(response)
+    return profile_converter
 
 # ====== WEB ROUTES ======
 
@@ -648,6 +4040,17 @@ def index():
             text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
         }
 
+        .profile-bar {
+            margin-top: 15px;
+        }
+
+        .profile-bar select {
+            padding: 6px 10px;
+            border-radius: 5px;
+            border: none;
+            font-size: 1em;
+        }
+
         .tabs {
             display: flex;
             background: white;
@@ -814,6 +4217,27 @@ def index():
             overflow-y: auto;
         }
 
+        .jk-filters {
+            display: flex;
+            gap: 10px;
+            margin: 15px 0 10px;
+        }
+
+        .jk-filters input,
+        .jk-filters select {
+            padding: 8px;
+            border: 2px solid #e9ecef;
+            border-radius: 5px;
+        }
+
+        .jk-filters input {
+            flex: 1;
+        }
+
+        .jk-pager {
+            margin-top: 10px;
+        }
+
         .jk-item {
             background: white;
             border: 2px solid #e9ecef;
@@ -849,6 +4273,7 @@ def index():
             padding: 2px 0;
         }
 
+        .log-debug { color: #adb5bd; }
         .log-info { color: #6c757d; }
         .log-success { color: #28a745; font-weight: bold; }
         .log-warning { color: #ffc107; }
@@ -937,6 +4362,11 @@ def index():
         <div class="header">
             <h1>🏠 Конвертер фидов Яндекс → Авито</h1>
             <p>Автоматическая настройка объявлений по ЖК с фото и описаниями</p>
+            <div class="profile-bar">
+                <label for="profileSelect">Профиль:</label>
+                <select id="profileSelect" onchange="switchProfile(this.value)"></select>
+                <button class="btn" onclick="createProfile()">➕ Новый профиль</button>
+            </div>
         </div>
 
         <div class="tabs">
@@ -955,8 +4385,12 @@ def index():
                         <label for="yandexUrl">URL фида Яндекс.Недвижимость:</label>
                         <input type="url" id="yandexUrl" placeholder="https://realty.yandex.ru/...">
                     </div>
+                    <div class="form-group">
+                        <label for="extraUrls">Дополнительные фиды (по одному в строке, при совпадении ID объявления приоритет у фида выше):</label>
+                        <textarea id="extraUrls" rows="3" placeholder="https://..."></textarea>
+                    </div>
                     <button class="btn" onclick="saveConfig()">Сохранить</button>
-                    <button class="btn" onclick="loadJkList()">Обновить список ЖК</button>
+                    <button class="btn" onclick="refreshJkList()">Обновить список ЖК</button>
                 </div>
 
                 <div class="card">
@@ -967,8 +4401,41 @@ def index():
                         </label>
                     </div>
                     <div class="form-group">
-                        <label for="updateTime">Время обновления:</label>
-                        <input type="time" id="updateTime" value="06:00">
+                        <label for="updateTimes">Время обновления (можно несколько через запятую):</label>
+                        <input type="text" id="updateTimes" value="06:00" placeholder="06:00, 18:00">
+                    </div>
+                    <div class="form-group">
+                        <label for="updateInterval">Или интервал, минут (0 - по времени):</label>
+                        <input type="number" id="updateInterval" value="0" min="0">
+                    </div>
+                    <div class="form-group">
+                        <label for="updateJitter">Случайная задержка запуска, секунд:</label>
+                        <input type="number" id="updateJitter" value="0" min="0">
+                    </div>
+                    <div class="form-group">
+                        <label for="shardBy">Разбивка фида на части (для очень больших каталогов):</label>
+                        <select id="shardBy">
+                            <option value="">Один файл</option>
+                            <option value="jk">По ЖК</option>
+                            <option value="size">По числу объявлений</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="shardSize">Объявлений в части (при разбивке по числу):</label>
+                        <input type="number" id="shardSize" value="5000" min="1">
+                    </div>
+                    <div class="form-group">
+                        <label>
+                            <input type="checkbox" id="checkImages"> Проверять ссылки на фото и убирать недоступные
+                        </label>
+                    </div>
+                    <div class="form-group">
+                        <label for="logLevel">Подробность логов:</label>
+                        <select id="logLevel">
+                            <option value="info">Обычная</option>
+                            <option value="debug">Подробная (по каждому объявлению)</option>
+                            <option value="warning">Только предупреждения и ошибки</option>
+                        </select>
                     </div>
                     <button class="btn" onclick="saveConfig()">Сохранить настройки</button>
                 </div>
@@ -978,6 +4445,7 @@ def index():
                     <div id="stats">
                         <p>🏢 ЖК с настройками: <span id="configuredJkCount">0</span></p>
                         <p>📅 Последнее обновление: <span id="lastUpdate">Никогда</span></p>
+                        <p>⏭️ Следующее обновление: <span id="nextUpdate">Не запланировано</span></p>
                         <p>📄 Статус фида: <span id="feedStatus">Не создан</span></p>
                     </div>
                 </div>
@@ -987,11 +4455,31 @@ def index():
             <div id="jk" class="tab-content">
                 <div class="card">
                     <h3>🏢 Список ЖК из фида</h3>
-                    <button class="btn" onclick="loadJkList()">Обновить список ЖК</button>
+                    <button class="btn" onclick="refreshJkList()">Обновить список ЖК</button>
                     <button class="btn" onclick="debugSettings()">🔍 Проверить настройки</button>
+                    <button class="btn" onclick="exportJkSettings()">⬇️ Экспорт настроек</button>
+                    <button class="btn" onclick="document.getElementById('jkImportFile').click()">⬆️ Импорт настроек</button>
+                    <input type="file" id="jkImportFile" accept=".json" style="display: none" onchange="importJkSettings(this)">
+                    <div class="jk-filters">
+                        <input type="text" id="jkSearch" placeholder="Поиск по названию..." oninput="searchJkList()">
+                        <select id="jkSort" onchange="loadJkList(1)">
+                            <option value="-count">По числу квартир</option>
+                            <option value="name">По названию</option>
+                            <option value="price_min">По минимальной цене</option>
+                            <option value="-price_max">По максимальной цене</option>
+                            <option value="-last_seen">По последнему появлению</option>
+                        </select>
+                        <select id="jkConfigured" onchange="loadJkList(1)">
+                            <option value="">Все ЖК</option>
+                            <option value="1">Настроенные</option>
+                            <option value="0">Без настроек</option>
+                        </select>
+                    </div>
+                    <div id="jkListInfo"></div>
                     <div id="jkList" class="jk-list">
                         <p>Загрузите фид для просмотра ЖК...</p>
                     </div>
+                    <div id="jkPager" class="jk-pager"></div>
                 </div>
             </div>
 
@@ -1077,14 +4565,82 @@ def index():
 
     <script>
         let currentJkName = '';
+        let currentProfile = new URLSearchParams(window.location.search).get('profile') || 'default';
+        let profileFeedUrls = {};
+        let feedSharded = false;
 
         // Инициализация
         document.addEventListener('DOMContentLoaded', function() {
+            loadProfiles();
             loadConfig();
             loadLogs();
-            updatePublicFeedUrl();
         });
 
+        // Адрес API с учетом выбранного профиля
+        function apiUrl(path) {
+            return path + (path.includes('?') ? '&' : '?') + 'profile=' + encodeURIComponent(currentProfile);
+        }
+
+        // Загрузка списка профилей
+        async function loadProfiles() {
+            try {
+                const response = await fetch('/api/profiles');
+                const profiles = await response.json();
+                const select = document.getElementById('profileSelect');
+                select.innerHTML = '';
+                profiles.forEach(profile => {
+                    profileFeedUrls[profile.name] = profile.feed_url;
+                    const option = document.createElement('option');
+                    option.value = profile.name;
+                    option.textContent = profile.name;
+                    select.appendChild(option);
+                });
+                select.value = currentProfile;
+                updatePublicFeedUrl();
+            } catch (error) {
+                console.error('Ошибка загрузки профилей:', error);
+            }
+        }
+
+        // Переключение профиля
+        function switchProfile(name) {
+            currentProfile = name;
+            const url = new URL(window.location.href);
+            url.searchParams.set('profile', name);
+            window.history.replaceState(null, '', url);
+            document.getElementById('jkList').innerHTML = '';
+            document.getElementById('conversionStatus').innerHTML = '';
+            loadConfig();
+            loadLogs();
+            updatePublicFeedUrl();
+        }
+
+        // Создание профиля
+        async function createProfile() {
+            const name = prompt('Имя нового профиля (латинские буквы, цифры, - и _):');
+            if (!name) {
+                return;
+            }
+            try {
+                const response = await fetch('/api/profiles', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ name: name.trim() })
+                });
+                const result = await response.json();
+                if (result.success) {
+                    currentProfile = result.name;
+                    await loadProfiles();
+                    switchProfile(result.name);
+                    showStatus('✅ Профиль создан', 'success');
+                } else {
+                    showStatus('❌ ' + result.error, 'error');
+                }
+            } catch (error) {
+                showStatus('❌ Ошибка: ' + error.message, 'error');
+            }
+        }
+
         // Переключение вкладок
         function showTab(tabName) {
             // Скрываем все вкладки
@@ -1110,17 +4666,31 @@ def index():
         // Загрузка конфигурации
         async function loadConfig() {
             try {
-                const response = await fetch('/api/config');
+                const response = await fetch(apiUrl('/api/config'));
                 const data = await response.json();
 
                 document.getElementById('yandexUrl').value = data.config.yandex_url || '';
+                document.getElementById('extraUrls').value = (data.config.yandex_urls || []).join('\\n');
                 document.getElementById('autoUpdate').checked = data.config.auto_update || false;
-                document.getElementById('updateTime').value = data.config.update_time || '06:00';
+                const updateTimes = (data.config.update_times && data.config.update_times.length) ?
+                    data.config.update_times : [data.config.update_time || '06:00'];
+                document.getElementById('updateTimes').value = updateTimes.join(', ');
+                document.getElementById('updateInterval').value = data.config.update_interval || 0;
+                document.getElementById('updateJitter').value = data.config.update_jitter || 0;
+                document.getElementById('logLevel').value = data.config.log_level || 'info';
+                document.getElementById('shardBy').value = data.config.shard_by || '';
+                document.getElementById('shardSize').value = data.config.shard_size || 5000;
+                document.getElementById('checkImages').checked = data.config.check_images || false;
+                feedSharded = data.shards > 0;
+                updatePublicFeedUrl();
 
                 document.getElementById('configuredJkCount').textContent = data.jk_count;
                 document.getElementById('lastUpdate').textContent = data.config.last_update ? 
                     new Date(data.config.last_update).toLocaleString('ru') : 'Никогда';
-                document.getElementById('feedStatus').textContent = data.feed_exists ? 'Создан' : 'Не создан';
+                document.getElementById('nextUpdate').textContent = data.next_update ?
+                    new Date(data.next_update).toLocaleString('ru') : 'Не запланировано';
+                document.getElementById('feedStatus').textContent = data.feed_exists ?
+                    (data.shards ? `Создан, частей: ${data.shards}` : 'Создан') : 'Не создан';
 
             } catch (error) {
                 console.error('Ошибка загрузки конфигурации:', error);
@@ -1129,24 +4699,36 @@ def index():
 
         // Сохранение конфигурации
         async function saveConfig() {
+            const updateTimes = document.getElementById('updateTimes').value
+                .split(',').map(value => value.trim()).filter(value => value);
             const config = {
                 yandex_url: document.getElementById('yandexUrl').value,
+                yandex_urls: document.getElementById('extraUrls').value
+                    .split('\\n').map(value => value.trim()).filter(value => value),
                 auto_update: document.getElementById('autoUpdate').checked,
-                update_time: document.getElementById('updateTime').value
+                update_time: updateTimes[0] || '06:00',
+                update_times: updateTimes,
+                update_interval: parseInt(document.getElementById('updateInterval').value) || 0,
+                update_jitter: parseInt(document.getElementById('updateJitter').value) || 0,
+                log_level: document.getElementById('logLevel').value,
+                shard_by: document.getElementById('shardBy').value,
+                shard_size: parseInt(document.getElementById('shardSize').value) || 5000,
+                check_images: document.getElementById('checkImages').checked
             };
 
             try {
-                const response = await fetch('/api/config', {
+                const response = await fetch(apiUrl('/api/config'), {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify(config)
                 });
 
+                const result = await response.json();
                 if (response.ok) {
                     showStatus('✅ Конфигурация сохранена!', 'success');
                     loadConfig();
                 } else {
-                    showStatus('❌ Ошибка сохранения конфигурации', 'error');
+                    showStatus('❌ Ошибка сохранения конфигурации: ' + (result.error || ''), 'error');
                 }
             } catch (error) {
                 showStatus('❌ Ошибка: ' + error.message, 'error');
@@ -1154,23 +4736,57 @@ def index():
         }
 
         // Загрузка списка ЖК
-        async function loadJkList() {
+        let jkPage = 1;
+        let jkSearchTimer = null;
+        const ROOM_NAMES = { studio: 'студии', '?': 'без комнат' };
+
+        async function loadJkList(page) {
+            if (page) {
+                jkPage = page;
+            }
+            const params = new URLSearchParams({
+                q: document.getElementById('jkSearch').value,
+                sort: document.getElementById('jkSort').value,
+                configured: document.getElementById('jkConfigured').value,
+                page: jkPage,
+                per_page: 50
+            });
+
             try {
-                const response = await fetch('/api/jk-list');
-                const jkList = await response.json();
+                const response = await fetch(apiUrl('/api/jk-list?' + params));
+                const result = await response.json();
+                if (!response.ok) {
+                    throw new Error(result.error);
+                }
 
                 const container = document.getElementById('jkList');
-
-                if (jkList.length === 0) {
-                    container.innerHTML = '<p>Сначала укажите ссылку на фид Яндекса в настройках</p>';
+                const info = document.getElementById('jkListInfo');
+                info.textContent = result.updated_at ?
+                    `ЖК: ${result.total}, обновлено ${new Date(result.updated_at).toLocaleString('ru')}` : '';
+
+                if (result.items.length === 0) {
+                    container.innerHTML = result.refreshing ?
+                        '<p>⏳ Список ЖК собирается из фида...</p>' :
+                        '<p>Сначала укажите ссылку на фид Яндекса в настройках</p>';
+                    document.getElementById('jkPager').innerHTML = '';
+                    if (result.refreshing) {
+                        setTimeout(() => loadJkList(), 2000);
+                    }
                     return;
                 }
 
                 let html = '';
-                jkList.forEach(jk => {
+                result.items.forEach(jk => {
+                    const rooms = Object.entries(jk.rooms || {})
+                        .map(([rooms, count]) => `${ROOM_NAMES[rooms] || rooms + '-комн.'}: ${count}`)
+                        .join(', ');
+                    const prices = jk.price_min !== null ?
+                        `${jk.price_min.toLocaleString('ru')} – ${jk.price_max.toLocaleString('ru')} ₽` : 'нет данных';
                     html += `
                         <div class="jk-item ${jk.configured ? 'configured' : ''}">
-                            <strong>${jk.name}</strong> (${jk.count} квартир)
+                            <strong>${jk.name}</strong> (${jk.count} квартир)${jk.in_feed ? '' : ' - <span class="warning-text">нет в фиде</span>'}
+                            <br>
+                            Комнаты: ${rooms} | Цены: ${prices}
                             <br>
                             Фото: ${jk.has_photos ? 'Есть' : 'Нет'} | 
                             Описание: ${jk.has_description ? 'Есть' : 'Нет'} |
@@ -1186,18 +4802,47 @@ def index():
 
                 container.innerHTML = html;
 
+                const pages = Math.ceil(result.total / result.per_page);
+                document.getElementById('jkPager').innerHTML = pages > 1 ? `
+                    <button class="btn" onclick="loadJkList(${jkPage - 1})" ${jkPage <= 1 ? 'disabled' : ''}>←</button>
+                    Страница ${jkPage} из ${pages}
+                    <button class="btn" onclick="loadJkList(${jkPage + 1})" ${jkPage >= pages ? 'disabled' : ''}>→</button>
+                ` : '';
+
             } catch (error) {
                 document.getElementById('jkList').innerHTML = '<p>Ошибка загрузки списка ЖК: ' + error.message + '</p>';
             }
         }
 
+        // Поиск ЖК с задержкой, пока пользователь печатает
+        function searchJkList() {
+            clearTimeout(jkSearchTimer);
+            jkSearchTimer = setTimeout(() => loadJkList(1), 300);
+        }
+
+        // Пересборка списка ЖК по текущему фиду
+        async function refreshJkList() {
+            try {
+                const response = await fetch(apiUrl('/api/jk-list/refresh'), { method: 'POST' });
+                const result = await response.json();
+                if (result.refreshing) {
+                    document.getElementById('jkList').innerHTML = '<p>⏳ Список ЖК собирается из фида...</p>';
+                    setTimeout(() => loadJkList(1), 2000);
+                } else {
+                    loadJkList(1);
+                }
+            } catch (error) {
+                showStatus('❌ Ошибка: ' + error.message, 'error');
+            }
+        }
+
         // Редактирование ЖК
         async function editJk(jkName) {
             currentJkName = jkName;
             document.getElementById('modalJkName').textContent = jkName;
 
             try {
-                const response = await fetch('/api/jk-settings/' + encodeURIComponent(jkName));
+                const response = await fetch(apiUrl('/api/jk-settings/' + encodeURIComponent(jkName)));
                 const settings = await response.json();
 
                 document.getElementById('jkPhotos').value = settings.photos ? settings.photos.join('\\n') : '';
@@ -1229,7 +4874,7 @@ def index():
             };
 
             try {
-                const response = await fetch('/api/jk-settings/' + encodeURIComponent(currentJkName), {
+                const response = await fetch(apiUrl('/api/jk-settings/' + encodeURIComponent(currentJkName)), {
                     method: 'POST',
                     headers: { 
                         'Content-Type': 'application/json',
@@ -1241,10 +4886,16 @@ def index():
                 const result = await response.json();
 
                 if (response.ok && result.success) {
-                    showStatus('✅ Настройки ЖК сохранены!', 'success');
+                    let message = '✅ Настройки ЖК сохранены!';
+                    if (result.warnings && result.warnings.length) {
+                        message += '<br>⚠️ ' + result.warnings.join('<br>⚠️ ');
+                    }
+                    showStatus(message, 'success');
                     closeModal();
                     loadJkList();
                     loadConfig();
+                } else if (result.errors) {
+                    alert('Настройки ЖК не сохранены:\\n\\n' + result.errors.join('\\n'));
                 } else {
                     showStatus('❌ Ошибка сохранения настроек ЖК', 'error');
                 }
@@ -1259,6 +4910,17 @@ def index():
         }
 
         // Ручная конвертация
+        const STAGE_NAMES = {
+            queued: 'ожидание запуска',
+            start: 'подготовка',
+            fetch: 'загрузка фида',
+            parse: 'разбор фида',
+            extract: 'извлечение полей',
+            convert: 'конвертация',
+            write: 'запись фида',
+            cache: 'обновление кэша'
+        };
+
         async function manualConvert() {
             const button = event.target;
             const originalText = button.textContent;
@@ -1266,16 +4928,17 @@ def index():
             button.disabled = true;
 
             try {
-                const response = await fetch('/api/convert', { method: 'POST' });
+                const response = await fetch(apiUrl('/api/convert'), { method: 'POST' });
                 const result = await response.json();
+                const job = await waitForJob(result.job_id);
 
-                if (result.success) {
+                if (job.state === 'done') {
                     document.getElementById('conversionStatus').innerHTML = `
                         <div class="status success">
                             ✅ Конвертация завершена!<br>
-                            Обработано: ${result.stats.total} объявлений<br>
-                            С настройками: ${result.stats.with_custom}<br>
-                            Ошибок: ${result.stats.errors}
+                            Обработано: ${job.stats.total} объявлений<br>
+                            С настройками: ${job.stats.with_custom}<br>
+                            Ошибок: ${job.stats.errors}
                         </div>
                     `;
                     loadConfig();
@@ -1283,7 +4946,7 @@ def index():
                     updatePublicFeedUrl();
                 } else {
                     document.getElementById('conversionStatus').innerHTML = `
-                        <div class="status error">❌ Ошибка конвертации: ${result.error}</div>
+                        <div class="status error">❌ Ошибка конвертации: ${job.error}</div>
                     `;
                 }
             } catch (error) {
@@ -1296,10 +4959,38 @@ def index():
             }
         }
 
+        // Опрашиваем прогресс фоновой конвертации до ее завершения
+        async function waitForJob(jobId) {
+            while (true) {
+                const response = await fetch(apiUrl('/api/jobs/' + jobId));
+                const job = await response.json();
+                if (!response.ok) {
+                    throw new Error(job.error);
+                }
+                if (job.state !== 'running' && job.state !== 'queued') {
+                    return job;
+                }
+
+                const progress = job.progress;
+                const stage = STAGE_NAMES[progress.stage] || progress.stage;
+                let details = `Стадия: ${stage}<br>Обработано: ${progress.offers} объявлений`;
+                if (progress.percent !== null) {
+                    details += `<br>Прочитано фида: ${progress.percent}%`;
+                }
+                if (progress.eta !== null) {
+                    details += `<br>Осталось примерно: ${Math.ceil(progress.eta)} с`;
+                }
+                document.getElementById('conversionStatus').innerHTML = `
+                    <div class="status info">⏳ Конвертация выполняется...<br>${details}</div>
+                `;
+                await new Promise(resolve => setTimeout(resolve, 1000));
+            }
+        }
+
         // Скачивание фида
         async function downloadFeed() {
             try {
-                const response = await fetch('/api/download-feed');
+                const response = await fetch(apiUrl('/api/download-feed'));
                 if (response.ok) {
                     const blob = await response.blob();
                     const url = window.URL.createObjectURL(blob);
@@ -1319,7 +5010,7 @@ def index():
         // Отладка настроек
         async function debugSettings() {
             try {
-                const response = await fetch('/api/debug-settings');
+                const response = await fetch(apiUrl('/api/debug-settings'));
                 const debug = await response.json();
 
                 let message = 'ОТЛАДОЧНАЯ ИНФОРМАЦИЯ:\\n\\n';
@@ -1340,10 +5031,45 @@ def index():
             }
         }
 
+        // Выгрузка настроек ЖК в JSON
+        function exportJkSettings() {
+            window.location.href = apiUrl('/api/jk-settings-export');
+        }
+
+        // Загрузка настроек ЖК из JSON-файла
+        async function importJkSettings(input) {
+            const file = input.files[0];
+            input.value = '';
+            if (!file) return;
+
+            try {
+                const data = JSON.parse(await file.text());
+                const replace = confirm('Заменить все текущие настройки ЖК? (Отмена - только дополнить)');
+                const response = await fetch(apiUrl('/api/jk-settings-import' + (replace ? '?replace=1' : '')), {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify(data)
+                });
+                const result = await response.json();
+
+                if (result.success) {
+                    showStatus(`✅ Импортировано настроек ЖК: ${result.imported}`, 'success');
+                    loadJkList(jkPage);
+                } else if (result.errors) {
+                    const lines = Object.entries(result.errors).map(([jkName, errors]) => `${jkName}: ${errors.join('; ')}`);
+                    showStatus('❌ Настройки не импортированы:\\n' + lines.join('\\n'), 'error');
+                } else {
+                    showStatus('❌ ' + result.error, 'error');
+                }
+            } catch (error) {
+                showStatus('❌ Ошибка импорта: ' + error.message, 'error');
+            }
+        }
+
         // Загрузка логов
         async function loadLogs() {
             try {
-                const response = await fetch('/api/logs');
+                const response = await fetch(apiUrl('/api/logs'));
                 const logs = await response.json();
 
                 const container = document.getElementById('logsContainer');
@@ -1368,10 +5094,11 @@ def index():
             }
         }
 
-        // Обновление публичной ссылки на фид
+        // Обновление публичной ссылки на фид (или на индекс частей)
         function updatePublicFeedUrl() {
-            const url = window.location.origin + '/feed.xml';
-            document.getElementById('publicFeedUrl').textContent = url;
+            const path = feedSharded ? `/feeds/${currentProfile}/shards.json` :
+                (profileFeedUrls[currentProfile] || '/feed.xml');
+            document.getElementById('publicFeedUrl').textContent = window.location.origin + path;
         }
 
         // Копирование ссылки на фид
@@ -1429,54 +5156,158 @@ def ping():
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Получить текущую конфигурацию"""
+    converter = get_converter()
     return jsonify({
         'config': converter.config,
         'jk_count': len(converter.jk_settings),
-        'feed_exists': os.path.exists(converter.output_file)
+        'feed_exists': (converter.published_feed is not None
+                        or bool(converter.published_shards)),
+        'shards': len(converter.published_shards),
+        'next_update': (converter.scheduler.next_run.isoformat()
+                        if converter.scheduler.next_run else None)
     })
 
 
 @app.route('/api/config', methods=['POST'])
 def save_config():
     """Сохранить конфигурацию"""
+    converter = get_converter()
     data = request.json
-    converter.config.update(data)
-    converter.save_config()
+    try:
+        Scheduler.parse_times({**converter.config, **data})
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Время обновления должно быть в формате ЧЧ:ММ'
+        }), 400
+    for key in ('update_interval', 'update_jitter'):
+        value = data.get(key)
+        if value is not None and (isinstance(value, bool)
+                                  or not isinstance(value, (int, float))
+                                  or value < 0):
+            return jsonify({
+                'success': False,
+                'error': 'Интервал и задержка обновления - '
+                         'неотрицательные числа'
+            }), 400
+    if data.get('shard_by', '') not in ('', 'jk', 'size'):
+        return jsonify({
+            'success': False,
+            'error': 'Разбивка фида: jk, size или пусто'
+        }), 400
+    if 'shard_size' in data and (not isinstance(data['shard_size'], int)
+                                 or data['shard_size'] < 1):
+        return jsonify({
+            'success': False,
+            'error': 'Размер шарда - целое число объявлений больше 0'
+        }), 400
+    for key in ('workers', 'chunk_size'):
+        value = data.get(key)
+        if key in data and (isinstance(value, bool)
+                            or not isinstance(value, int) or value < 1):
+            return jsonify({
+                'success': False,
+                'error': 'Число процессов и размер пачки - целые числа '
+                         'больше 0'
+            }), 400
+    converter.update_config(data)
+    converter.scheduler.reschedule()
     return jsonify({'success': True})
 
 
 @app.route('/api/jk-list', methods=['GET'])
 def get_jk_list():
-    """Получить список ЖК"""
-    jk_list = converter.get_jk_list()
+    """Список ЖК из индекса: поиск q, сортировка sort, страницы page/per_page"""
+    converter = get_converter()
+    if converter.jk_index.updated_at is None:
+        # Индекс еще не строился - собираем его в фоне
+        converter.start_jk_index_refresh()
+
+    try:
+        entries = converter.jk_index.search(request.args.get('q', ''),
+                                            request.args.get('sort', '-count'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    configured = request.args.get('configured')
+    if configured in ('0', '1'):
+        entries = [
+            entry for entry in entries
+            if bool(converter.jk_settings.get(entry['name'])) == (
+                configured == '1')
+        ]
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
 
     # Добавляем информацию о настройках
-    result = []
-    for jk_name, count in jk_list.items():
-        settings = converter.jk_settings.get(jk_name, {})
-        result.append({
-            'name':
-            jk_name,
-            'count':
-            count,
-            'configured':
-            bool(settings),
-            'has_photos':
-            bool(settings.get('photos')),
-            'has_description':
-            bool(settings.get('description')),
-            'has_development_id':
-            bool(settings.get('development_id')),
-            'has_building_id':
-            bool(settings.get('building_id'))
+    items = []
+    for entry in entries[(page - 1) * per_page:page * per_page]:
+        settings = converter.jk_settings.get(entry['name'], {})
+        items.append({
+            **entry,
+            'configured': bool(settings),
+            'has_photos': bool(settings.get('photos')),
+            'has_description': bool(settings.get('description')),
+            'has_development_id': bool(settings.get('development_id')),
+            'has_building_id': bool(settings.get('building_id'))
         })
 
-    return jsonify(result)
+    return jsonify({
+        'items': items,
+        'total': len(entries),
+        'page': page,
+        'per_page': per_page,
+        'updated_at': converter.jk_index.updated_at,
+        'refreshing': converter.jk_index_refreshing
+    })
+
+
+@app.route('/api/jk-list/refresh', methods=['POST'])
+def refresh_jk_list():
+    """Обновить индекс ЖК по текущему фиду в фоне"""
+    converter = get_converter()
+    return jsonify({'refreshing': converter.start_jk_index_refresh()})
+
+
+@app.route('/api/jk-settings-export', methods=['GET'])
+def export_jk_settings():
+    """Выгрузить все настройки ЖК в JSON"""
+    converter = get_converter()
+    response = jsonify(converter.settings_store.load_all())
+    response.headers['Content-Disposition'] = (
+        'attachment; filename=jk_settings.json')
+    return response
+
+
+@app.route('/api/jk-settings-import', methods=['POST'])
+def import_jk_settings():
+    """Загрузить настройки ЖК из JSON (replace=1 - заменить все)"""
+    converter = get_converter()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({
+            'success': False,
+            'error': 'Ожидается JSON-объект {ЖК: настройки}'
+        }), 400
+
+    replace = request.args.get('replace') == '1'
+    errors = converter.import_jk_settings(data, replace=replace)
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    converter.add_log(f"Импортированы настройки ЖК: {len(data)}", 'info')
+    return jsonify({
+        'success': True,
+        'imported': len(data),
+        'total': len(converter.jk_settings)
+    })
 
 
 @app.route('/api/jk-settings/<jk_name>', methods=['GET'])
 def get_jk_settings(jk_name):
     """Получить настройки ЖК"""
+    converter = get_converter()
     import urllib.parse
     jk_name_decoded = urllib.parse.unquote(jk_name)
     settings = converter.jk_settings.get(jk_name_decoded, {})
@@ -1487,6 +5318,7 @@ def get_jk_settings(jk_name):
 @app.route('/api/jk-settings/<jk_name>', methods=['POST'])
 def save_jk_settings(jk_name):
     """Сохранить настройки ЖК"""
+    converter = get_converter()
     try:
         # Декодируем название ЖК из URL
         import urllib.parse
@@ -1496,23 +5328,24 @@ def save_jk_settings(jk_name):
         print(f"🔧 Сохранение настроек для ЖК: '{jk_name_decoded}'")
         print(f"📝 Данные: {data}")
 
-        if jk_name_decoded not in converter.jk_settings:
-            converter.jk_settings[jk_name_decoded] = {}
-
-        converter.jk_settings[jk_name_decoded].update(data)
-
-        # Сохраняем в файл
-        converter.save_jk_settings()
+        # Проверяем настройки до сохранения, чтобы не ловить ошибки в каждом объявлении
+        try:
+            compiled = converter.update_jk_settings(jk_name_decoded, data)
+        except JkSettingsError as e:
+            print(f"❌ Некорректные настройки ЖК: {e.errors}")
+            return jsonify({'success': False, 'errors': e.errors}), 400
 
-        # Проверяем что сохранилось
-        converter.load_jk_settings()
         saved_settings = converter.jk_settings.get(jk_name_decoded, {})
         print(
             f"✅ Настройки сохранены для '{jk_name_decoded}': {saved_settings}")
 
         converter.add_log(f"Обновлены настройки ЖК: {jk_name_decoded}", 'info')
 
-        return jsonify({'success': True, 'saved_settings': saved_settings})
+        return jsonify({
+            'success': True,
+            'saved_settings': saved_settings,
+            'warnings': list(compiled.warnings)
+        })
 
     except Exception as e:
         print(f"❌ Ошибка сохранения настроек ЖК: {e}")
@@ -1521,29 +5354,121 @@ def save_jk_settings(jk_name):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/profiles', methods=['GET'])
+def get_profiles():
+    """Список профилей и ссылки на их фиды"""
+    result = []
+    for name in profiles.names():
+        profile_converter = profiles.get(name)
+        result.append({
+            'name': name,
+            'feed_url': ('/feed.xml'
+                         if name == 'default' else f'/feeds/{name}.xml'),
+            'feed_exists': (profile_converter.published_feed is not None
+                            or bool(profile_converter.published_shards)),
+            'shards_url': (f'/feeds/{name}/shards.json'
+                           if profile_converter.shard_index else None),
+            'last_update': profile_converter.config.get('last_update')
+        })
+    return jsonify(result)
+
+
+@app.route('/api/profiles', methods=['POST'])
+def create_profile():
+    """Создать профиль"""
+    name = (request.json or {}).get('name', '').strip()
+    try:
+        profiles.create(name)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'name': name})
+
+
 @app.route('/api/convert', methods=['POST'])
 def manual_convert():
-    """Ручная конвертация"""
-    result = converter.convert_feed(manual=True)
-    if result:
-        return jsonify({'success': True, 'stats': result})
-    else:
-        return jsonify({'success': False, 'error': 'Ошибка конвертации'})
+    """Ручная конвертация в фоне; если запуск уже идет - присоединяемся"""
+    converter = get_converter()
+    job, attached = converter.start_conversion(manual=True)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'attached': attached,
+        'job': converter.get_job(job.id) or job.to_dict()
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Состояние и прогресс фоновой конвертации"""
+    converter = get_converter()
+    job = converter.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(job)
 
 
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
     """Получить логи"""
-    return jsonify(converter.logs[-30:])  # Последние 30 записей
+    converter = get_converter()
+    return jsonify(converter.log_sink.recent(30))  # Последние 30 записей
+
+
+@app.route('/api/runs', methods=['GET'])
+def get_runs():
+    """История запусков с замерами по стадиям"""
+    converter = get_converter()
+    limit = request.args.get('limit', 30, type=int)
+    return jsonify(converter.run_history.recent(limit))
+
+
+@app.route('/api/feed-delta', methods=['GET'])
+def get_feed_delta():
+    """Изменения фида по сравнению с прошлой публикацией"""
+    converter = get_converter()
+    if converter.feed_delta is None:
+        return jsonify({'error': 'Фид еще не конвертировался'}), 404
+    return jsonify(converter.feed_delta)
+
+
+def send_feed(feed, download_name=None):
+    """Отдаем фид (PublishedFeed) из памяти: сжатая версия по Accept-Encoding, ETag/304 и Range"""
+    encoding = request.accept_encodings.best_match(
+        [name for name in ('br', 'gzip') if name in feed.bodies])
+    body = feed.bodies[encoding or 'identity']
+
+    response = Response(wrap_file(request.environ, FeedReader(body)),
+                        mimetype='application/xml',
+                        direct_passthrough=True)
+    response.content_length = len(body)
+    response.set_etag(feed.etag(encoding))
+    response.last_modified = feed.modified
+    response.cache_control.no_cache = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if download_name:
+        response.headers.set('Content-Disposition',
+                             'attachment',
+                             filename=download_name)
+    # If-None-Match -> 304, Range -> 206
+    return response.make_conditional(request,
+                                     accept_ranges=True,
+                                     complete_length=len(body))
 
 
 @app.route('/api/download-feed', methods=['GET'])
 def download_feed():
     """Скачать готовый фид"""
-    if os.path.exists(converter.output_file):
-        return send_file(converter.output_file,
-                         as_attachment=True,
+    converter = get_converter()
+    if converter.published_feed:
+        return send_feed(converter.published_feed,
                          download_name='avito_feed.xml')
+    elif converter.published_shards:
+        return jsonify({
+            'error': 'Фид разбит на шарды, ссылки на них - в индексе',
+            'shards_url': f'/feeds/{converter.profile}/shards.json'
+        }), 404
     else:
         return jsonify({'error': 'Файл не найден'}), 404
 
@@ -1551,12 +5476,16 @@ def download_feed():
 @app.route('/api/debug-settings', methods=['GET'])
 def debug_settings():
     """Отладочная информация"""
+    converter = get_converter()
     debug_info = {
         'jk_settings': converter.jk_settings,
         'config': converter.config,
-        'settings_file_exists': os.path.exists(converter.jk_settings_file),
+        'settings_backend': converter.config.get('settings_backend',
+                                                 'sqlite'),
+        'settings_version': converter.jk_settings_version,
+        'settings_file_exists': os.path.exists(converter.settings_store.path),
         'config_file_exists': os.path.exists(converter.config_file),
-        'settings_file_path': os.path.abspath(converter.jk_settings_file),
+        'settings_file_path': os.path.abspath(converter.settings_store.path),
         'current_dir': os.getcwd(),
         'files_in_dir': [f for f in os.listdir('.') if f.endswith('.json')]
     }
@@ -1565,9 +5494,59 @@ def debug_settings():
 
 @app.route('/feed.xml')
 def public_feed():
-    """Публичная ссылка на фид для Авито"""
-    if os.path.exists(converter.output_file):
-        return send_file(converter.output_file, mimetype='application/xml')
+    """Публичная ссылка на фид для Авито
+
+    Без sync(): новую версию от ведущего процесса подхватывает поток
+    согласования (раз в секунду), запрос не делает ни одного stat.
+    """
+    if converter.published_feed:
+        return send_feed(converter.published_feed)
+    else:
+        return 'Feed not found', 404
+
+
+@app.route('/feeds/<profile>.xml')
+def profile_feed(profile):
+    """Публичная ссылка на фид профиля"""
+    profile_converter = profiles.get(profile)
+    if profile_converter and profile_converter.published_feed:
+        return send_feed(profile_converter.published_feed)
+    else:
+        return 'Feed not found', 404
+
+
+@app.route('/feeds/<profile>/shards.json')
+def profile_shards(profile):
+    """Индекс шардов фида профиля со ссылками на них"""
+    profile_converter = profiles.get(profile)
+    if not profile_converter or not profile_converter.shard_index:
+        return jsonify({'error': 'Фид не разбит на шарды'}), 404
+
+    index = profile_converter.shard_index
+    base_url = request.host_url.rstrip('/')
+    return jsonify({
+        'shard_by': index['shard_by'],
+        'generated_at': index['generated_at'],
+        'total': index['total'],
+        'shards': [{
+            'name': entry['name'],
+            'jk': entry['jk'],
+            'ads': entry['ads'],
+            'size': entry['size'],
+            'etag': entry['etag'],
+            'updated_at': entry['generated_at'],
+            'url': f"{base_url}/feeds/{profile}/shards/{entry['name']}.xml"
+        } for entry in index['shards']]
+    })
+
+
+@app.route('/feeds/<profile>/shards/<name>.xml')
+def profile_shard(profile, name):
+    """Публичная ссылка на шард фида профиля"""
+    profile_converter = profiles.get(profile)
+    feed = profile_converter and profile_converter.published_shards.get(name)
+    if feed:
+        return send_feed(feed)
     else:
         return 'Feed not found', 404
 
@@ -0,0 +1,54 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    """Модуль конвертера, импортированный во временном каталоге"""
+    pytest.importorskip('flask')
+    workdir = tmp_path_factory.mktemp('converter')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # Фоновые потоки модуля пишут файлы по относительным путям,
+    # поэтому остаемся в рабочем каталоге до конца сессии
+    try:
+        spec = importlib.util.spec_from_file_location(
+            'main', os.path.join(ROOT, 'main (3).py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['main'] = module
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def feed_url(tmp_path):
+    """Синтетический фид Яндекса на диске (file://)"""
+    from benchmark import generate_feed
+    path = tmp_path / 'feed.xml'
+    generate_feed(str(path), 300, jk_count=5, images_per_offer=2)
+    return path.as_uri()
+
+
+@pytest.fixture
+def make_converter(main, tmp_path):
+    """Конвертер отдельного профиля в своем каталоге"""
+    def make(name='test', jk_settings=None, **config):
+        base_dir = tmp_path / name
+        base_dir.mkdir()
+        if jk_settings is not None:
+            with open(base_dir / 'jk_settings.json', 'w',
+                      encoding='utf-8') as f:
+                json.dump(jk_settings, f, ensure_ascii=False)
+        converter = main.AutoFeedConverter(name, str(base_dir))
+        converter.update_config(config)
+        return converter
+    return make
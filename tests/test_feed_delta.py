@@ -0,0 +1,23 @@
+FRAGMENT = ('<Ad>\n<Id>1</Id>\n<DateBegin>{date}</DateBegin>\n'
+            '<Price>100</Price>\n</Ad>\n')
+
+
+def publish(main, db_file, date, jk_name):
+    delta = main.FeedDelta(db_file, date, {'shard_by': 'jk'})
+    list(delta.track([(FRAGMENT.format(date=date), jk_name)]))
+    unchanged = delta.unchanged()
+    delta.commit()
+    delta.close()
+    return unchanged
+
+
+def test_unchanged_ignores_date_begin(main, tmp_path):
+    db_file = str(tmp_path / 'delta.sqlite')
+    assert not publish(main, db_file, '2024-01-01', 'ЖК А')
+    assert publish(main, db_file, '2024-01-02', 'ЖК А')
+
+
+def test_jk_change_is_a_change(main, tmp_path):
+    db_file = str(tmp_path / 'delta.sqlite')
+    publish(main, db_file, '2024-01-01', 'ЖК А')
+    assert not publish(main, db_file, '2024-01-01', 'ЖК Б')
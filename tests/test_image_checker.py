@@ -0,0 +1,97 @@
+import pytest
+
+from benchmark import StubImageServer
+
+
+@pytest.fixture
+def stub():
+    with StubImageServer(delay=1.0) as server:
+        yield server
+
+
+def make_checker(main, tmp_path):
+    return main.ImageChecker(str(tmp_path / 'images.db'), ttl=3600,
+                             workers=4, timeout=0.3)
+
+
+def test_dead_images_are_dropped(main, stub, tmp_path):
+    urls = [stub.url(name) for name in
+            ('ok.jpg', 'missing.jpg', 'error.jpg', 'slow.jpg', 'nohead.jpg')]
+    checker = make_checker(main, tmp_path)
+    try:
+        dead = checker.check(urls)
+    finally:
+        checker.close()
+
+    # 404 - мертвая; 5xx и таймаут - оставляем; без HEAD - проверка GET
+    assert dead == {stub.url('missing.jpg')}
+    assert checker.stats['checked'] == 5
+    assert checker.stats['failed'] == 2
+    assert ('GET', '/nohead.jpg') in stub.requests
+
+
+def test_results_are_cached_for_ttl(main, stub, tmp_path):
+    urls = [stub.url('ok.jpg'), stub.url('missing.jpg'),
+            stub.url('error.jpg')]
+    checker = make_checker(main, tmp_path)
+    checker.check(urls)
+    checker.close()
+    stub.requests.clear()
+
+    checker = make_checker(main, tmp_path)
+    try:
+        dead = checker.check(urls)
+    finally:
+        checker.close()
+
+    assert dead == {stub.url('missing.jpg')}
+    assert checker.stats['cached'] == 2
+    # Неудачная проверка не кэшируется и повторяется
+    assert stub.requests == [('HEAD', '/error.jpg')]
+
+
+def test_filter_offers_drops_dead_images(main, stub, tmp_path):
+    fields = main.OfferFields('1', '1')
+    fields.images = (stub.url('ok.jpg'), stub.url('missing.jpg'))
+    checker = make_checker(main, tmp_path)
+    try:
+        [filtered] = checker.filter_offers([fields])
+    finally:
+        checker.close()
+
+    assert filtered.images == (stub.url('ok.jpg'), )
+    assert fields.images == (stub.url('ok.jpg'), stub.url('missing.jpg'))
+    assert checker.stats['dropped'] == 1
+
+
+def test_expired_results_are_rechecked(main, stub, tmp_path):
+    url = stub.url('missing.jpg')
+    checker = make_checker(main, tmp_path)
+    checker.check([url])
+    checker.close()
+    stub.requests.clear()
+
+    checker = main.ImageChecker(str(tmp_path / 'images.db'), ttl=0,
+                                timeout=0.3)
+    try:
+        assert checker.check([url]) == {url}
+    finally:
+        checker.close()
+    assert checker.stats['cached'] == 0
+    assert stub.requests == [('HEAD', '/missing.jpg')]
+
+
+def test_known_urls_are_bounded(main, stub, tmp_path):
+    urls = [stub.url(f'ok{i}.jpg') for i in range(5)]
+    checker = main.ImageChecker(str(tmp_path / 'images.db'), timeout=0.3,
+                                known_limit=2)
+    try:
+        assert checker.check(urls + [stub.url('missing.jpg')]) == {
+            stub.url('missing.jpg')}
+        assert len(checker.known) == 2
+        stub.requests.clear()
+        # Вытесненные из памяти ссылки берутся из кэша SQLite
+        assert checker.check(urls) == frozenset()
+    finally:
+        checker.close()
+    assert stub.requests == []
@@ -0,0 +1,36 @@
+from benchmark import generate_jk_settings
+
+
+def feed_body(converter):
+    return bytes(converter.published_feed.bodies['identity'])
+
+
+def test_second_run_reuses_cached_offers(make_converter, feed_url):
+    converter = make_converter(yandex_url=feed_url, incremental=True,
+                               jk_settings=generate_jk_settings(5))
+    first = converter.convert_feed(manual=True)
+    second = converter.convert_feed(manual=True)
+
+    assert first['reconverted'] == first['total'] == 300
+    assert second['reused'] == second['total'] == 300
+    assert second['reconverted'] == 0
+    assert second['delta']['published'] is False
+
+
+def test_jk_change_reconverts_only_its_offers(make_converter, feed_url):
+    settings = generate_jk_settings(5, configured_ratio=1)
+    converter = make_converter(yandex_url=feed_url, incremental=True,
+                               jk_settings=settings)
+    converter.convert_feed(manual=True)
+
+    converter.update_jk_settings('ЖК Квартал 0', {'price_modifier': '+7%'})
+    stats = converter.convert_feed(manual=True)
+    assert 0 < stats['reconverted'] < stats['total']
+    assert stats['reused'] + stats['reconverted'] == stats['total']
+
+    # Результат совпадает с полной конвертацией с теми же настройками
+    settings['ЖК Квартал 0']['price_modifier'] = '+7%'
+    full = make_converter('full', yandex_url=feed_url, incremental=False,
+                          jk_settings=settings)
+    full.convert_feed(manual=True)
+    assert feed_body(converter) == feed_body(full)
@@ -0,0 +1,67 @@
+import pytest
+
+
+@pytest.mark.parametrize('template, message', [
+    ('{jk_name[0]}', 'индексы и атрибуты'),
+    ('{jk_name.upper}', 'индексы и атрибуты'),
+    ('{price[0]}', 'индексы и атрибуты'),
+    ('{}', 'без имени'),
+    ('{metro}', 'неизвестная переменная {metro}'),
+])
+def test_invalid_description_is_compile_error(main, template, message):
+    compiled = main.CompiledJkSettings.compile(
+        'ЖК Тест', {'description': template, 'development_id': '1'})
+    assert not compiled.has_description()
+    assert len(compiled.errors) == 1
+    assert message in compiled.errors[0]
+
+
+def test_description_parts(main):
+    compiled = main.CompiledJkSettings.compile(
+        'ЖК Тест', {'description': '{jk_name}: {rooms} комн.'})
+    assert compiled.errors == ()
+    assert compiled.description_parts == (
+        ('ЖК Тест', None), (': ', None), ('', 'rooms'), (' комн.', None))
+
+
+def test_non_string_values_are_coerced(main):
+    compiled = main.CompiledJkSettings.compile(
+        'ЖК Тест', {'price_modifier': 5, 'description': 7,
+                    'development_id': 1})
+    assert compiled.errors == ()
+    assert compiled.price_rule == ('absolute', 5.0, '5')
+    assert compiled.description_parts == (('7', None), )
+
+
+def test_invalid_photos_are_compile_error(main):
+    compiled = main.CompiledJkSettings.compile('ЖК Тест', {'photos': 5})
+    assert compiled.errors == ('Фото должны быть списком ссылок', )
+
+
+def test_update_replaces_dicts(main):
+    converter = main.converter
+    settings, compiled = converter.jk_settings, converter.compiled_jk_settings
+    converter.update_jk_settings('ЖК Обновление', {'development_id': '7'})
+
+    assert converter.jk_settings is not settings
+    assert converter.compiled_jk_settings is not compiled
+    assert 'ЖК Обновление' not in compiled
+    assert (converter.compiled_jk_settings['ЖК Обновление']
+            .new_development_id == '7')
+
+
+def test_conversion_reuses_compiled_settings(main, make_converter, feed_url,
+                                             monkeypatch):
+    from benchmark import generate_jk_settings
+    converter = make_converter(yandex_url=feed_url, incremental=False,
+                               jk_settings=generate_jk_settings(
+                                   5, configured_ratio=1))
+    calls = []
+    compile_settings = main.CompiledJkSettings.compile
+    monkeypatch.setattr(
+        main.CompiledJkSettings, 'compile',
+        lambda *args: calls.append(args) or compile_settings(*args))
+
+    stats = converter.convert_feed(manual=True)
+    assert stats['with_custom'] > 0
+    assert calls == []
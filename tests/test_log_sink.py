@@ -0,0 +1,57 @@
+import json
+
+
+def make_sink(main, path, **kwargs):
+    return main.LogSink(str(path), flush_interval=3600, **kwargs)
+
+
+def entry(number):
+    return {'message': f'запись {number}', 'level': 'info'}
+
+
+def test_reload_reads_only_new_lines(main, tmp_path):
+    path = tmp_path / 'log.jsonl'
+    writer = make_sink(main, path)
+    reader = make_sink(main, path)
+
+    writer.add(entry(1))
+    assert writer.recent(10) == [entry(1)]
+    writer.flush()
+    writer.reload()
+    assert writer.recent(10) == [entry(1)]
+
+    reader.reload()
+    assert reader.recent(10) == [entry(1)]
+    offset = reader.offset
+
+    writer.add(entry(2))
+    writer.flush()
+    reader.reload()
+    reader.reload()
+    assert reader.recent(10) == [entry(1), entry(2)]
+    assert reader.offset > offset
+
+
+def test_partial_line_is_read_later(main, tmp_path):
+    path = tmp_path / 'log.jsonl'
+    line = json.dumps(entry(1), ensure_ascii=False)
+    path.write_text(line[:5], encoding='utf-8')
+    reader = make_sink(main, path)
+    assert reader.recent(10) == []
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line[5:] + '\n')
+    reader.reload()
+    assert reader.recent(10) == [entry(1)]
+
+
+def test_rotation_starts_new_file(main, tmp_path):
+    path = tmp_path / 'log.jsonl'
+    sink = make_sink(main, path, capacity=5, max_bytes=1)
+    sink.add(entry(1))
+    sink.flush()
+    assert (tmp_path / 'log.jsonl.1').exists()
+    sink.add(entry(2))
+    sink.flush()
+    sink.reload()
+    assert sink.recent(10) == [entry(1), entry(2)]
@@ -0,0 +1,20 @@
+import threading
+
+
+def test_run_log_level_is_per_thread(main, monkeypatch):
+    converter = main.converter
+    monkeypatch.setitem(converter.config, 'log_level', 'warning')
+    assert not converter.log_enabled('info')
+
+    converter.run_local.log_level = 'debug'
+    try:
+        assert converter.log_enabled('debug')
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(converter.log_enabled('info')))
+        thread.start()
+        thread.join()
+        assert other == [False]
+    finally:
+        converter.run_local.log_level = None
+    assert converter.run_log_level() == 'warning'
@@ -0,0 +1,37 @@
+from benchmark import generate_jk_settings
+
+
+def test_process_pool_matches_serial_output(make_converter, feed_url,
+                                            monkeypatch):
+    settings = generate_jk_settings(5)
+    serial = make_converter('serial', yandex_url=feed_url,
+                            incremental=False, jk_settings=settings)
+    parallel = make_converter('parallel', yandex_url=feed_url,
+                              incremental=False, workers=2, chunk_size=37,
+                              jk_settings=settings)
+
+    pools = []
+    iter_parallel_results = parallel.iter_parallel_results
+    monkeypatch.setattr(
+        parallel, 'iter_parallel_results',
+        lambda *args: pools.append(args[1]) or iter_parallel_results(*args))
+
+    serial_stats = serial.convert_feed(manual=True)
+    parallel_stats = parallel.convert_feed(manual=True)
+
+    assert pools == [2]
+    assert parallel_stats['total'] == serial_stats['total'] == 300
+    assert parallel_stats['errors'] == serial_stats['errors'] == 0
+    assert (bytes(parallel.published_feed.bodies['identity']) ==
+            bytes(serial.published_feed.bodies['identity']))
+
+
+def test_process_pool_with_offer_cache(make_converter, feed_url):
+    converter = make_converter(yandex_url=feed_url, incremental=True,
+                               workers=2, chunk_size=50)
+    converter.convert_feed(manual=True)
+    first = bytes(converter.published_feed.bodies['identity'])
+
+    stats = converter.convert_feed(manual=True)
+    assert stats['reused'] == stats['total'] == 300
+    assert bytes(converter.published_feed.bodies['identity']) == first
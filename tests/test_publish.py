@@ -0,0 +1,55 @@
+import json
+import os
+
+from benchmark import generate_feed
+
+
+def tmp_files(converter):
+    base_dir = os.path.dirname(converter.output_file)
+    return [name for name in os.listdir(base_dir) if name.endswith('.tmp')]
+
+
+def test_old_version_survives_republish(make_converter, feed_url, tmp_path):
+    converter = make_converter(yandex_url=feed_url)
+    converter.convert_feed(manual=True)
+    old_feed = converter.published_feed
+    old_body = bytes(old_feed.bodies['identity'])
+
+    other = tmp_path / 'other.xml'
+    generate_feed(str(other), 200, jk_count=5, seed=2)
+    converter.update_config({'yandex_url': other.as_uri()})
+    converter.convert_feed(manual=True)
+
+    new_feed = converter.published_feed
+    assert new_feed is not old_feed
+    assert new_feed.etag() != old_feed.etag()
+    # Отображение прежней версии по-прежнему отдает ее содержимое
+    assert bytes(old_feed.bodies['identity']) == old_body
+    with open(converter.output_file, 'rb') as f:
+        assert f.read() == bytes(new_feed.bodies['identity'])
+    with open(converter.feed_meta_file, encoding='utf-8') as f:
+        assert json.load(f)['etag'] == new_feed.etag()
+    assert tmp_files(converter) == []
+
+    # Другой процесс поднимает ту же версию с диска
+    converter.load_published_feed()
+    assert converter.published_feed.etag() == new_feed.etag()
+
+
+def test_failed_run_keeps_published_feed(make_converter, feed_url, tmp_path):
+    converter = make_converter(yandex_url=feed_url)
+    converter.convert_feed(manual=True)
+    published = converter.published_feed
+    with open(converter.output_file, 'rb') as f:
+        body = f.read()
+
+    broken = tmp_path / 'broken.xml'
+    with open(feed_url[len('file://'):], 'rb') as f:
+        broken.write_bytes(f.read()[:200000])
+    converter.update_config({'yandex_url': broken.as_uri()})
+    assert not converter.convert_feed(manual=True)
+
+    assert converter.published_feed is published
+    with open(converter.output_file, 'rb') as f:
+        assert f.read() == body
+    assert tmp_files(converter) == []
@@ -0,0 +1,24 @@
+def test_conversion_records_stages(main, make_converter, feed_url):
+    converter = make_converter(yandex_url=feed_url)
+    converter.convert_feed(manual=True)
+
+    [run] = converter.run_history.recent(1)
+    assert run['success'] and run['manual']
+    assert run['stats']['total'] == 300
+    for stage in ('fetch', 'parse', 'extract', 'convert', 'write'):
+        assert run['stages'][stage]['wall'] >= 0
+    assert sum(stage['wall'] for stage in run['stages'].values()) <= (
+        run['wall'] + 0.01)
+
+    # История переживает перезапуск
+    history = main.RunHistory(converter.run_history.path)
+    assert history.recent(1) == [run]
+
+
+def test_history_is_bounded(main, tmp_path):
+    history = main.RunHistory(str(tmp_path / 'runs.json'), limit=3)
+    for number in range(5):
+        history.add({'number': number})
+    assert [run['number'] for run in history.recent(10)] == [4, 3, 2]
+    reloaded = main.RunHistory(history.path, limit=3)
+    assert reloaded.recent(10) == history.recent(10)
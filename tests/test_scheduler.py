@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+
+class FakeClock:
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def run_for(scheduler, clock, hours):
+    """Гоняем планировщик по фиктивным часам, возвращаем время запусков"""
+    end = clock.now + timedelta(hours=hours)
+    while clock.now < end:
+        timeout = scheduler.step()
+        clock.now += timedelta(seconds=timeout or 1)
+
+
+def make_scheduler(main, config, start):
+    clock = FakeClock(start)
+    runs = []
+
+    def job():
+        runs.append(clock.now)
+        config['last_update'] = clock.now.isoformat()
+
+    return main.Scheduler(lambda: config, job, clock=clock), clock, runs
+
+
+def test_daily_runs_once_per_slot(main):
+    for jitter in (0, 60):
+        config = {'auto_update': True, 'update_times': ['06:00'],
+                  'update_jitter': jitter}
+        scheduler, clock, runs = make_scheduler(
+            main, config, datetime(2024, 1, 1, 12, 0))
+        run_for(scheduler, clock, 72)
+        assert len(runs) == 3
+        for run in runs:
+            assert run.hour == 6 and run.minute <= 1
+
+
+def test_interval_runs_with_jitter(main):
+    config = {'auto_update': True, 'update_interval': 60,
+              'update_jitter': 30}
+    scheduler, clock, runs = make_scheduler(
+        main, config, datetime(2024, 1, 1, 12, 0))
+    run_for(scheduler, clock, 6)
+    assert 6 <= len(runs) <= 7
+    for previous, run in zip(runs, runs[1:]):
+        gap = (run - previous).total_seconds()
+        assert 3600 <= gap <= 3600 + 31
+
+
+def test_reschedule_keeps_due_slot(main, monkeypatch):
+    monkeypatch.setattr(main.random, 'uniform', lambda low, high: 300)
+    config = {'auto_update': True, 'update_times': ['06:00'],
+              'update_jitter': 600}
+    scheduler, clock, runs = make_scheduler(
+        main, config, datetime(2024, 1, 1, 5, 59))
+    scheduler.step()
+    assert scheduler.next_run == datetime(2024, 1, 1, 6, 5)
+
+    # Настройки сохранены, когда срок наступил, но задержка еще идет
+    clock.now = datetime(2024, 1, 1, 6, 0, 1)
+    scheduler.reschedule()
+    scheduler.step()
+    assert runs == []
+    assert scheduler.next_run == datetime(2024, 1, 1, 6, 5)
+
+    run_for(scheduler, clock, 1)
+    assert runs == [datetime(2024, 1, 1, 6, 5)]
+
+
+def test_disabled_never_runs(main):
+    config = {'auto_update': False, 'update_times': ['06:00']}
+    scheduler, clock, runs = make_scheduler(
+        main, config, datetime(2024, 1, 1, 0, 0))
+    run_for(scheduler, clock, 48)
+    assert runs == []
+    assert scheduler.next_run is None
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+
+@pytest.fixture
+def feed(make_converter, feed_url):
+    converter = make_converter(yandex_url=feed_url)
+    converter.convert_feed(manual=True)
+    return converter.published_feed
+
+
+def send(main, feed, headers=None):
+    """Ответ и тело так, как их отдаст WSGI-сервер"""
+    with main.app.test_request_context('/feed.xml',
+                                       headers=headers or {}) as context:
+        response = main.send_feed(feed)
+        body = b''.join(response.get_app_iter(context.request.environ))
+        return response, body
+
+
+def test_plain_and_gzip_bodies_match(main, feed):
+    response, plain = send(main, feed)
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert plain == bytes(feed.bodies['identity'])
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+    response, body = send(main, feed, {'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == plain
+    assert response.get_etag()[0] == feed.etag('gzip')
+
+
+def test_if_none_match_returns_304(main, feed):
+    response, body = send(main, feed,
+                          {'If-None-Match': f'"{feed.etag()}"'})
+    assert response.status_code == 304
+    assert body == b''
+
+    response, _ = send(main, feed, {'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+
+
+def test_range_request(main, feed):
+    plain = bytes(feed.bodies['identity'])
+    response, body = send(main, feed, {'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert body == plain[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(plain)}'
@@ -0,0 +1,22 @@
+def fragments(date, price=100):
+    return [(f'<Ad>\n<Id>{i}</Id>\n<DateBegin>{date}</DateBegin>\n'
+             f'<Price>{price}</Price>\n</Ad>', 'ЖК А') for i in range(3)]
+
+
+def test_date_begin_does_not_rewrite_shards(main, monkeypatch):
+    converter = main.converter
+    monkeypatch.setitem(converter.config, 'shard_by', 'size')
+    monkeypatch.setitem(converter.config, 'shard_size', 2)
+
+    index, written = converter.write_shards(iter(fragments('2024-01-01')))
+    converter.publish_shards(index, written)
+    assert sorted(written) == ['part-0001', 'part-0002']
+
+    index, written = converter.write_shards(iter(fragments('2024-01-02')))
+    converter.publish_shards(index, written)
+    assert written == {}
+
+    index, written = converter.write_shards(
+        iter(fragments('2024-01-02', price=200)))
+    converter.publish_shards(index, written)
+    assert sorted(written) == ['part-0001', 'part-0002']
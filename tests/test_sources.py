@@ -0,0 +1,33 @@
+import io
+
+REALTY_NS = 'http://webmaster.yandex.ru/schemas/feed/realty/2010-06'
+
+
+def make_feed(main, offers):
+    body = (f'<realty-feed xmlns="{REALTY_NS}">' + ''.join(offers) +
+            '</realty-feed>').encode('utf-8')
+    stats = {'fetch_time': 0.0, 'bytes_read': 0, 'bytes_total': len(body),
+             'bytes_downloaded': 0}
+    return main.FeedStream(io.BytesIO(body), stats)
+
+
+def offer(attributes, price):
+    return (f'<offer {attributes}><price><value>{price}</value></price>'
+            '</offer>')
+
+
+def test_multi_source_dedup_uses_real_ids(main, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    feeds = [
+        make_feed(main, [offer('internal-id="1"', 100), offer('', 200)]),
+        make_feed(main, [offer('internal-id="1"', 300), offer('', 400),
+                         offer('id="2"', 500)]),
+    ]
+    stats = {'total': 0, 'errors': 0, 'duplicates': 0}
+    records = list(main.converter.iter_source_fields(feeds, stats))
+
+    assert [record.price for record in records] == ['100', '200', '400',
+                                                    '500']
+    assert [record.source_id for record in records] == ['1', None, None,
+                                                        '2']
+    assert stats['duplicates'] == 1
@@ -0,0 +1,37 @@
+import io
+
+REALTY_NS = 'http://webmaster.yandex.ru/schemas/feed/realty/2010-06'
+
+
+class CountingStream(io.BytesIO):
+    """Поток, запоминающий, сколько байт прочитано"""
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read = self.tell()
+        return data
+
+
+def test_offers_are_streamed_and_released(main):
+    offers = ''.join(f'<offer internal-id="{i}"><price><value>{i}</value>'
+                     '</price></offer>' for i in range(5000))
+    stream = CountingStream(
+        f'<realty-feed xmlns="{REALTY_NS}">{offers}</realty-feed>'
+        .encode('utf-8'))
+    converter = main.OfferConverter()
+
+    seen = []
+    previous = None
+    for offer in converter.iter_offers(stream):
+        if previous is None:
+            # Первое объявление отдается до чтения всего фида
+            assert stream.bytes_read < len(stream.getvalue())
+        else:
+            # Обработанное объявление очищено и не держит поддерево
+            assert len(previous) == 0
+        seen.append(converter.extract_offer_fields(offer).price)
+        previous = offer
+
+    assert seen == [str(i) for i in range(5000)]
@@ -0,0 +1,64 @@
+import http.server
+import ssl
+import threading
+from contextlib import closing
+
+import pytest
+
+
+class ProxyHandler(http.server.BaseHTTPRequestHandler):
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        body = b'<realty-feed/>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def proxy():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ProxyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ProxyHandler.paths = []
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_proxy_from_environment(main, proxy, monkeypatch):
+    monkeypatch.setenv('http_proxy', proxy)
+    monkeypatch.delenv('no_proxy', raising=False)
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    client = main.UpstreamClient(retries=0)
+    with closing(client.open(
+            'http://feeds.example.invalid/feed.xml?x=1')) as response:
+        assert response.read() == b'<realty-feed/>'
+    assert ProxyHandler.paths == ['http://feeds.example.invalid/feed.xml?x=1']
+
+
+def test_no_proxy_bypasses_proxy(main, monkeypatch):
+    monkeypatch.setenv('http_proxy', 'http://proxy.example.invalid:3128')
+    monkeypatch.setenv('no_proxy', 'feeds.example.com')
+    parts = main.urllib.parse.urlsplit('http://feeds.example.com/feed.xml')
+    assert main.UpstreamClient.proxy_for(parts) is None
+
+
+def test_certificate_errors_are_not_retried(main, monkeypatch):
+    client = main.UpstreamClient(retries=3, backoff=0)
+    calls = []
+
+    def follow(url, headers, stats):
+        calls.append(url)
+        raise ssl.SSLCertVerificationError('certificate verify failed')
+
+    monkeypatch.setattr(client, '_follow', follow)
+    with pytest.raises(ssl.SSLCertVerificationError):
+        client.open('https://feeds.example.invalid/feed.xml')
+    assert len(calls) == 1